@@ -4,26 +4,64 @@ Flask application that provides security risk assessment based on location and t
 """
 import json
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-from dotenv import load_dotenv
 
 # Import services
-from services.risk_calculator import calculate_risk
-from services.location_service import get_location_context
-from services.email_service_simple import send_red_alert_email
-from services.llm_service import suggest_safe_locations
-from services.network_service import get_user_ip
+from services.circuit_breaker import get_circuit_breaker_stats
+from services.threat_prefetcher import get_threat_prefetch_stats, start_threat_prefetcher
+from services.threat_service import get_threat_cache_stats
+from services.risk_tiles import get_risk_tile, get_risk_tile_cache_stats
+from services.risk_calculator import assess_risk, assess_risk_batch, get_risk_rules, stream_risk
+from services.location_service import geocode_home_address, get_geocode_cache_stats, start_whitelist_watcher
+from services.alert_queue import (
+    enqueue_configuration_code, enqueue_red_alert, get_alert_queue_stats, start_alert_queue,
+)
+from services.llm_service import get_safe_locations_cache_stats, suggest_safe_locations
+from services.http_client import get_upstream_latency_stats
+from services.metrics import render_prometheus
+from services.network_service import get_ip_cache_stats, get_user_ip
+from services.request_validation import (
+    parse_batch_records, parse_confirmation, parse_coordinates, parse_session, parse_user_config,
+    parse_user_credentials,
+)
+from services.risk_sessions import get_risk_session, get_risk_session_stats
+from services.tracing import finish_trace, span, start_trace
+from services.user_store import (
+    authenticate_user, confirm_user_configuration, get_user_index_cache_stats, normalize_user_id,
+    request_user_configuration,
+)
 
 WHITELISTED_LOCATIONS_FILENAME = '../database/whitelisted_locations'
 
-# Load environment variables
-load_dotenv()
-
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Compile the risk rules up front so a broken rules file fails at startup
+get_risk_rules()
+
+# Load the whitelist index up front and pick up edits to the file in the background
+start_whitelist_watcher()
+
+# Keep threat intel for recently active zipcodes fresh ahead of user requests
+start_threat_prefetcher()
+
+# Send Red Zone alert emails in the background
+start_alert_queue()
+
+@app.before_request
+def start_request_trace():
+    g.trace = start_trace(request.endpoint or "unmatched")
+
+@app.after_request
+def finish_request_trace(response):
+    # Streamed responses are timed up to their first byte
+    trace = g.pop('trace', None)
+    if trace is not None:
+        finish_trace(*trace, response.status_code)
+    return response
+
 @app.route('/')
 def health_check():
     """Health check endpoint."""
@@ -33,6 +71,33 @@ def health_check():
         "version": "1.0.0"
     })
 
+@app.route('/api/stats')
+def stats():
+    """Cache statistics for the backend services."""
+    return jsonify({
+        "geocodeCache": get_geocode_cache_stats(),
+        "ipCache": get_ip_cache_stats(),
+        "upstreamLatency": get_upstream_latency_stats(),
+        "circuitBreakers": get_circuit_breaker_stats(),
+        "threatCache": get_threat_cache_stats(),
+        "threatPrefetch": get_threat_prefetch_stats(),
+        "safeLocationsCache": get_safe_locations_cache_stats(),
+        "riskTileCache": get_risk_tile_cache_stats(),
+        "userIndexCache": get_user_index_cache_stats(),
+        "alertQueue": get_alert_queue_stats(),
+        "riskSessions": get_risk_session_stats()
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Latency histograms, counters and cache statistics in the Prometheus text format."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+def authenticated_user(data):
+    """The userId of a check-security payload, if it carries the userToken last issued to that user."""
+    user_id, token = parse_user_credentials(data)
+    return authenticate_user(user_id, token) if user_id is not None else None
+
 @app.route('/api/check-security', methods=['POST'])
 def check_security():
     """
@@ -42,46 +107,47 @@ def check_security():
     {
         "latitude": 40.7128,
         "longitude": -74.0060,
+        "userId": "user@example.com",  (optional, with userToken: checks against their saved safe locations)
+        "userToken": "...",  (the token /api/configure-user or /api/configure-user/confirm returned)
+        "sessionId": "...",  (optional: reuses the lookups of the session's last check; "new" starts one)
+        "revision": "..."  (optional: revision of the last response received for the session)
     }
+
+    With a sessionId, only the fields that changed since revision are returned,
+    along with the sessionId to send next (issued by the server), the new
+    revision and whether the response is full.
     """
     try:
         i = 0
-        # Get request data
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({"error": "No JSON data provided"}), 400
+        with span('parse_request'):
+            # Get request data
+            data = request.get_json(silent=True)
 
-        # Extract required fields
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        ip = get_user_ip(request)
+            # Extract and validate required fields
+            coordinates, error = parse_coordinates(data)
+        if error:
+            return jsonify({"error": error}), 400
 
-        # Validate required fields
-        if latitude is None or longitude is None:
-            return jsonify({
-                "error": "Missing required fields: latitude and longitude"
-            }), 400
-
-        try:
-            latitude = float(latitude)
-            longitude = float(longitude)
-        except (ValueError, TypeError):
-            return jsonify({
-                "error": "Invalid latitude or longitude format"
-            }), 400
+        latitude, longitude = coordinates
+        ip = get_user_ip(request)
 
-        # Step 1: Get location context
-        location_context = get_location_context(latitude, longitude)
-        zipcode = location_context['postcode']
+        # Step 1-2: Look up location context and network concurrently, then
+        # calculate risk score using weighted scoring engine
+        user_id = authenticated_user(data)
+        session_id, revision = parse_session(data)
+        if session_id:
+            session = get_risk_session(session_id, ip, user_id)
+            risk_assessment = session.assess(latitude, longitude, ip, user_id)
+        else:
+            risk_assessment = assess_risk(latitude, longitude, ip, user_id)
+        enqueue_red_alert(risk_assessment, user_id, latitude, longitude)
 
-        # Step 2: Calculate risk score using weighted scoring engine
-        risk_assessment = calculate_risk(latitude, longitude, ip, zipcode)
+        # Step 3: Suggest safe locations, if already cached for this area
+        suggested_locations = suggest_safe_locations(latitude, longitude)
+        risk_assessment["suggestedLocations"] = suggested_locations.get("suggestedLocations", [])
 
-        # Step 3: Generate recommendations (AI-powered or static fallback)
-        # suggested_locations = suggest_safe_locations(latitude, longitude)
-        # risk_assessment["suggestedLocations"] = suggested_locations["suggestedLocations"]
-        
+        if session_id:
+            return jsonify(session.delta(risk_assessment, revision))
         return jsonify(risk_assessment)
     
     except Exception as e:
@@ -92,14 +158,174 @@ def check_security():
             "details": str(e) if app.debug else None
         }), 500
     
+@app.route('/api/check-security/stream', methods=['POST'])
+def check_security_stream():
+    """
+    Streaming variant of /api/check-security.
+
+    Takes the same JSON payload and responds with newline-delimited JSON events:
+    one "factor" event per risk factor as soon as it is scored (with the running
+    score and zone), a "suggestedLocations" event, and a final "summary" event
+    holding the same assessment /api/check-security returns.
+    """
+    with span('parse_request'):
+        data = request.get_json(silent=True)
+        coordinates, error = parse_coordinates(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    latitude, longitude = coordinates
+    ip = get_user_ip(request)
+    user_id = authenticated_user(data)
+
+    def generate():
+        try:
+            for event in stream_risk(latitude, longitude, ip, user_id):
+                if event["type"] == "summary":
+                    enqueue_red_alert(event, user_id, latitude, longitude)
+                    suggested_locations = suggest_safe_locations(latitude, longitude).get("suggestedLocations", [])
+                    yield json.dumps({"type": "suggestedLocations", "suggestedLocations": suggested_locations}) + "\n"
+                    event["suggestedLocations"] = suggested_locations
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            print(f"Error in check_security_stream endpoint: {str(e)}")
+            yield json.dumps({"type": "error", "error": "Internal server error occurred during security check"}) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/check-security/batch', methods=['POST'])
+def check_security_batch():
+    """
+    Batch security assessment for a fleet of devices.
+
+    Expected JSON payload:
+    {
+        "records": [
+            {"latitude": 40.7128, "longitude": -74.0060, "ip": "203.0.113.7"},
+            ...
+        ]
+    }
+
+    Returns one result per record, in input order: the same assessment as
+    /api/check-security (without suggested locations), or {"error": ...} for a
+    record that failed validation.
+    """
+    try:
+        with span('parse_request'):
+            records, error = parse_batch_records(request.get_json(silent=True))
+        if error:
+            return jsonify({"error": error}), 400
+
+        assessments = iter(assess_risk_batch([(*coordinates, ip) for coordinates, ip, error in records if not error]))
+        results = [{"error": error} if error else next(assessments) for _, _, error in records]
+        return jsonify({"results": results})
+
+    except Exception as e:
+        print(f"Error in check_security_batch endpoint: {str(e)}")
+        return jsonify({
+            "error": "Internal server error occurred during security check",
+            "details": str(e) if app.debug else None
+        }), 500
+
+@app.route('/api/risk-tiles/<int:z>/<int:x>/<int:y>')
+def risk_tile(z, x, y):
+    """
+    Location risk grid for a z/x/y web-mercator map tile.
+
+    Returns distance to the closest safe location and cached threat counts for a
+    grid of points over the tile, so the map can shade it without point queries.
+    """
+    try:
+        return jsonify(get_risk_tile(z, x, y))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
 @app.route('/api/configure-user', methods=['POST'])
 def configure_user():
+    """
+    Save a user's alert email and home addresses, which become their safe locations.
+
+    Expected JSON payload:
+    {
+        "userId": "user@example.com",  (optional, defaults to 2faEmail)
+        "2faEmail": "user@example.com",
+        "homeAddresses": ["12|Main Street|Lynchburg|VA|24502", ...]
+    }
+
+    Addresses are geocoded once here; a "latitude|longitude" entry is used as is.
+    A configuration that would replace an existing user's isn't saved yet: a
+    confirmation code goes to their current 2faEmail, and the change is applied
+    once it is posted to /api/configure-user/confirm (202 response). A saved
+    configuration returns the userToken that checks for the user must send.
+    """
     try:
-        return jsonify({"status": "success", "message": "Configuration saved."}), 200
+        with span('parse_request'):
+            data = request.get_json(silent=True)
+            config, error = parse_user_config(data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        user_id, alert_email, addresses = config
+        safe_locations = []
+        for address in addresses:
+            coordinates = geocode_home_address(address)
+            if coordinates is None:
+                return jsonify({"error": f"Could not find address: {address}"}), 400
+            safe_locations.append((address, *coordinates))
+
+        code, owner_email, token = request_user_configuration(user_id, alert_email, safe_locations)
+        if code is not None:
+            if not enqueue_configuration_code(owner_email, normalize_user_id(user_id), code):
+                return jsonify({"error": "Could not send the confirmation code, try again later."}), 503
+            return jsonify({
+                "status": "pending",
+                "message": "A confirmation code is on its way to the current 2faEmail.",
+                "userId": normalize_user_id(user_id)
+            }), 202
+        return jsonify({
+            "status": "success",
+            "message": "Configuration saved.",
+            "userId": normalize_user_id(user_id),
+            "userToken": token
+        }), 200
 
     except Exception as e:
         print(f"An error occurred in /api/configure-user: {e}")
-        return jsonify({"error": "An internal server error occurred."}), 200
+        return jsonify({"error": "An internal server error occurred."}), 500
+
+@app.route('/api/configure-user/confirm', methods=['POST'])
+def confirm_user_config():
+    """
+    Apply a configuration change held by /api/configure-user.
+
+    Expected JSON payload:
+    {
+        "userId": "user@example.com",
+        "confirmationCode": "123456"
+    }
+
+    Returns the user's new userToken; the ones issued before stop working.
+    """
+    try:
+        with span('parse_request'):
+            confirmation, error = parse_confirmation(request.get_json(silent=True))
+        if error:
+            return jsonify({"error": error}), 400
+
+        user_id, code = confirmation
+        token = confirm_user_configuration(user_id, code)
+        if token is None:
+            return jsonify({"error": "Invalid or expired confirmation code"}), 403
+        return jsonify({
+            "status": "success",
+            "message": "Configuration saved.",
+            "userId": normalize_user_id(user_id),
+            "userToken": token
+        }), 200
+
+    except Exception as e:
+        print(f"An error occurred in /api/configure-user/confirm: {e}")
+        return jsonify({"error": "An internal server error occurred."}), 500
 
 # @app.route('/api/test-connection', methods=['GET'])
 # def test_connection():
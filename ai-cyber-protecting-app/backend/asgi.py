@@ -0,0 +1,339 @@
+"""
+AI Cyber Protecting App - ASGI Backend
+Async serving mode with the same API as app.py. Upstream calls go through async
+service functions and pooled HTTP clients, so a single process can hold thousands
+of concurrent in-flight security checks instead of one per worker thread.
+
+Run from the backend directory:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+# Import services
+from services.alert_queue import (
+    enqueue_configuration_code, enqueue_red_alert, get_alert_queue_stats, start_alert_queue,
+)
+from services.circuit_breaker import get_circuit_breaker_stats
+from services.http_client import close_async_client, get_upstream_latency_stats
+from services.llm_service import get_safe_locations_cache_stats, suggest_safe_locations
+from services.location_service import geocode_home_address_async, get_geocode_cache_stats, start_whitelist_watcher
+from services.metrics import render_prometheus
+from services.network_service import get_ip_cache_stats, get_user_ip
+from services.request_validation import (
+    parse_batch_records, parse_confirmation, parse_coordinates, parse_session, parse_user_config,
+    parse_user_credentials,
+)
+from services.risk_calculator import assess_risk_async, assess_risk_batch_async, get_risk_rules, stream_risk_async
+from services.risk_sessions import get_risk_session, get_risk_session_stats
+from services.risk_tiles import get_risk_tile, get_risk_tile_cache_stats
+from services.threat_prefetcher import get_threat_prefetch_stats, start_threat_prefetcher
+from services.threat_service import get_threat_cache_stats
+from services.tracing import finish_trace, span, start_trace
+from services.user_store import (
+    authenticate_user, confirm_user_configuration, get_user_index_cache_stats, normalize_user_id,
+    request_user_configuration,
+)
+
+DEBUG = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
+
+class TracingMiddleware:
+    """Traces every HTTP request, including the whole body of streamed responses."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace, token = start_trace("unmatched")
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router records the matched endpoint in the scope
+            trace.endpoint = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            finish_trace(trace, token, status)
+
+async def health_check(request):
+    """Health check endpoint."""
+    return JSONResponse({
+        "status": "healthy",
+        "message": "AI Cyber Protecting App Backend is running",
+        "version": "1.0.0"
+    })
+
+async def stats(request):
+    """Cache statistics for the backend services."""
+    return JSONResponse({
+        "geocodeCache": get_geocode_cache_stats(),
+        "ipCache": get_ip_cache_stats(),
+        "upstreamLatency": get_upstream_latency_stats(),
+        "circuitBreakers": get_circuit_breaker_stats(),
+        "threatCache": get_threat_cache_stats(),
+        "threatPrefetch": get_threat_prefetch_stats(),
+        "safeLocationsCache": get_safe_locations_cache_stats(),
+        "riskTileCache": get_risk_tile_cache_stats(),
+        "userIndexCache": get_user_index_cache_stats(),
+        "alertQueue": get_alert_queue_stats(),
+        "riskSessions": get_risk_session_stats()
+    })
+
+async def metrics(request):
+    """Latency histograms, counters and cache statistics in the Prometheus text format."""
+    return Response(render_prometheus(), media_type='text/plain; version=0.0.4')
+
+async def authenticated_user(data):
+    """The userId of a check-security payload, if it carries the userToken last issued to that user."""
+    user_id, token = parse_user_credentials(data)
+    if user_id is None:
+        return None
+    # SQLite read: keep it off the event loop
+    return await asyncio.to_thread(authenticate_user, user_id, token)
+
+async def check_security(request):
+    """
+    Main security assessment endpoint, same contract as app.check_security.
+    """
+    try:
+        with span('parse_request'):
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+
+            # Extract and validate required fields
+            coordinates, error = parse_coordinates(data)
+        if error:
+            return JSONResponse({"error": error}, status_code=400)
+
+        latitude, longitude = coordinates
+        ip = get_user_ip(request)
+        user_id = await authenticated_user(data)
+        session_id, revision = parse_session(data)
+        session = get_risk_session(session_id, ip, user_id) if session_id else None
+
+        if session:
+            risk_assessment = await session.assess_async(latitude, longitude, ip, user_id)
+        else:
+            risk_assessment = await assess_risk_async(latitude, longitude, ip, user_id)
+        suggested_locations = suggest_safe_locations(latitude, longitude)
+        risk_assessment["suggestedLocations"] = suggested_locations.get("suggestedLocations", [])
+        enqueue_red_alert(risk_assessment, user_id, latitude, longitude)
+
+        if session:
+            return JSONResponse(session.delta(risk_assessment, revision))
+        return JSONResponse(risk_assessment)
+
+    except Exception as e:
+        # Log error and return generic error response
+        print(f"Error in check_security endpoint: {str(e)}")
+        return JSONResponse({
+            "error": "Internal server error occurred during security check",
+            "details": str(e) if DEBUG else None
+        }, status_code=500)
+
+async def check_security_stream(request):
+    """
+    Streaming variant of check_security, same contract as app.check_security_stream.
+    """
+    with span('parse_request'):
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        coordinates, error = parse_coordinates(data)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+
+    latitude, longitude = coordinates
+    ip = get_user_ip(request)
+    user_id = await authenticated_user(data)
+
+    async def generate():
+        try:
+            async for event in stream_risk_async(latitude, longitude, ip, user_id):
+                if event["type"] == "summary":
+                    enqueue_red_alert(event, user_id, latitude, longitude)
+                    suggested_locations = suggest_safe_locations(latitude, longitude).get("suggestedLocations", [])
+                    yield json.dumps({"type": "suggestedLocations", "suggestedLocations": suggested_locations}) + "\n"
+                    event["suggestedLocations"] = suggested_locations
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            print(f"Error in check_security_stream endpoint: {str(e)}")
+            yield json.dumps({"type": "error", "error": "Internal server error occurred during security check"}) + "\n"
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+async def check_security_batch(request):
+    """
+    Batch security assessment, same contract as app.check_security_batch.
+    """
+    try:
+        with span('parse_request'):
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            records, error = parse_batch_records(data)
+        if error:
+            return JSONResponse({"error": error}, status_code=400)
+
+        assessments = iter(await assess_risk_batch_async(
+            [(*coordinates, ip) for coordinates, ip, error in records if not error]
+        ))
+        results = [{"error": error} if error else next(assessments) for _, _, error in records]
+        return JSONResponse({"results": results})
+
+    except Exception as e:
+        print(f"Error in check_security_batch endpoint: {str(e)}")
+        return JSONResponse({
+            "error": "Internal server error occurred during security check",
+            "details": str(e) if DEBUG else None
+        }, status_code=500)
+
+async def risk_tile(request):
+    """
+    Location risk grid for a map tile, same contract as app.risk_tile.
+    """
+    params = request.path_params
+    try:
+        # Tiles are scored with numpy and cached in SQLite: keep that off the event loop
+        tile = await asyncio.to_thread(get_risk_tile, params['z'], params['x'], params['y'])
+        return JSONResponse(tile)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+async def configure_user(request):
+    """
+    Save a user's alert email and home addresses, same contract as app.configure_user.
+    """
+    try:
+        with span('parse_request'):
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            config, error = parse_user_config(data)
+        if error:
+            return JSONResponse({"error": error}, status_code=400)
+
+        user_id, alert_email, addresses = config
+        safe_locations = []
+        for address in addresses:
+            coordinates = await geocode_home_address_async(address)
+            if coordinates is None:
+                return JSONResponse({"error": f"Could not find address: {address}"}, status_code=400)
+            safe_locations.append((address, *coordinates))
+
+        # SQLite write: keep it off the event loop
+        code, owner_email, token = await asyncio.to_thread(request_user_configuration, user_id, alert_email,
+                                                           safe_locations)
+        if code is not None:
+            if not enqueue_configuration_code(owner_email, normalize_user_id(user_id), code):
+                return JSONResponse({"error": "Could not send the confirmation code, try again later."},
+                                    status_code=503)
+            return JSONResponse({
+                "status": "pending",
+                "message": "A confirmation code is on its way to the current 2faEmail.",
+                "userId": normalize_user_id(user_id)
+            }, status_code=202)
+        return JSONResponse({
+            "status": "success",
+            "message": "Configuration saved.",
+            "userId": normalize_user_id(user_id),
+            "userToken": token
+        })
+
+    except Exception as e:
+        print(f"An error occurred in /api/configure-user: {e}")
+        return JSONResponse({"error": "An internal server error occurred."}, status_code=500)
+
+async def confirm_user_config(request):
+    """
+    Apply a held configuration change, same contract as app.confirm_user_config.
+    """
+    try:
+        with span('parse_request'):
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            confirmation, error = parse_confirmation(data)
+        if error:
+            return JSONResponse({"error": error}, status_code=400)
+
+        user_id, code = confirmation
+        token = await asyncio.to_thread(confirm_user_configuration, user_id, code)
+        if token is None:
+            return JSONResponse({"error": "Invalid or expired confirmation code"}, status_code=403)
+        return JSONResponse({
+            "status": "success",
+            "message": "Configuration saved.",
+            "userId": normalize_user_id(user_id),
+            "userToken": token
+        })
+
+    except Exception as e:
+        print(f"An error occurred in /api/configure-user/confirm: {e}")
+        return JSONResponse({"error": "An internal server error occurred."}, status_code=500)
+
+async def http_error(request, exc):
+    """Handle 404/405 errors like the Flask backend does."""
+    messages = {404: "Endpoint not found", 405: "Method not allowed"}
+    return JSONResponse({"error": messages.get(exc.status_code, exc.detail)}, status_code=exc.status_code)
+
+async def internal_error(request, exc):
+    """Handle 500 errors."""
+    return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Compile the risk rules up front so a broken rules file fails at startup
+    get_risk_rules()
+    # Load the whitelist index up front and pick up edits to the file in the background
+    start_whitelist_watcher()
+    # Keep threat intel for recently active zipcodes fresh ahead of user requests
+    start_threat_prefetcher()
+    # Send Red Zone alert emails in the background
+    start_alert_queue()
+    yield
+    await close_async_client()
+
+app = Starlette(
+    debug=DEBUG,
+    routes=[
+        Route('/', health_check),
+        Route('/api/stats', stats),
+        Route('/metrics', metrics),
+        Route('/api/check-security', check_security, methods=['POST']),
+        Route('/api/check-security/stream', check_security_stream, methods=['POST']),
+        Route('/api/check-security/batch', check_security_batch, methods=['POST']),
+        Route('/api/risk-tiles/{z:int}/{x:int}/{y:int}', risk_tile),
+        Route('/api/configure-user', configure_user, methods=['POST']),
+        Route('/api/configure-user/confirm', confirm_user_config, methods=['POST']),
+    ],
+    middleware=[
+        Middleware(TracingMiddleware),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+    ],
+    exception_handlers={HTTPException: http_error, 500: internal_error},
+    lifespan=lifespan,
+)
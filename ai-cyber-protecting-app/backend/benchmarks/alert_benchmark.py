@@ -0,0 +1,136 @@
+"""
+Alert Benchmark for AI Cyber Protecting App
+Compares sending Red Zone alerts inline, one SMTP session each, with the alert
+queue (services/alert_queue.py), against the fake SMTP server of
+benchmarks/fake_upstreams.py. Results are saved and compared with the previous
+run (see benchmarks/results.py).
+
+Run from the backend directory:
+    python -m benchmarks.alert_benchmark --alerts 5000 --users 100 --smtp-latency-ms 20
+"""
+import argparse
+import os
+import random
+import smtplib
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+# Retry quickly, so injected failures don't stretch the run
+os.environ.setdefault('ALERT_RETRY_BASE_SECONDS', '0.05')
+
+from benchmarks.fake_upstreams import UpstreamBehaviour, start_fake_smtp
+from benchmarks.results import report_run
+from services.alert_queue import AlertQueue
+from services.email_service import SMTPConnection, build_message, compose_red_alert, generate_security_code
+
+RISK_FACTORS = ("Location: 12.3km from the closest safe location", "Network: 'You are on Public WiFi Network")
+
+def make_alerts(rng, count: int, users: int, places: int):
+    """
+    Returns:
+        list: (user id, latitude, longitude, risk factors); each user moves between a few places
+    """
+    alerts = []
+    for _ in range(count):
+        user, place = rng.randrange(users), rng.randrange(places)
+        alerts.append((f"user{user}", 40.7 + place * 0.01, -74.0 + user * 0.01, RISK_FACTORS))
+    return alerts
+
+def recipient(user_id):
+    return f"{user_id}@example.com"
+
+def send_inline(host, port, alert):
+    """Send one alert the way a request handler would without the queue: in its own SMTP session."""
+    user_id, latitude, longitude, risk_factors = alert
+    connection = SMTPConnection(host, port, username=None, starttls=False)
+    text_body, html_body = compose_red_alert([{
+        'latitude': latitude, 'longitude': longitude, 'riskFactors': list(risk_factors), 'count': 1,
+        'time': datetime.now(),
+    }], generate_security_code())
+    connection.send(build_message(connection.sender, recipient(user_id), text_body, html_body))
+    connection.close()
+
+def benchmark_inline(server, alerts):
+    host, port = server.server_address[:2]
+    sessions_before = server.sessions
+    failed = 0
+    started = time.perf_counter()
+    for alert in alerts:
+        try:
+            send_inline(host, port, alert)
+        except (smtplib.SMTPException, OSError):
+            failed += 1 # Nothing retries it
+    seconds = time.perf_counter() - started
+    print(f"Inline: {len(alerts)} alerts in {seconds:.2f}s, {seconds / len(alerts) * 1000:.1f}ms each "
+          f"on the request path, {server.sessions - sessions_before} SMTP sessions, {failed} failed")
+    return {"inline_send_ms": seconds / len(alerts) * 1000}
+
+def benchmark_queue(server, alerts, window_seconds: float):
+    host, port = server.server_address[:2]
+    alert_queue = AlertQueue(SMTPConnection(host, port, username=None, starttls=False), recipient,
+                             window_seconds=window_seconds, max_size=len(alerts))
+    messages_before = len(server.messages)
+    alert_queue.start()
+
+    enqueue_seconds = []
+    started = time.perf_counter()
+    for alert in alerts:
+        enqueue_started = time.perf_counter()
+        alert_queue.enqueue(*alert)
+        enqueue_seconds.append(time.perf_counter() - enqueue_started)
+
+    while True:
+        stats = alert_queue.stats()
+        if stats["queued"] == 0 and stats["pendingBatches"] == 0:
+            break
+        time.sleep(0.01)
+    drain_seconds = time.perf_counter() - started
+
+    enqueue_us = np.array(enqueue_seconds) * 1e6
+    metrics = {
+        "enqueue_p50_us": float(np.percentile(enqueue_us, 50)),
+        "enqueue_p99_us": float(np.percentile(enqueue_us, 99)),
+        "drain_seconds": drain_seconds,
+        "emails_sent_count": stats["emailsSent"],
+        "smtp_sessions_count": stats["smtpSessions"],
+        "failed_count": stats["failed"],
+    }
+    print(f"Queued: {len(alerts)} alerts enqueued in p50 {metrics['enqueue_p50_us']:.1f}us / "
+          f"p99 {metrics['enqueue_p99_us']:.1f}us, drained in {drain_seconds:.2f}s as "
+          f"{stats['emailsSent']} emails ({len(server.messages) - messages_before} received) over "
+          f"{stats['smtpSessions']} SMTP sessions, {stats['retries']} retries, {stats['failed']} failed")
+    return metrics
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Red Zone alert delivery.")
+    parser.add_argument('--alerts', type=int, default=5000, help="Alerts raised in the burst")
+    parser.add_argument('--users', type=int, default=100, help="Distinct users alerted")
+    parser.add_argument('--places', type=int, default=3, help="Distinct places per user")
+    parser.add_argument('--inline-alerts', type=int, default=50, help="Alerts sent inline, for comparison")
+    parser.add_argument('--window-seconds', type=float, default=0.5, help="Alert batch window")
+    parser.add_argument('--smtp-latency-ms', type=float, default=20, help="Latency of the fake SMTP server")
+    parser.add_argument('--smtp-error-rate', type=float, default=0.0, help="Share of emails the fake SMTP server rejects")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-save', action='store_true', help="Don't save the results")
+    parser.add_argument('--check', action='store_true', help="Exit with status 1 if any metric regressed")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    server, _ = start_fake_smtp(UpstreamBehaviour(args.smtp_latency_ms, args.smtp_latency_ms / 5, args.smtp_error_rate))
+
+    metrics = {}
+    metrics.update(benchmark_inline(server, make_alerts(rng, args.inline_alerts, args.users, args.places)))
+    metrics.update(benchmark_queue(server, make_alerts(rng, args.alerts, args.users, args.places), args.window_seconds))
+    server.shutdown()
+
+    params = {name: value for name, value in vars(args).items() if name not in ('no_save', 'check')}
+    regressed = report_run('alert_benchmark', params, metrics, save=not args.no_save)
+    if args.check and regressed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
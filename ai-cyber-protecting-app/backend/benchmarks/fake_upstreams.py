@@ -0,0 +1,345 @@
+"""
+Fake Upstreams for AI Cyber Protecting App
+Local stand-ins for Geoapify, ip-api.com, Gemini and the SMTP server with
+configurable latency and error injection, so the backend can be benchmarked
+without the real services.
+
+Geoapify and ip-api.com are served by one local HTTP server, which the backend
+is pointed at through GEOAPIFY_BASE_URL and IP_API_BASE_URL. Gemini is called
+through its SDK, so it is replaced in-process by FakeGeminiModel instead. Alert
+emails go to FakeSMTPServer, which keeps the messages it accepts.
+Responses are derived from the request (postcode from the coordinates, ISP from
+the IP address), so caches behave as they would against the real services.
+
+Run from the backend directory, to serve the app against the fakes:
+    python -m benchmarks.fake_upstreams --app asgi --port 5001 --latency-ms 50
+or only the HTTP fakes, for a backend started separately:
+    python -m benchmarks.fake_upstreams --port 5002
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socketserver
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from email import message_from_bytes
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+UPSTREAMS = ('geoapify', 'ip-api', 'gemini', 'smtp')
+
+# (isp, org, as) answers of the fake ip-api.com, picked by hashing the IP address
+IP_API_PROFILES = [
+    ("Comcast Cable Communications", "Comcast", "AS7922 Comcast Cable Communications, LLC"),
+    ("Boingo Wireless", "Boingo Airport Wi-Fi", "AS10910 Boingo Wireless, Inc."),
+    ("Amazon.com", "Amazon Technologies Inc.", "AS16509 Amazon.com, Inc."),
+    ("City Free Wi-Fi", "Municipal Network", "AS64512 City Free Wi-Fi"),
+]
+
+class UpstreamBehaviour:
+    """How a fake upstream responds: latency around a mean, and a share of errors."""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+
+    def latency_seconds(self):
+        return max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+
+    def should_fail(self):
+        return random.random() < self.error_rate
+
+def _stable_hash(text: str) -> int:
+    return zlib.crc32(text.encode())
+
+def fake_postcode(latitude: float, longitude: float) -> str:
+    """Postcode of the ~10km cell holding the coordinates."""
+    return f"{_stable_hash(f'{latitude:.1f},{longitude:.1f}') % 90000 + 10000}"
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real services
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/v1/geocode/reverse':
+            upstream, body = 'geoapify', self._geoapify(parse_qs(url.query))
+        elif url.path == '/v1/geocode/search':
+            upstream, body = 'geoapify', self._geoapify_search(parse_qs(url.query))
+        elif url.path.startswith('/json/'):
+            upstream, body = 'ip-api', self._ip_api(url.path[len('/json/'):])
+        else:
+            return self._respond(404, {"error": "Not found"})
+
+        with self.server.lock:
+            self.server.calls[upstream] += 1
+        behaviour = self.server.behaviours[upstream]
+        time.sleep(behaviour.latency_seconds())
+        if behaviour.should_fail():
+            return self._respond(503, {"error": "Injected failure"})
+        self._respond(200, body)
+
+    def _geoapify(self, query):
+        latitude = float(query.get('lat', ['0'])[0])
+        longitude = float(query.get('lon', ['0'])[0])
+        return {"features": [{"properties": {
+            "housenumber": "1",
+            "street": "Benchmark Street",
+            "state": "Benchmark State",
+            "country": "United States",
+            "country_code": "us",
+            "postcode": fake_postcode(latitude, longitude),
+        }}]}
+
+    def _geoapify_search(self, query):
+        # Somewhere in the continental US, fixed per address
+        text_hash = _stable_hash(query.get('text', [''])[0])
+        return {"features": [{"properties": {
+            "lat": 30 + text_hash % 1800 / 100,
+            "lon": -120 + text_hash // 1800 % 4500 / 100,
+        }}]}
+
+    def _ip_api(self, ip_address):
+        isp, org, asn = IP_API_PROFILES[_stable_hash(ip_address) % len(IP_API_PROFILES)]
+        return {"isp": isp, "org": org, "as": asn}
+
+    def _respond(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass # One line per request would drown the benchmark output
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, behaviours, host='127.0.0.1', port=0):
+        super().__init__((host, port), FakeUpstreamHandler)
+        self.behaviours = behaviours
+        self.calls = Counter()  # upstream -> requests received
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+def start_fake_upstreams(behaviours, host='127.0.0.1', port=0):
+    """
+    Serve the fake Geoapify and ip-api.com on a background thread.
+
+    Returns:
+        tuple: (server, environment variables that point the backend at it)
+    """
+    server = FakeUpstreamServer(behaviours, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True, name='fake-upstreams').start()
+    return server, {"GEOAPIFY_BASE_URL": server.base_url, "IP_API_BASE_URL": server.base_url}
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: no STARTTLS or AUTH, so run the backend with SMTP_STARTTLS=False."""
+
+    def handle(self):
+        with self.server.lock:
+            self.server.sessions += 1
+        self._reply("220 fake-smtp ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().split(' ', 1)[0].upper()
+            if command in ('EHLO', 'HELO'):
+                self._reply("250 fake-smtp")
+            elif command in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self._reply("250 OK")
+            elif command == 'DATA':
+                self._data()
+            elif command == 'QUIT':
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+    def _data(self):
+        self._reply("354 End data with <CR><LF>.<CR><LF>")
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line == b".\r\n":
+                break
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+        behaviour = self.server.behaviour
+        time.sleep(behaviour.latency_seconds())
+        if behaviour.should_fail():
+            return self._reply("451 Injected failure")
+        with self.server.lock:
+            self.server.messages.append(message_from_bytes(b"".join(lines)))
+        self._reply("250 OK")
+
+    def _reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, behaviour, host='127.0.0.1', port=0):
+        super().__init__((host, port), FakeSMTPHandler)
+        self.behaviour = behaviour
+        self.messages = []  # email.message.Message objects accepted so far
+        self.sessions = 0
+        self.lock = threading.Lock()
+
+def start_fake_smtp(behaviour, host='127.0.0.1', port=0):
+    """
+    Serve the fake SMTP server on a background thread.
+
+    Returns:
+        tuple: (server, environment variables that make the backend send alerts to it)
+    """
+    server = FakeSMTPServer(behaviour, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True, name='fake-smtp').start()
+    host, port = server.server_address[:2]
+    return server, {"SMTP_SERVER": host, "SMTP_PORT": str(port), "SMTP_STARTTLS": "False", "ALERT_EMAIL_DELIVERY": "smtp"}
+
+class FakeGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeGeminiModel:
+    """Stands in for genai.GenerativeModel, answering the backend's two prompts."""
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+
+    def _answer(self, prompt):
+        if self.behaviour.should_fail():
+            raise RuntimeError("Injected Gemini failure")
+        if "suggestedLocations" in prompt:
+            return FakeGeminiResponse(json.dumps({"suggestedLocations": [
+                {"Name": "Benchmark Library", "Distance": "0.5 miles", "Safety Level": "9/10",
+                 "Google Map Link": "https://maps.google.com/maps?q=Benchmark+Library"},
+                {"Name": "Benchmark Cafe", "Distance": "0.8 miles", "Safety Level": "8/10",
+                 "Google Map Link": "https://maps.google.com/maps?q=Benchmark+Cafe"},
+            ]}))
+        threats = [{"type": "Phishing"}] * (_stable_hash(prompt) % 3)
+        return FakeGeminiResponse("```json\n" + json.dumps({"threats": threats}) + "\n```")
+
+    def generate_content(self, prompt):
+        time.sleep(self.behaviour.latency_seconds())
+        return self._answer(prompt)
+
+    async def generate_content_async(self, prompt):
+        await asyncio.sleep(self.behaviour.latency_seconds())
+        return self._answer(prompt)
+
+def install_fake_gemini(behaviour):
+    """Make the threat and safe location services use FakeGeminiModel."""
+    import services.llm_service
+    import services.threat_service
+
+    model = FakeGeminiModel(behaviour)
+    services.llm_service.model = model
+    services.threat_service._threat_model = model
+
+def add_behaviour_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=50, help="Mean latency of every upstream")
+    parser.add_argument('--jitter-ms', type=float, default=10, help="Standard deviation of the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of upstream calls that fail")
+    for upstream in UPSTREAMS:
+        parser.add_argument(f'--{upstream}-latency-ms', type=float, default=None,
+                            help=f"Mean latency of {upstream}, overriding --latency-ms")
+        parser.add_argument(f'--{upstream}-error-rate', type=float, default=None,
+                            help=f"Error rate of {upstream}, overriding --error-rate")
+
+def behaviours_from_args(args):
+    """Build each upstream's UpstreamBehaviour from add_behaviour_arguments options."""
+    behaviours = {}
+    for upstream in UPSTREAMS:
+        option = upstream.replace('-', '_')
+        latency_ms = getattr(args, f'{option}_latency_ms')
+        error_rate = getattr(args, f'{option}_error_rate')
+        behaviours[upstream] = UpstreamBehaviour(
+            args.latency_ms if latency_ms is None else latency_ms,
+            args.jitter_ms,
+            args.error_rate if error_rate is None else error_rate,
+        )
+    return behaviours
+
+def serve_app(app_name, host, port, behaviours, workers=1):
+    """
+    Run the Flask or ASGI backend against the fake upstreams, until interrupted.
+
+    With more than one worker, the ASGI backend is served by server.py's pre-fork master.
+    """
+    _, environment = start_fake_upstreams(behaviours)
+    os.environ.update(environment)
+    _, environment = start_fake_smtp(behaviours['smtp'])
+    os.environ.update(environment)
+    # Turns the Gemini features on; calls go to FakeGeminiModel
+    os.environ.setdefault('GEMINI_API_KEY', 'fake-gemini-key')
+    # Start from an empty threat cache rather than the one on disk
+    os.environ.setdefault('THREAT_CACHE_PATH', os.path.join(tempfile.mkdtemp(), 'threat_cache.sqlite3'))
+
+    # The services read their configuration at import time, so import them only now
+    install_fake_gemini(behaviours['gemini'])
+    if app_name == 'flask':
+        from werkzeug.serving import make_server
+        from app import app
+
+        logging.getLogger('werkzeug').setLevel(logging.WARNING) # No line per request
+        print(f"Serving the Flask backend on http://{host}:{port}", flush=True)
+        make_server(host, port, app, threaded=True).serve_forever()
+    elif workers > 1:
+        import server
+
+        server.configure_workers(workers)
+        from asgi import app
+
+        server.warm_up()
+        sock = server.bind_socket(host, port)
+        print(f"Serving the ASGI backend on http://{host}:{port} with {workers} workers", flush=True)
+        server.Master(app, sock, workers, 'warning').run()
+    else:
+        import uvicorn
+        from asgi import app
+
+        print(f"Serving the ASGI backend on http://{host}:{port}", flush=True)
+        uvicorn.run(app, host=host, port=port, log_level='warning')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve fake upstreams, optionally with the backend in front of them.")
+    parser.add_argument('--app', choices=['flask', 'asgi'], default=None,
+                        help="Backend to serve against the fakes (default: only serve the HTTP fakes)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes of the ASGI backend")
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    behaviours = behaviours_from_args(args)
+    if args.app:
+        serve_app(args.app, args.host, args.port, behaviours, args.workers)
+    else:
+        server, environment = start_fake_upstreams(behaviours, args.host, args.port)
+        smtp_server, smtp_environment = start_fake_smtp(behaviours['smtp'], args.host)
+        environment.update(smtp_environment)
+        print("Fake Geoapify, ip-api.com and SMTP server are running. Start the backend with:")
+        print(" ".join(f"{name}={value}" for name, value in environment.items()))
+        print("Gemini can only be faked in-process, with --app.")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+            smtp_server.shutdown()
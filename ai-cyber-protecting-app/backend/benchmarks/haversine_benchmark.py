@@ -0,0 +1,82 @@
+"""
+Haversine Benchmark for AI Cyber Protecting App
+Checks the vectorized distance engine against the scalar calculate_distance and
+measures the speedup at growing whitelist sizes.
+
+Run from the backend directory:
+    python -m benchmarks.haversine_benchmark
+"""
+import time
+
+import numpy as np
+
+from services.location_service import calculate_distance, calculate_distances, calculate_distance_matrix
+
+SITE_COUNTS = [1_000, 100_000, 1_000_000]
+
+# Maximum allowed difference from the scalar implementation, in kilometers
+TOLERANCE_KM = 1e-9
+
+def random_coordinates(rng, count):
+    """Generate coordinates spread uniformly over the sphere."""
+    latitudes = np.degrees(np.arcsin(rng.uniform(-1, 1, count)))
+    longitudes = rng.uniform(-180, 180, count)
+    return latitudes, longitudes
+
+def check_precision(rng, count=10_000):
+    """
+    Compare vectorized distances against calculate_distance, including
+    near-identical and near-antipodal pairs where rounding matters most.
+
+    Returns:
+        float: Largest absolute difference in kilometers
+    """
+    latitudes, longitudes = random_coordinates(rng, count)
+    user_latitude, user_longitude = 37.3521, -79.1754
+
+    edge_latitudes = np.array([user_latitude, user_latitude + 1e-7, -user_latitude])
+    edge_longitudes = np.array([user_longitude, user_longitude, user_longitude + 180])
+    latitudes = np.concatenate((latitudes, edge_latitudes))
+    longitudes = np.concatenate((longitudes, edge_longitudes))
+
+    expected = np.array([
+        calculate_distance(user_latitude, user_longitude, latitude, longitude)
+        for latitude, longitude in zip(latitudes, longitudes)
+    ])
+    one_to_many = calculate_distances(user_latitude, user_longitude, latitudes, longitudes)
+    many_to_many = calculate_distance_matrix([user_latitude] * 2, [user_longitude] * 2, latitudes, longitudes)
+
+    error = max(np.max(np.abs(one_to_many - expected)), np.max(np.abs(many_to_many - expected)))
+    assert error <= TOLERANCE_KM, f"Vectorized distances differ from scalar ones by {error} km"
+    return error
+
+def time_call(function, repeat=3):
+    """Return the best wall-clock time of several runs, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_benchmark(rng):
+    user_latitude, user_longitude = 37.3521, -79.1754
+
+    print(f"{'sites':>10} {'scalar (ms)':>12} {'vectorized (ms)':>16} {'speedup':>8}")
+    for count in SITE_COUNTS:
+        latitudes, longitudes = random_coordinates(rng, count)
+        site_pairs = list(zip(latitudes.tolist(), longitudes.tolist()))
+
+        scalar = time_call(
+            lambda: [calculate_distance(user_latitude, user_longitude, lat, lon) for lat, lon in site_pairs],
+            repeat=1 if count >= 1_000_000 else 3
+        )
+        vectorized = time_call(lambda: calculate_distances(user_latitude, user_longitude, latitudes, longitudes))
+
+        print(f"{count:>10,} {scalar * 1000:>12.2f} {vectorized * 1000:>16.2f} {scalar / vectorized:>7.1f}x")
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(42)
+    error = check_precision(rng)
+    print(f"Precision check passed (max difference {error:.2e} km)")
+    run_benchmark(rng)
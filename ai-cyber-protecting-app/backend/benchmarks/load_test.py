@@ -0,0 +1,185 @@
+"""
+Load Test for AI Cyber Protecting App
+End-to-end load generator for /api/check-security, reporting throughput and
+p50/p95/p99 latency.
+
+By default it starts the backend in a subprocess against the fake upstreams of
+benchmarks/fake_upstreams.py, with the latency and error rates given, so results
+don't depend on the real services. Requests come from a fixed pool of locations
+and client IPs, so pool sizes control how often the caches hit. After a warm-up
+period, every request is timed; results are saved and compared with the previous
+run with the same parameters (see benchmarks/results.py).
+
+Run from the backend directory:
+    python -m benchmarks.load_test --app asgi --concurrency 64 --duration 30
+or against a backend that is already running:
+    python -m benchmarks.load_test --url http://localhost:5000
+"""
+import argparse
+import asyncio
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+from benchmarks.fake_upstreams import add_behaviour_arguments
+from benchmarks.results import report_run
+
+ENDPOINT = '/api/check-security'
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_backend(args):
+    """
+    Start the backend against the fake upstreams in a subprocess.
+
+    Returns:
+        tuple: (process, base URL)
+    """
+    port = _free_port()
+    command = [sys.executable, '-m', 'benchmarks.fake_upstreams', '--app', args.app, '--port', str(port),
+               '--workers', str(args.workers)]
+    for name, value in vars(args).items():
+        if value is not None and (name.endswith('latency_ms') or name.endswith('error_rate') or name == 'jitter_ms'):
+            command += [f"--{name.replace('_', '-')}", str(value)]
+    process = subprocess.Popen(command, stdout=None if args.verbose else subprocess.DEVNULL)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Backend exited with status {process.returncode}")
+        try:
+            httpx.get(base_url + '/', timeout=1)
+            return process, base_url
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("Backend did not start within 30s")
+
+def make_request_pool(rng, locations: int, ips: int):
+    """
+    Returns:
+        list: (JSON body, headers) pairs, one per location, each with a client IP
+    """
+    # Around New York, Chicago and Los Angeles
+    centres = [(40.7128, -74.0060), (41.8781, -87.6298), (34.0522, -118.2437)]
+    addresses = [f"{rng.integers(1, 224)}.{rng.integers(0, 256)}.{rng.integers(0, 256)}.{rng.integers(1, 255)}"
+                 for _ in range(ips)]
+    pool = []
+    for index in range(locations):
+        latitude, longitude = centres[index % len(centres)]
+        body = {
+            "latitude": round(latitude + rng.normal(0, 0.2), 5),
+            "longitude": round(longitude + rng.normal(0, 0.2), 5),
+        }
+        pool.append((body, {"X-Forwarded-For": addresses[index % ips]}))
+    return pool
+
+async def generate_load(base_url, pool, concurrency: int, duration: float, warmup: float):
+    """
+    Keep concurrency requests in flight for warmup + duration seconds.
+
+    Returns:
+        tuple: (latencies in seconds, failed request count, seconds measured), for
+               requests started after the warm-up
+    """
+    latencies = []
+    failures = 0
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    async def worker(client):
+        nonlocal failures
+        while True:
+            request_started = time.perf_counter()
+            if request_started >= stop_at:
+                return
+            body, headers = random.choice(pool)
+            try:
+                response = await client.post(ENDPOINT, json=body, headers=headers)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if request_started >= measure_from:
+                latencies.append(time.perf_counter() - request_started)
+                failures += not ok
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return latencies, failures, time.perf_counter() - measure_from
+
+def summarize(latencies, failures, elapsed):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "request_count": len(latencies),
+        "error_rate": failures / len(latencies),
+        "throughput_per_second": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "max_ms": float(latencies_ms.max()),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/check-security.")
+    parser.add_argument('--url', help="Base URL of a running backend (default: start one against fake upstreams)")
+    parser.add_argument('--app', choices=['flask', 'asgi'], default='asgi', help="Backend to start")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes of the ASGI backend started")
+    parser.add_argument('--concurrency', type=int, default=32, help="Requests kept in flight")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds to measure")
+    parser.add_argument('--warmup', type=float, default=3, help="Seconds of load before measuring")
+    parser.add_argument('--locations', type=int, default=500, help="Distinct locations requested")
+    parser.add_argument('--ips', type=int, default=500, help="Distinct client IPs")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-save', action='store_true', help="Don't save the results")
+    parser.add_argument('--check', action='store_true', help="Exit with status 1 if any metric regressed")
+    parser.add_argument('--verbose', action='store_true', help="Show the backend's output")
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    pool = make_request_pool(np.random.default_rng(args.seed), args.locations, args.ips)
+
+    process = None
+    base_url = args.url
+    if base_url is None:
+        process, base_url = start_backend(args)
+    try:
+        print(f"Loading {base_url}{ENDPOINT} with {args.concurrency} concurrent requests "
+              f"for {args.warmup:g}s warm-up + {args.duration:g}s...")
+        latencies, failures, elapsed = asyncio.run(
+            generate_load(base_url, pool, args.concurrency, args.duration, args.warmup)
+        )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    if not latencies:
+        raise SystemExit("No requests completed")
+    metrics = summarize(latencies, failures, elapsed)
+    print(f"\n{metrics['request_count']} requests, {failures} failed, "
+          f"{metrics['throughput_per_second']:.1f} req/s")
+    print(f"p50 {metrics['p50_ms']:.1f}ms  p95 {metrics['p95_ms']:.1f}ms  "
+          f"p99 {metrics['p99_ms']:.1f}ms  max {metrics['max_ms']:.1f}ms")
+
+    params = {
+        name: value for name, value in vars(args).items()
+        if name not in ('no_save', 'check', 'verbose') and not (name in ('app', 'workers') and args.url)
+    }
+    regressed = report_run('load_test', params, metrics, save=not args.no_save)
+    if args.check and regressed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
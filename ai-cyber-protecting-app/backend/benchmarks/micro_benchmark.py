@@ -0,0 +1,120 @@
+"""
+Micro-benchmarks for AI Cyber Protecting App
+Times the local hot paths of a security check, none of which touch an upstream:
+Haversine distances, whitelist lookups at growing whitelist sizes and IP
+classification. Results are saved and compared with the previous run (see
+benchmarks/results.py).
+
+Run from the backend directory:
+    python -m benchmarks.micro_benchmark
+"""
+import argparse
+import ipaddress
+import sys
+
+import numpy as np
+
+from benchmarks.haversine_benchmark import random_coordinates, time_call
+from benchmarks.results import report_run
+from services.ip_classifier import IPClassifier
+from services.location_service import calculate_distances
+from services.network_service import NETWORK_RANGES_FILENAME, NETWORK_TYPE
+from services.spatial_index import SphereKDTree
+
+HAVERSINE_SITE_COUNTS = [1_000, 100_000, 1_000_000]
+WHITELIST_SIZES = [10, 1_000, 100_000, 1_000_000]
+# Brute force is only timed up to this size; beyond it, it takes too long to be useful
+BRUTE_FORCE_MAX_SIZE = 100_000
+IP_TABLE_SIZES = [1_000, 100_000]
+
+def benchmark_haversine(rng, site_counts):
+    metrics = {}
+    print(f"{'sites':>10} {'distances (ms)':>16}")
+    for count in site_counts:
+        latitudes, longitudes = random_coordinates(rng, count)
+        seconds = time_call(lambda: calculate_distances(37.3521, -79.1754, latitudes, longitudes))
+        metrics[f"haversine_{count}_ms"] = seconds * 1000
+        print(f"{count:>10,} {seconds * 1000:>16.3f}")
+    return metrics
+
+def benchmark_whitelist(rng, sizes, queries=1_000):
+    """Time single and batched nearest-safe-location queries against indexes of growing size."""
+    metrics = {}
+    query_latitudes, query_longitudes = random_coordinates(rng, queries)
+    query_pairs = list(zip(query_latitudes.tolist(), query_longitudes.tolist()))
+
+    print(f"\n{'sites':>10} {'build (ms)':>11} {'query (us)':>11} {'batched (us)':>13} {'brute force (us)':>17}")
+    for size in sizes:
+        latitudes, longitudes = random_coordinates(rng, size)
+        sites = list(zip(latitudes.tolist(), longitudes.tolist()))
+
+        build = time_call(lambda: SphereKDTree(sites), repeat=1)
+        index = SphereKDTree(sites)
+        single = time_call(lambda: [index.nearest(latitude, longitude) for latitude, longitude in query_pairs])
+        batched = time_call(lambda: index.nearest_many(query_latitudes, query_longitudes))
+
+        metrics[f"whitelist_{size}_build_ms"] = build * 1000
+        metrics[f"whitelist_{size}_query_us"] = single / queries * 1e6
+        metrics[f"whitelist_{size}_batched_query_us"] = batched / queries * 1e6
+
+        brute_force = ""
+        if size <= BRUTE_FORCE_MAX_SIZE:
+            sample = query_pairs[:100]
+            seconds = time_call(lambda: [
+                np.argmin(calculate_distances(latitude, longitude, latitudes, longitudes))
+                for latitude, longitude in sample
+            ], repeat=1)
+            metrics[f"whitelist_{size}_brute_force_us"] = seconds / len(sample) * 1e6
+            brute_force = f"{seconds / len(sample) * 1e6:.1f}"
+
+        print(f"{size:>10,} {build * 1000:>11.1f} {single / queries * 1e6:>11.2f} "
+              f"{batched / queries * 1e6:>13.2f} {brute_force:>17}")
+    return metrics
+
+def random_ipv4_addresses(rng, count):
+    return [str(ipaddress.IPv4Address(int(value))) for value in rng.integers(1 << 24, 224 << 24, count)]
+
+def benchmark_ip_classification(rng, table_sizes, lookups=100_000):
+    """Time longest-prefix lookups against the shipped network ranges and larger synthetic tables."""
+    metrics = {}
+    addresses = random_ipv4_addresses(rng, lookups)
+    classifiers = {"default": IPClassifier.from_file(NETWORK_RANGES_FILENAME, NETWORK_TYPE)}
+    for size in table_sizes:
+        # Random /16 to /24 prefixes, like a geo-IP or hosting provider table
+        networks = random_ipv4_addresses(rng, size)
+        prefix_lengths = rng.integers(16, 25, size)
+        classifiers[str(size)] = IPClassifier([
+            (f"{network}/{prefix_length}", NETWORK_TYPE["VPN/Proxy Network"])
+            for network, prefix_length in zip(networks, prefix_lengths.tolist())
+        ])
+
+    print(f"\n{'rules':>10} {'lookup (ns)':>12}")
+    for name, classifier in classifiers.items():
+        seconds = time_call(lambda: [classifier.classify_ip(address) for address in addresses])
+        metrics[f"ip_classify_{name}_ns"] = seconds / lookups * 1e9
+        print(f"{name:>10} {seconds / lookups * 1e9:>12.0f}")
+    return metrics
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local hot paths of a security check.")
+    parser.add_argument('--quick', action='store_true', help="Skip the largest sizes")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-save', action='store_true', help="Don't save the results")
+    parser.add_argument('--check', action='store_true', help="Exit with status 1 if any metric regressed")
+    args = parser.parse_args()
+
+    def sizes(values):
+        return values[:-1] if args.quick else values
+
+    rng = np.random.default_rng(args.seed)
+    metrics = {}
+    metrics.update(benchmark_haversine(rng, sizes(HAVERSINE_SITE_COUNTS)))
+    metrics.update(benchmark_whitelist(rng, sizes(WHITELIST_SIZES)))
+    metrics.update(benchmark_ip_classification(rng, sizes(IP_TABLE_SIZES)))
+
+    regressed = report_run('micro_benchmark', {"quick": args.quick, "seed": args.seed}, metrics, save=not args.no_save)
+    if args.check and regressed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark Results for AI Cyber Protecting App
+Saves benchmark runs and compares each one with the previous run of the same
+benchmark and parameters, so regressions show up.
+
+Runs are appended to BENCHMARK_RESULTS_DIR/<benchmark>.jsonl, one JSON object
+per line with the time, git commit, parameters and metrics. Metrics whose name
+ends in "_per_second" are better when higher, those ending in "_count" are only
+informational, and every other metric is better when lower.
+"""
+import json
+import os
+import subprocess
+import time
+
+BENCHMARK_RESULTS_DIR = os.getenv('BENCHMARK_RESULTS_DIR', 'benchmarks/results')
+# Relative change beyond which a metric is reported as a regression
+BENCHMARK_REGRESSION_THRESHOLD = float(os.getenv('BENCHMARK_REGRESSION_THRESHOLD', 0.10))
+
+def _results_path(benchmark: str):
+    return os.path.join(BENCHMARK_RESULTS_DIR, f"{benchmark}.jsonl")
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_previous_run(benchmark: str, params: dict):
+    """
+    Returns:
+        dict: The latest saved run of benchmark with the same params, or None
+    """
+    previous = None
+    try:
+        with open(_results_path(benchmark), 'r') as file:
+            for line in file:
+                run = json.loads(line)
+                if run.get('params') == params:
+                    previous = run
+    except FileNotFoundError:
+        pass
+    return previous
+
+def save_run(benchmark: str, params: dict, metrics: dict):
+    os.makedirs(BENCHMARK_RESULTS_DIR, exist_ok=True)
+    run = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _git_commit(),
+        'params': params,
+        'metrics': metrics,
+    }
+    with open(_results_path(benchmark), 'a') as file:
+        file.write(json.dumps(run) + '\n')
+
+def compare_runs(previous_metrics: dict, metrics: dict):
+    """
+    Returns:
+        list: (metric, previous value, value, relative change, regressed) for every
+              metric present in both runs; change is positive when it got better
+    """
+    comparison = []
+    for name, value in metrics.items():
+        before = previous_metrics.get(name)
+        if not before or value is None or name.endswith('_count'):
+            continue
+        change = (value - before) / before
+        if not name.endswith('_per_second'):
+            change = -change
+        comparison.append((name, before, value, change, change < -BENCHMARK_REGRESSION_THRESHOLD))
+    return comparison
+
+def report_run(benchmark: str, params: dict, metrics: dict, save: bool = True):
+    """
+    Print how a run compares with the previous one, then save it.
+
+    Returns:
+        bool: True if any metric regressed beyond BENCHMARK_REGRESSION_THRESHOLD
+    """
+    previous = load_previous_run(benchmark, params)
+    regressed = False
+    if previous is None:
+        print(f"\nNo previous {benchmark} run with these parameters to compare with.")
+    else:
+        print(f"\nCompared with the run of {previous['time']} (commit {previous['commit']}):")
+        print(f"{'metric':<36} {'before':>12} {'now':>12} {'change':>8}")
+        for name, before, value, change, is_regression in compare_runs(previous['metrics'], metrics):
+            flag = "  REGRESSION" if is_regression else ""
+            print(f"{name:<36} {before:>12.4g} {value:>12.4g} {change:>+7.1%}{flag}")
+            regressed = regressed or is_regression
+
+    if save:
+        save_run(benchmark, params, metrics)
+        print(f"Saved to {_results_path(benchmark)}")
+    return regressed
@@ -0,0 +1,133 @@
+"""
+Session Benchmark for AI Cyber Protecting App
+Compares polling clients assessed in full on every check with the same clients
+in session mode (services/risk_sessions.py), against the fake Geoapify and
+ip-api.com of benchmarks/fake_upstreams.py.
+
+Each client starts somewhere around Chicago, moves a few metres between polls
+and now and then changes IP. Both modes get the same walks, but the session
+mode's are a degree further east and use other IPs, so neither mode starts
+with the other's lookups cached. Reports per-poll latency, upstream calls and
+response size. Results are saved and compared with the previous run (see
+benchmarks/results.py).
+
+Run from the backend directory:
+    python -m benchmarks.session_benchmark --clients 200 --polls 30 --step-m 5
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.fake_upstreams import UpstreamBehaviour, start_fake_upstreams
+from benchmarks.results import report_run
+
+CITY = (41.8781, -87.6298)
+
+def make_walks(rng, city, clients: int, polls: int, step_m: float, ip_change_rate: float, first_ip: int):
+    """
+    Returns:
+        list: Per client, one (latitude, longitude, ip) per poll
+    """
+    walks = []
+    for client in range(clients):
+        latitude = city[0] + rng.normal(0, 0.1)
+        longitude = city[1] + rng.normal(0, 0.1)
+        ip_number = first_ip + client * 1000
+        walk = []
+        for _ in range(polls):
+            walk.append((latitude, longitude, f"10.{ip_number // 65536 % 256}.{ip_number // 256 % 256}.{ip_number % 256}"))
+            heading = rng.uniform(0, 2 * math.pi)
+            latitude += step_m / 111_320 * math.cos(heading)
+            longitude += step_m / (111_320 * math.cos(math.radians(latitude))) * math.sin(heading)
+            if rng.random() < ip_change_rate:
+                ip_number += 1
+        walks.append(walk)
+    return walks
+
+def run_polls(server, walks, check):
+    """
+    Poll every client once per round, in order.
+
+    Args:
+        check (callable): Takes the client number, latitude, longitude and IP and returns the response
+
+    Returns:
+        dict: Per-poll latency, upstream calls and response size
+    """
+    calls_before = sum(server.calls.values())
+    latencies = []
+    response_bytes = []
+    for poll in range(len(walks[0])):
+        for client, walk in enumerate(walks):
+            latitude, longitude, ip = walk[poll]
+            started = time.perf_counter()
+            response = check(client, latitude, longitude, ip)
+            latencies.append(time.perf_counter() - started)
+            response_bytes.append(len(json.dumps(response)))
+    latencies_us = np.array(latencies) * 1e6
+    return {
+        "p50_us": float(np.percentile(latencies_us, 50)),
+        "mean_us": float(latencies_us.mean()),
+        "upstream_calls_per_poll": (sum(server.calls.values()) - calls_before) / len(latencies),
+        "response_bytes": float(np.mean(response_bytes)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark session-mode security checks against full ones.")
+    parser.add_argument('--clients', type=int, default=200, help="Polling clients per mode")
+    parser.add_argument('--polls', type=int, default=30, help="Checks per client")
+    parser.add_argument('--step-m', type=float, default=5, help="Metres a client moves between polls")
+    parser.add_argument('--ip-change-rate', type=float, default=0.02, help="Chance a client's IP changes between polls")
+    parser.add_argument('--latency-ms', type=float, default=20, help="Latency of the fake upstreams")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-save', action='store_true', help="Don't save the results")
+    parser.add_argument('--check', action='store_true', help="Exit with status 1 if any metric regressed")
+    args = parser.parse_args()
+
+    behaviour = UpstreamBehaviour(args.latency_ms, args.latency_ms / 5)
+    server, environment = start_fake_upstreams({'geoapify': behaviour, 'ip-api': behaviour})
+    os.environ.update(environment)
+    # Start from an empty threat cache rather than the one on disk
+    os.environ.setdefault('THREAT_CACHE_PATH', os.path.join(tempfile.mkdtemp(), 'threat_cache.sqlite3'))
+
+    # The services read their configuration at import time, so import them only now
+    from services.risk_calculator import assess_risk
+    from services.risk_sessions import get_risk_session, get_risk_session_stats
+
+    walks = [make_walks(np.random.default_rng(args.seed), (CITY[0], CITY[1] + mode), args.clients, args.polls,
+                        args.step_m, args.ip_change_rate, first_ip=mode * 2**20)
+             for mode in range(2)]
+
+    full = run_polls(server, walks[0], lambda client, latitude, longitude, ip: assess_risk(latitude, longitude, ip))
+
+    session_ids, revisions = {}, {}
+    def session_check(client, latitude, longitude, ip):
+        # A new IP starts a new session, as it would on the server
+        session = get_risk_session(session_ids.get(client, "new"), ip)
+        response = session.delta(session.assess(latitude, longitude, ip), revisions.get(client))
+        session_ids[client], revisions[client] = response["sessionId"], response["revision"]
+        return response
+    session = run_polls(server, walks[1], session_check)
+    server.shutdown()
+
+    for name, results in (("Full", full), ("Session", session)):
+        print(f"{name}: p50 {results['p50_us']:.0f}us, mean {results['mean_us']:.0f}us per poll, "
+              f"{results['upstream_calls_per_poll']:.3f} upstream calls per poll, "
+              f"{results['response_bytes']:.0f} response bytes")
+    print("Session inputs reused/recomputed:", get_risk_session_stats()["inputs"])
+
+    metrics = {f"{mode}_{name}": value for mode, results in (("full", full), ("session", session))
+               for name, value in results.items()}
+    params = {name: value for name, value in vars(args).items() if name not in ('no_save', 'check')}
+    regressed = report_run('session_benchmark', params, metrics, save=not args.no_save)
+    if args.check and regressed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
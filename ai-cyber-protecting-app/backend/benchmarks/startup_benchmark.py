@@ -0,0 +1,93 @@
+"""
+Startup Benchmark for AI Cyber Protecting App
+Measures how long a fresh process takes to import each serving mode, and checks
+that modules meant to load lazily (e.g. the Gemini SDK) aren't imported at
+startup. Results are saved and compared with the previous run (see
+benchmarks/results.py).
+
+Run from the backend directory:
+    python -m benchmarks.startup_benchmark --check
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from benchmarks.results import report_run
+
+# Serving mode module -> modules that must not be imported when it starts
+LAZY_MODULES = {
+    'app': ['google.generativeai'],
+    'asgi': ['google.generativeai', 'requests'],
+}
+
+# Prints the import time and which lazy modules got imported anyway, as JSON
+IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "imported": [name for name in {lazy_modules!r} if name in sys.modules]}}))
+"""
+
+def time_import(module: str):
+    """
+    Import module in a fresh interpreter.
+
+    Returns:
+        dict: seconds taken and the lazy modules that were imported
+    """
+    script = IMPORT_SCRIPT.format(module=module, lazy_modules=LAZY_MODULES[module])
+    result = subprocess.run([sys.executable, '-W', 'ignore', '-c', script], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def slowest_imports(module: str, count: int = 10):
+    """
+    Returns:
+        list: (cumulative microseconds, module name) of the slowest top-level imports
+    """
+    result = subprocess.run([sys.executable, '-W', 'ignore', '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented; keep the ones the module imports directly
+        if name.startswith('   ') and not name.startswith('    '):
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long the backend takes to import.")
+    parser.add_argument('--runs', type=int, default=5, help="Fresh interpreters per serving mode")
+    parser.add_argument('--no-save', action='store_true', help="Don't save the results")
+    parser.add_argument('--check', action='store_true',
+                        help="Exit with status 1 if a lazy module is imported at startup or any metric regressed")
+    args = parser.parse_args()
+
+    metrics = {}
+    eager_imports = []
+    for module in LAZY_MODULES:
+        runs = [time_import(module) for _ in range(args.runs)]
+        seconds = [run['seconds'] for run in runs]
+        metrics[f"{module}_import_median_ms"] = statistics.median(seconds) * 1000
+        metrics[f"{module}_import_min_ms"] = min(seconds) * 1000
+        imported = sorted({name for run in runs for name in run['imported']})
+        eager_imports += [(module, name) for name in imported]
+
+        print(f"\nimport {module}: median {metrics[f'{module}_import_median_ms']:.0f}ms, "
+              f"min {metrics[f'{module}_import_min_ms']:.0f}ms over {args.runs} runs")
+        for cumulative, name in slowest_imports(module):
+            print(f"  {cumulative / 1000:>8.1f}ms  {name}")
+
+    for module, name in eager_imports:
+        print(f"\n{name} is imported when {module} starts, but should only load on first use")
+
+    regressed = report_run('startup_benchmark', {"runs": args.runs}, metrics, save=not args.no_save)
+    if args.check and (regressed or eager_imports):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+AI Cyber Protecting App - Production Server
+Pre-fork server for the ASGI backend (asgi.py), which has the same API as app.py.
+
+The master process loads everything requests would otherwise load lazily (risk
+rules, whitelist index, IP classifier, offline geocoder, threat cache), and only
+then opens the listening socket and forks SERVER_WORKERS uvicorn workers that
+accept on it. Workers share the preloaded state copy-on-write. The geocode and
+IP caches are shared through a SQLite database in /dev/shm (SHARED_CACHE_PATH),
+and the threat cache through its database on disk. Workers that die are
+replaced; SIGTERM or SIGINT shuts them all down gracefully.
+
+Run from the backend directory:
+    python server.py --workers 4 --port 5000
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from services.config import load_environment
+
+load_environment()
+
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', 5000))
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', os.cpu_count() or 1))
+SERVER_BACKLOG = int(os.getenv('SERVER_BACKLOG', 2048))
+# Workers that exit sooner than this after starting are restarted after a pause
+WORKER_MIN_UPTIME_SECONDS = float(os.getenv('WORKER_MIN_UPTIME_SECONDS', 5))
+
+def default_shared_cache_path():
+    """Path of the cross-worker cache database, in shared memory where available."""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'ai-cyber-protecting-app-cache.sqlite3')
+
+def default_prefetch_slots_dir():
+    """Directory of the lock files that cap threat prefetches in flight across workers."""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'ai-cyber-protecting-app-prefetch-slots')
+
+def configure_workers(workers: int):
+    """
+    Set the environment the services read at import time, so it must run before asgi is imported.
+
+    Points the in-memory caches at the shared database and splits the threat
+    prefetcher's Gemini quota between the workers, which each run one: the rate
+    is divided between them, and PREFETCH_MAX_CONCURRENCY refreshes in flight are
+    shared through lock files (see threat_prefetcher.ProcessSlots), so the cap
+    holds however many workers there are.
+    """
+    os.environ.setdefault('SHARED_CACHE_PATH', default_shared_cache_path())
+    os.environ.setdefault('PREFETCH_SLOTS_DIR', default_prefetch_slots_dir())
+    rate_per_minute = float(os.getenv('PREFETCH_RATE_PER_MINUTE', 30))
+    os.environ['PREFETCH_RATE_PER_MINUTE'] = str(rate_per_minute / workers)
+
+def warm_up():
+    """Load the state every worker needs before any of them is forked."""
+    from services.location_service import get_offline_geocoder, reload_whitelist_index
+    from services.network_service import get_ip_classifier
+    from services.risk_calculator import get_risk_rules
+    from services.threat_service import get_threat_cache
+
+    started = time.perf_counter()
+    get_risk_rules()
+    reload_whitelist_index()
+    get_ip_classifier()
+    get_offline_geocoder()
+    get_threat_cache()
+    print(f"Warmed up in {time.perf_counter() - started:.2f}s")
+
+def bind_socket(host: str, port: int):
+    """Open the listening socket the workers share."""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(SERVER_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(app, sock, log_level: str):
+    """Serve app on sock until told to stop. Runs in a forked worker."""
+    import uvicorn
+
+    # Only the master reacts to Ctrl-C, then stops the workers itself
+    os.setpgid(0, 0)
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+
+    config = uvicorn.Config(app, lifespan='on', log_level=log_level, access_log=False)
+    uvicorn.Server(config).run(sockets=[sock])
+
+class Master:
+    """Forks the workers, replaces the ones that die and stops them on SIGTERM/SIGINT."""
+
+    def __init__(self, app, sock, workers: int, log_level: str):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.log_level = log_level
+        self._children = {}  # pid -> time it was started
+        self._stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                run_worker(self.app, self.sock, self.log_level)
+            except BaseException as e:
+                print(f"Worker {os.getpid()} failed: {e}")
+                status = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(status)
+        self._children[pid] = time.monotonic()
+
+    def stop(self, signum, frame):
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # Objects loaded so far are never freed; keep the collector from touching
+        # (and so copying) their pages in every worker
+        gc.freeze()
+        for _ in range(self.workers):
+            self.spawn()
+        print(f"Serving on {self.sock.getsockname()[:2]} with {self.workers} workers (master {os.getpid()})")
+
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self._children.pop(pid, None)
+            if self._stopping or started is None:
+                continue
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting it")
+            if time.monotonic() - started < WORKER_MIN_UPTIME_SECONDS:
+                time.sleep(1) # Don't spin if workers crash on startup
+            if not self._stopping:
+                self.spawn()
+        self.sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the backend with several worker processes.")
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS)
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+
+    configure_workers(workers)
+    from asgi import app
+
+    warm_up()
+    # Bound only once warm, so no connection waits on loading
+    sock = bind_socket(args.host, args.port)
+    Master(app, sock, workers, args.log_level).run()
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,7 @@
 """
 Services package for AI Cyber Protecting App
 """
+from services.config import load_environment
+
+# Before any service module reads its settings
+load_environment()
@@ -2,8 +2,8 @@ from dotenv import load_dotenv
 import os
 
 def get_address(latitude, longitude):
-    import requests
     from requests.structures import CaseInsensitiveDict
+    from services.http_client import http_get
     
     load_dotenv()
     api_key = os.getenv('GEOAPIFY_API_KEY')
@@ -13,7 +13,7 @@ def get_address(latitude, longitude):
     headers = CaseInsensitiveDict()
     headers["Accept"] = "application/json"
 
-    response = requests.get(url, headers=headers)
+    response = http_get('geoapify', url, headers=headers)
     location = response.json()['features'][0]['properties']
     
     address = {
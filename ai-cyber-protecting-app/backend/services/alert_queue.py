@@ -0,0 +1,310 @@
+"""
+Alert Queue for AI Cyber Protecting App
+Sends Red Zone alert emails from a background worker, so a security check only
+pays for putting the alert on a queue.
+
+The worker collects each user's alerts for ALERT_BATCH_WINDOW_SECONDS after the
+first one and sends them as one email. Repeats of the same alert (same geocode
+cell and risk factors) are merged within a batch, and not emailed again for
+ALERT_DEDUPE_SECONDS after they went out. Emails go over one reused SMTP session
+(email_service.SMTPConnection). A failed send is retried with exponential
+backoff, up to ALERT_MAX_ATTEMPTS times.
+
+Configuration confirmation codes go out through the same worker, unbatched.
+"""
+import heapq
+import itertools
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from services.email_service import (
+    CONFIRMATION_SUBJECT, build_message, compose_configuration_code, compose_red_alert, create_sender,
+    generate_security_code,
+)
+from services.metrics import get_counter
+from services.user_store import get_user_configuration, normalize_user_id
+
+ALERT_QUEUE_MAX_SIZE = int(os.getenv('ALERT_QUEUE_MAX_SIZE', 10000))
+ALERT_BATCH_WINDOW_SECONDS = float(os.getenv('ALERT_BATCH_WINDOW_SECONDS', 10))
+ALERT_DEDUPE_SECONDS = float(os.getenv('ALERT_DEDUPE_SECONDS', 15 * 60))
+ALERT_MAX_ATTEMPTS = int(os.getenv('ALERT_MAX_ATTEMPTS', 5))
+ALERT_RETRY_BASE_SECONDS = float(os.getenv('ALERT_RETRY_BASE_SECONDS', 2))
+ALERT_RETRY_MAX_SECONDS = float(os.getenv('ALERT_RETRY_MAX_SECONDS', 5 * 60))
+# Alerts within this many decimal degrees of each other count as the same place
+ALERT_LOCATION_PRECISION = int(os.getenv('ALERT_LOCATION_PRECISION', 3))
+
+ALERTS_METRIC = 'alerts_total'
+
+def _default_recipient(user_id):
+    config = get_user_configuration(user_id)
+    return config.get('alertEmail') if config else None
+
+class AlertBatch:
+    """A user's alerts that go out in one email."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.alerts = OrderedDict()  # alert key -> alert dict, see email_service.compose_red_alert
+        self.attempts = 0
+
+    def add(self, key, latitude, longitude, risk_factors, at):
+        alert = self.alerts.get(key)
+        if alert is None:
+            self.alerts[key] = {
+                'latitude': latitude, 'longitude': longitude, 'riskFactors': list(risk_factors),
+                'count': 1, 'time': datetime.fromtimestamp(at),
+            }
+        else:
+            alert['count'] += 1
+            alert['time'] = datetime.fromtimestamp(at)
+
+    @property
+    def description(self):
+        return f"alert email for user {self.user_id}"
+
+class PreparedEmail:
+    """An email composed by the caller, sent as soon as the worker gets to it."""
+
+    def __init__(self, recipient, subject, text_body, html_body, description):
+        """
+        Args:
+            description (str): What the email is, for log messages
+        """
+        self.recipient = recipient
+        self.subject = subject
+        self.text_body = text_body
+        self.html_body = html_body
+        self.description = description
+        self.attempts = 0
+
+class AlertQueue:
+    """Batches, dedupes and sends Red Zone alerts, and other emails, on a background thread."""
+
+    def __init__(self, sender, resolve_recipient=_default_recipient, window_seconds=ALERT_BATCH_WINDOW_SECONDS,
+                 dedupe_seconds=ALERT_DEDUPE_SECONDS, max_size=ALERT_QUEUE_MAX_SIZE):
+        """
+        Args:
+            sender: Has send(message) and a sender address, like email_service.SMTPConnection
+            resolve_recipient (callable): Takes a user id and returns the address to
+                                          alert, or None to drop their alerts
+        """
+        self.sender = sender
+        self.resolve_recipient = resolve_recipient
+        self.window_seconds = window_seconds
+        self.dedupe_seconds = dedupe_seconds
+        self._queue = queue.Queue(max_size)
+        self._collecting = {}  # user id -> AlertBatch still taking alerts
+        self._due = []  # heap of (time to send, sequence, AlertBatch or PreparedEmail)
+        self._sequence = itertools.count()
+        self._sending = None  # AlertBatch or PreparedEmail being sent
+        self._sent_keys = {}  # (user id, alert key) -> time it was last emailed
+        self._counts = {"enqueued": 0, "dropped": 0, "deduplicated": 0, "emailsSent": 0, "retries": 0, "failed": 0}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+        get_counter(ALERTS_METRIC, status=name).inc(amount)
+
+    def enqueue(self, user_id, latitude, longitude, risk_factors):
+        """
+        Queue a Red Zone alert for user_id without waiting for it to be sent.
+
+        Returns:
+            bool: False if the queue is full and the alert was dropped
+        """
+        try:
+            self._queue.put_nowait((user_id, latitude, longitude, tuple(risk_factors), time.time()))
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def enqueue_email(self, email):
+        """
+        Queue a PreparedEmail without waiting for it to be sent.
+
+        Returns:
+            bool: False if the queue is full and the email was dropped
+        """
+        try:
+            self._queue.put_nowait(email)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="alert-queue", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.process(block=True)
+            except Exception as e:
+                print(f"Alert queue failed: {e}")
+
+    def process(self, block=False):
+        """
+        Take queued alerts into their batches and send the batches that are due.
+
+        Args:
+            block (bool): Wait for the next alert or the next due batch first
+        """
+        timeout = None
+        if self._due:
+            timeout = max(0.0, self._due[0][0] - time.monotonic())
+        try:
+            item = self._queue.get(block=block, timeout=timeout if block else None)
+            while True:
+                if isinstance(item, PreparedEmail):
+                    self._schedule(item, 0)
+                else:
+                    self._collect(*item)
+                self._queue.task_done()
+                item = self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+        while self._due and self._due[0][0] <= time.monotonic():
+            _, _, item = heapq.heappop(self._due)
+            self._sending = item
+            try:
+                self._send(item)
+            finally:
+                self._sending = None
+
+    def _collect(self, user_id, latitude, longitude, risk_factors, at):
+        key = (round(latitude, ALERT_LOCATION_PRECISION), round(longitude, ALERT_LOCATION_PRECISION), risk_factors)
+        sent_at = self._sent_keys.get((user_id, key))
+        if sent_at is not None and at - sent_at < self.dedupe_seconds:
+            self._count("deduplicated")
+            return
+
+        batch = self._collecting.get(user_id)
+        if batch is None:
+            batch = self._collecting[user_id] = AlertBatch(user_id)
+            self._schedule(batch, self.window_seconds)
+        elif key in batch.alerts:
+            self._count("deduplicated")
+        batch.add(key, latitude, longitude, risk_factors, at)
+
+    def _schedule(self, batch, delay):
+        heapq.heappush(self._due, (time.monotonic() + delay, next(self._sequence), batch))
+
+    def _compose(self, item):
+        """
+        Returns:
+            MIMEMultipart: The email to send for item, or None if there is nobody to send it to
+        """
+        if isinstance(item, PreparedEmail):
+            return build_message(self.sender.sender, item.recipient, item.text_body, item.html_body, item.subject)
+        recipient = self.resolve_recipient(item.user_id)
+        if recipient is None:
+            return None # No alert email configured
+        text_body, html_body = compose_red_alert(list(item.alerts.values()), generate_security_code())
+        return build_message(self.sender.sender, recipient, text_body, html_body)
+
+    def _send(self, item):
+        # Alerts from now on start the user's next batch
+        if isinstance(item, AlertBatch) and self._collecting.get(item.user_id) is item:
+            del self._collecting[item.user_id]
+
+        try:
+            message = self._compose(item)
+            if message is None:
+                return
+            self.sender.send(message)
+        except Exception as e:
+            item.attempts += 1
+            if item.attempts >= ALERT_MAX_ATTEMPTS:
+                print(f"Giving up on {item.description} after {item.attempts} attempts: {e}")
+                self._count("failed")
+                return
+            delay = min(ALERT_RETRY_MAX_SECONDS, ALERT_RETRY_BASE_SECONDS * 2 ** (item.attempts - 1))
+            print(f"Sending {item.description} failed, retrying in {delay:.0f}s: {e}")
+            self._count("retries")
+            self._schedule(item, delay * random.uniform(0.5, 1.0)) # Jittered
+            return
+
+        self._count("emailsSent")
+        if isinstance(item, PreparedEmail):
+            return
+        batch = item
+        now = time.time()
+        for key in batch.alerts:
+            self._sent_keys[(batch.user_id, key)] = now
+        self._forget_sent(now)
+
+    def _forget_sent(self, now):
+        expired = [key for key, sent_at in self._sent_keys.items() if now - sent_at >= self.dedupe_seconds]
+        for key in expired:
+            del self._sent_keys[key]
+
+    def stats(self):
+        """
+        Returns:
+            dict: Alert counters, alerts not yet batched, batches not yet sent
+                  and SMTP sessions opened
+        """
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            **counts,
+            "queued": self._queue.unfinished_tasks,
+            "pendingBatches": len(self._due) + (self._sending is not None),
+            "smtpSessions": self.sender.sessions_opened,
+        }
+
+# Created on first use
+_alert_queue = None
+_alert_queue_lock = threading.Lock()
+
+def get_alert_queue():
+    global _alert_queue
+    with _alert_queue_lock:
+        if _alert_queue is None:
+            _alert_queue = AlertQueue(create_sender())
+    return _alert_queue
+
+def start_alert_queue():
+    """Start sending queued alerts in the background."""
+    get_alert_queue().start()
+
+def enqueue_red_alert(assessment, user_id, latitude, longitude):
+    """
+    Queue an alert email if the assessment put a user in the Red Zone.
+
+    Only users who saved an alert email with /api/configure-user are alerted.
+    Pass a user_id only once the check proved it with the user's token
+    (user_store.authenticate_user), or anyone could send them alerts.
+    """
+    if assessment.get('zone') != 'Red' or not user_id:
+        return
+    risk_factors = [description for status, description in assessment.get('reasons', []) if status == 'Bad']
+    get_alert_queue().enqueue(normalize_user_id(user_id), latitude, longitude, risk_factors)
+
+def enqueue_configuration_code(recipient, user_id, code):
+    """
+    Queue the email with the code that confirms a change to a user's configuration.
+
+    Returns:
+        bool: False if the queue is full and the email won't be sent
+    """
+    text_body, html_body = compose_configuration_code(user_id, code)
+    return get_alert_queue().enqueue_email(PreparedEmail(
+        recipient, CONFIRMATION_SUBJECT, text_body, html_body, f"confirmation code for user {user_id}"
+    ))
+
+def get_alert_queue_stats():
+    return get_alert_queue().stats()
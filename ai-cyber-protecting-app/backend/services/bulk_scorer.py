@@ -0,0 +1,197 @@
+"""
+Bulk Risk Scorer for AI Cyber Protecting App
+Replays historical location pings through the risk scoring engine, offline.
+
+Input is a CSV or Parquet file with latitude, longitude and ip columns, and an
+optional zipcode column. Rows are read in chunks, scored on a pool of worker
+processes with risk_calculator.calculate_risk_offline and written out in input
+order as each chunk finishes, so memory stays bounded however large the input is.
+The output has the input columns plus score, zone, reasons, actions (the last two
+as JSON) and error. Parquet support needs pyarrow.
+
+Nothing is looked up remotely: an IP is only classified if the network ranges
+table covers it (see services.network_ranges_updater), otherwise its network
+factor is "Unknown" and adds no points.
+
+Run from the backend directory:
+    python -m services.bulk_scorer pings.csv scored.csv --workers 8
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from services.network_service import NETWORK_RANGES_FILENAME, load_ip_classifier
+from services.risk_calculator import calculate_risk_offline
+
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', 10000))
+
+INPUT_COLUMNS = ['latitude', 'longitude', 'ip', 'zipcode']
+RESULT_COLUMNS = ['score', 'zone', 'reasons', 'actions', 'error']
+
+def _is_parquet(path):
+    return path.lower().endswith(('.parquet', '.pq'))
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Parquet files need pyarrow: pip install pyarrow")
+    return pyarrow
+
+def read_chunks(path, chunk_size):
+    """
+    Yield the input file in chunks of up to chunk_size rows.
+
+    Yields:
+        dict: Column name -> list of values, for each of INPUT_COLUMNS
+    """
+    if _is_parquet(path):
+        pyarrow = _import_pyarrow()
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        columns = [name for name in INPUT_COLUMNS if name in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            chunk = batch.to_pydict()
+            chunk.setdefault('zipcode', [None] * batch.num_rows)
+            yield chunk
+        return
+
+    with open(path, 'r', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, [])
+        positions = [header.index(name) if name in header else None for name in INPUT_COLUMNS]
+        while True:
+            rows = list(itertools.islice(reader, chunk_size))
+            if not rows:
+                return
+            yield {
+                name: [row[position] or None if position < len(row) else None for row in rows]
+                      if position is not None else [None] * len(rows)
+                for name, position in zip(INPUT_COLUMNS, positions)
+            }
+
+class ChunkWriter:
+    """Appends scored chunks to a CSV or Parquet file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._parquet_writer = None
+        self._file = None
+        self._csv_writer = None
+        if _is_parquet(path):
+            self._pyarrow = _import_pyarrow()
+        else:
+            self._file = open(path, 'w', newline='')
+            self._csv_writer = csv.writer(self._file)
+            self._csv_writer.writerow(INPUT_COLUMNS + RESULT_COLUMNS)
+
+    def write(self, chunk):
+        if self._csv_writer is not None:
+            self._csv_writer.writerows(zip(*(chunk[name] for name in INPUT_COLUMNS + RESULT_COLUMNS)))
+            return
+
+        table = self._pyarrow.table({name: chunk[name] for name in INPUT_COLUMNS + RESULT_COLUMNS})
+        if self._parquet_writer is None:
+            self._parquet_writer = self._pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self._parquet_writer.write_table(table)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+def score_chunk(chunk):
+    """
+    Score one chunk of rows; runs in a worker process.
+
+    Returns:
+        dict: The chunk with RESULT_COLUMNS added
+    """
+    records = []
+    errors = []
+    for latitude, longitude, ip, zipcode in zip(*(chunk[name] for name in INPUT_COLUMNS)):
+        try:
+            records.append((float(latitude), float(longitude), str(ip), str(zipcode) if zipcode else None))
+            errors.append(None)
+        except (ValueError, TypeError):
+            errors.append("Invalid latitude or longitude format")
+
+    assessments = iter(calculate_risk_offline(records))
+    for name in RESULT_COLUMNS:
+        chunk[name] = []
+    for error in errors:
+        assessment = next(assessments) if error is None else None
+        chunk['score'].append(assessment['score'] if assessment else None)
+        chunk['zone'].append(assessment['zone'] if assessment else None)
+        chunk['reasons'].append(json.dumps(assessment['reasons']) if assessment else None)
+        chunk['actions'].append(json.dumps(assessment['actions']) if assessment else None)
+        chunk['error'].append(error)
+    return chunk
+
+def score_file(input_path, output_path, workers=None, chunk_size=BULK_CHUNK_SIZE,
+               network_ranges=NETWORK_RANGES_FILENAME):
+    """
+    Score every row of input_path into output_path.
+
+    Args:
+        network_ranges (str): Network ranges table the workers classify IPs with
+
+    At most two chunks per worker are in flight, and finished chunks are written in
+    input order, so memory use doesn't grow with the input size.
+
+    Returns:
+        tuple: (rows scored, seconds taken)
+    """
+    workers = workers or os.cpu_count() or 1
+    writer = ChunkWriter(output_path)
+    in_flight = deque()
+    rows = 0
+    started_at = time.monotonic()
+
+    def write_oldest():
+        nonlocal rows
+        chunk = in_flight.popleft().result()
+        writer.write(chunk)
+        rows += len(chunk['score'])
+        elapsed = time.monotonic() - started_at
+        print(f"Scored {rows} rows ({rows / elapsed:.0f} rows/s)", file=sys.stderr)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_ip_classifier,
+                                 initargs=(network_ranges,)) as pool:
+            for chunk in read_chunks(input_path, chunk_size):
+                if len(in_flight) >= 2 * workers:
+                    write_oldest()
+                in_flight.append(pool.submit(score_chunk, chunk))
+            while in_flight:
+                write_oldest()
+    finally:
+        writer.close()
+
+    return rows, time.monotonic() - started_at
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Score historical location pings offline.",
+        epilog="Network types are resolved only for IPs inside the CIDR ranges of the network ranges table: "
+               "private ranges and the main blocks of large ISPs, cloud providers and mobile carriers. Other IPs "
+               "get an 'Unknown' network factor. Run python -m services.network_ranges_updater to add every "
+               "prefix the table's ASNs announce.",
+    )
+    parser.add_argument('input', help="CSV or Parquet file with latitude, longitude, ip and optional zipcode columns")
+    parser.add_argument('output', help="CSV or Parquet file to write the scored rows to")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE, help="Rows per chunk")
+    parser.add_argument('--network-ranges', default=NETWORK_RANGES_FILENAME,
+                        help="Network ranges table to classify IPs with (default: %(default)s)")
+    args = parser.parse_args()
+
+    rows, elapsed = score_file(args.input, args.output, args.workers, args.chunk_size, args.network_ranges)
+    print(f"Scored {rows} rows into {args.output} in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)")
@@ -0,0 +1,424 @@
+"""
+Cache Utilities for AI Cyber Protecting App
+Caches used to avoid repeating slow upstream lookups.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Database that processes on one host share as a second cache level, e.g. a file
+# in /dev/shm. server.py sets it so its workers reuse each other's lookups; when
+# unset, every process caches on its own.
+SHARED_CACHE_PATH = os.getenv('SHARED_CACHE_PATH')
+# Most entries kept per shared cache table
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv('SHARED_CACHE_MAX_ENTRIES', 100000))
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after a fixed time-to-live.
+
+    Tracks hit/miss counts so callers can report how much upstream traffic it saves.
+    An optional store (see open_shared_store) acts as a second level shared with
+    other processes: local misses are looked up in it and every set is written
+    through, so a value fetched by one worker serves all of them.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, store=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._store_writes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if it is missing or expired."""
+        value = self._get_local(key)
+        if value is not _MISSING:
+            return value
+        if self.store is None:
+            return default
+        # Query the shared level outside the lock, it may wait on another process
+        return self._remember_stored(key, self._get_stored(key), default)
+
+    async def get_async(self, key, default=None):
+        """Async version of get, which queries the shared level in a worker thread rather than on the event loop."""
+        value = self._get_local(key)
+        if value is not _MISSING:
+            return value
+        if self.store is None:
+            return default
+        return self._remember_stored(key, await asyncio.to_thread(self._get_stored, key), default)
+
+    def _get_local(self, key):
+        """Return the value cached in this process, or _MISSING."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            if self.store is None:
+                self.misses += 1
+            return _MISSING
+
+    def _remember_stored(self, key, stored, default):
+        with self._lock:
+            if stored is None:
+                self.misses += 1
+                return default
+            value, expires_in = stored
+            self._put(key, value, time.monotonic() + expires_in)
+            self.hits += 1
+            self.shared_hits += 1
+            return value
+
+    def _get_stored(self, key):
+        """
+        Returns:
+            tuple: (value, seconds until it expires) from the store, or None
+        """
+        try:
+            stored = self.store.get(key)
+        except sqlite3.Error as e:
+            print(f"Could not read shared cache entry {key}: {e}")
+            return None
+        if stored is None:
+            return None
+        expires_in = stored[1] + self.ttl_seconds - time.time()
+        return (stored[0], expires_in) if expires_in > 0 else None
+
+    def _put(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entry if full."""
+        prune = self._set_local(key, value)
+        if prune is not None:
+            self._set_stored(key, value, prune)
+
+    async def set_async(self, key, value):
+        """Async version of set, which writes to the shared level in a worker thread rather than on the event loop."""
+        prune = self._set_local(key, value)
+        if prune is not None:
+            await asyncio.to_thread(self._set_stored, key, value, prune)
+
+    def _set_local(self, key, value):
+        """
+        Returns:
+            bool: Whether the store is due for pruning, or None if there is no store
+        """
+        with self._lock:
+            self._put(key, value, time.monotonic() + self.ttl_seconds)
+            if self.store is None:
+                return None
+            self._store_writes += 1
+            return self._store_writes % self.max_size == 0
+
+    def _set_stored(self, key, value, prune: bool):
+        try:
+            self.store.set(key, value, time.time())
+            if prune:
+                self.store.prune(time.time() - self.ttl_seconds, SHARED_CACHE_MAX_ENTRIES)
+        except sqlite3.Error as e:
+            print(f"Could not write shared cache entry {key}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Size and hit/miss counters
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+            }
+            if self.store is not None:
+                stats["sharedHits"] = self.shared_hits
+            return stats
+
+class SQLiteCacheStore:
+    """
+    Persistent key/value layer for caches that should survive restarts.
+
+    Values are stored as JSON together with the time they were produced. The
+    database runs in WAL mode so reads are not blocked by a concurrent write, and
+    several processes can share it.
+    """
+
+    def __init__(self, path: str, table: str):
+        self.path = path
+        self.table = table
+        self._pid = None
+        self._connect()
+
+    def _connect(self):
+        """
+        Return this process's connection to the database.
+
+        A SQLite connection must not be used on both sides of a fork, so a forked
+        worker opens its own on first use.
+        """
+        if self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            with connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+                )
+            self._connection = connection
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        """
+        Returns:
+            tuple: (value, stored_at) or None if the key is not stored
+        """
+        connection = self._connect()
+        with self._lock:
+            row = connection.execute(
+                f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (str(key),)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def set(self, key, value, stored_at: float):
+        connection = self._connect()
+        with self._lock, connection:
+            connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at) VALUES (?, ?, ?)",
+                (str(key), json.dumps(value), stored_at)
+            )
+
+    def prune(self, stored_before: float, max_entries: int):
+        """Delete entries stored before stored_before, then the oldest ones beyond max_entries."""
+        connection = self._connect()
+        with self._lock, connection:
+            connection.execute(f"DELETE FROM {self.table} WHERE stored_at < ?", (stored_before,))
+            connection.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY stored_at DESC LIMIT -1 OFFSET ?)", (max_entries,)
+            )
+
+def open_shared_store(table: str):
+    """
+    Open a table of the SHARED_CACHE_PATH database, to pass as a TTLCache store.
+
+    Returns:
+        SQLiteCacheStore: The store, or None if no shared cache is configured or it can't be opened
+    """
+    if not SHARED_CACHE_PATH:
+        return None
+    try:
+        return SQLiteCacheStore(SHARED_CACHE_PATH, table)
+    except sqlite3.Error as e:
+        print(f"Could not open shared cache {SHARED_CACHE_PATH}, caching {table} per process: {e}")
+        return None
+
+class StaleWhileRevalidateCache:
+    """
+    Cache that never makes callers wait on the loader.
+
+    Entries younger than fresh_seconds are served as they are. Older entries, up to
+    fresh_seconds + stale_seconds, are still served immediately while a background
+    refresh replaces them. Misses return None and start a load in the background.
+    At most one load per key runs at a time. An optional store persists entries so
+    they survive restarts, and shares them with other processes using it.
+    """
+
+    def __init__(self, loader, executor, fresh_seconds: float, stale_seconds: float,
+                 max_size: int, store=None):
+        """
+        Args:
+            loader (callable): Takes a key and returns its value; raises on failure,
+                               in which case nothing is cached
+            executor: concurrent.futures executor that runs the loads
+        """
+        self.loader = loader
+        self.executor = executor
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        self.store = store
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries = TTLCache(max_size, fresh_seconds + stale_seconds)  # key -> (value, stored_at)
+        self._loading = set()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if self._needs_store(entry):
+            entry = self._lookup_stored(key, entry)
+        return entry
+
+    def _needs_store(self, entry):
+        # Another process sharing the store may have refreshed the entry since
+        return self.store is not None and (entry is None or time.time() - entry[1] >= self.fresh_seconds)
+
+    def _lookup_stored(self, key, entry):
+        """Return the newer of entry and the one in the store."""
+        try:
+            stored = self.store.get(key)
+        except sqlite3.Error as e:
+            print(f"Could not read shared cache entry {key}: {e}")
+            return entry
+        if stored is not None and (entry is None or stored[1] > entry[1]):
+            entry = stored
+            self._entries.set(key, entry)
+        return entry
+
+    def get(self, key, refresh: bool = True):
+        """
+        Return the cached value for key without blocking on the loader.
+
+        Args:
+            refresh (bool): Whether a stale or missing value starts a background load
+
+        Returns:
+            The value, or None if nothing usable is cached yet
+        """
+        return self._serve(key, self._lookup(key), refresh)
+
+    async def get_async(self, key, refresh: bool = True):
+        """Async version of get, which reads the store in a worker thread rather than on the event loop."""
+        entry = self._entries.get(key)
+        if self._needs_store(entry):
+            entry = await asyncio.to_thread(self._lookup_stored, key, entry)
+        return self._serve(key, entry, refresh)
+
+    def _serve(self, key, entry, refresh):
+        age = time.time() - entry[1] if entry is not None else None
+
+        if age is not None and age < self.fresh_seconds:
+            self.hits += 1
+            return entry[0]
+
+        if refresh:
+            self.refresh(key)
+        if age is not None and age < self.fresh_seconds + self.stale_seconds:
+            self.stale_hits += 1
+            return entry[0]
+
+        self.misses += 1
+        return None
+
+    def peek(self, key):
+        """Return the cached value for key regardless of its age, without refreshing it."""
+        entry = self._lookup(key)
+        return entry[0] if entry is not None else None
+
+    def age(self, key):
+        """Return how many seconds ago key's value was loaded, or None if it is not cached."""
+        entry = self._lookup(key)
+        return time.time() - entry[1] if entry is not None else None
+
+    def refresh(self, key):
+        """
+        Start loading key in the background unless a load is already running.
+
+        Returns:
+            Future of the load, which raises the loader's exception if it failed,
+            or None if one was already in flight
+        """
+        with self._lock:
+            if key in self._loading:
+                return None
+            self._loading.add(key)
+        return self.executor.submit(self._load, key, time.time())
+
+    def _load(self, key, requested_at):
+        try:
+            if self.store is not None:
+                stored = self.store.get(key)
+                if stored is not None and stored[1] >= requested_at:
+                    # Another process sharing the store refreshed it in the meantime
+                    self._entries.set(key, stored)
+                    return stored[0]
+            value = self.loader(key)
+            stored_at = time.time()
+            self._entries.set(key, (value, stored_at))
+            if self.store is not None:
+                self.store.set(key, value, stored_at)
+            return value
+        except Exception as e:
+            print(f"Could not refresh cache entry {key}: {e}")
+            raise
+        finally:
+            with self._lock:
+                self._loading.discard(key)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Size, hit/stale/miss counters and loads in flight
+        """
+        with self._lock:
+            loading = len(self._loading)
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "staleHits": self.stale_hits,
+            "misses": self.misses,
+            "loading": loading,
+        }
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one.
+
+    The first caller for a key runs the function; callers arriving while it runs
+    wait for and share its result (or exception) instead of repeating the work.
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> Future of the call in flight
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = function(*args)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
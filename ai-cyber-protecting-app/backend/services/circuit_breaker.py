@@ -0,0 +1,147 @@
+"""
+Circuit Breakers for AI Cyber Protecting App
+Fail fast on upstream dependencies that are erroring, instead of waiting on them.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+CIRCUIT_FAILURE_RATE_THRESHOLD = float(os.getenv('CIRCUIT_FAILURE_RATE_THRESHOLD', 0.5))
+CIRCUIT_MINIMUM_CALLS = int(os.getenv('CIRCUIT_MINIMUM_CALLS', 5))
+CIRCUIT_WINDOW_SECONDS = float(os.getenv('CIRCUIT_WINDOW_SECONDS', 30))
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', 15))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, name):
+        super().__init__(f"Circuit for {name} is open")
+        self.name = name
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of recent calls to one upstream.
+
+    Closed: calls go through. Once at least minimum_calls were made in the last
+    window_seconds and the share of failures reaches the threshold, the circuit
+    opens and calls are rejected immediately. After open_seconds it goes
+    half-open: the probe, if any, runs on a background thread (otherwise a single
+    trial call is let through), and its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, probe=None,
+                 failure_rate_threshold=CIRCUIT_FAILURE_RATE_THRESHOLD,
+                 minimum_calls=CIRCUIT_MINIMUM_CALLS,
+                 window_seconds=CIRCUIT_WINDOW_SECONDS,
+                 open_seconds=CIRCUIT_OPEN_SECONDS):
+        self.name = name
+        self.probe = probe
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._calls = deque()  # (timestamp, succeeded)
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Return True if a call to the upstream may go ahead right now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN or time.monotonic() - self._opened_at < self.open_seconds:
+                return False
+
+            self.state = self.HALF_OPEN
+            if self.probe is None:
+                return True # This call is the trial
+
+        threading.Thread(target=self._run_probe, name=f"{self.name}-probe", daemon=True).start()
+        return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._close()
+            self._record(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._open()
+                return
+            self._record(False)
+            calls = len(self._calls)
+            failures = sum(1 for _, succeeded in self._calls if not succeeded)
+            if self.state == self.CLOSED and calls >= self.minimum_calls \
+                    and failures / calls >= self.failure_rate_threshold:
+                print(f"Circuit for {self.name} opened ({failures}/{calls} recent calls failed)")
+                self._open()
+
+    def _record(self, succeeded):
+        now = time.monotonic()
+        self._calls.append((now, succeeded))
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+
+    def _close(self):
+        self.state = self.CLOSED
+        self._calls.clear()
+
+    def _run_probe(self):
+        try:
+            healthy = bool(self.probe())
+        except Exception as e:
+            print(f"Probe for {self.name} failed: {e}")
+            healthy = False
+
+        with self._lock:
+            if healthy:
+                print(f"Circuit for {self.name} closed")
+                self._close()
+            else:
+                self._open()
+
+    def stats(self):
+        with self._lock:
+            calls = len(self._calls)
+            failures = sum(1 for _, succeeded in self._calls if not succeeded)
+            return {
+                "state": self.state,
+                "recentCalls": calls,
+                "failureRate": failures / calls if calls else 0.0,
+            }
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Return the circuit breaker for an upstream, creating it on first use."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+def set_circuit_probe(name: str, probe):
+    """
+    Set the health check used while an upstream's circuit is half-open.
+
+    Args:
+        probe (callable): Takes no arguments and returns True if the upstream is healthy
+    """
+    get_circuit_breaker(name).probe = probe
+
+def get_circuit_breaker_stats():
+    """Return the state of every circuit breaker."""
+    return {name: breaker.stats() for name, breaker in list(_breakers.items())}
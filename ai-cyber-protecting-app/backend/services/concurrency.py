@@ -0,0 +1,132 @@
+"""
+Concurrency Utilities for AI Cyber Protecting App
+Shared thread pool (and its asyncio counterpart) for running independent upstream lookups side by side.
+"""
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError, wait
+
+SERVICE_POOL_WORKERS = int(os.getenv('SERVICE_POOL_WORKERS', 32))
+# Slow background work (e.g. LLM cache refreshes) gets its own pool so it can
+# never starve the lookups that requests are waiting on
+BACKGROUND_POOL_WORKERS = int(os.getenv('BACKGROUND_POOL_WORKERS', 4))
+
+_executor = ThreadPoolExecutor(max_workers=SERVICE_POOL_WORKERS, thread_name_prefix='service')
+_background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_POOL_WORKERS, thread_name_prefix='background')
+
+def get_background_executor():
+    """Return the shared pool for background work that no request waits on."""
+    return _background_executor
+
+class Stage:
+    """A lookup running on the shared pool, with its own deadline."""
+
+    def __init__(self, name: str, timeout: float, future: Future):
+        self.name = name
+        self.deadline = time.monotonic() + timeout
+        self.future = future
+
+    def result(self, default=None):
+        """
+        Wait for the lookup until its deadline.
+
+        Returns:
+            The lookup's result, or default if it failed or ran out of time
+        """
+        try:
+            return self.future.result(timeout=max(0.0, self.deadline - time.monotonic()))
+        except TimeoutError:
+            print(f"{self.name} timed out")
+        except Exception as e:
+            print(f"{self.name} failed: {e}")
+        return default
+
+def run_stage(name: str, timeout: float, function, *args, cached=None):
+    """
+    Start function(*args) on the shared pool and return its Stage.
+
+    Args:
+        cached (callable): Optional; called with args on the caller's thread first.
+                           If it returns anything but None, that is the stage's
+                           result and nothing is submitted, so cache hits never
+                           wait for a pool thread behind slow lookups.
+    """
+    if cached is not None:
+        value = cached(*args)
+        if value is not None:
+            future = Future()
+            future.set_result(value)
+            return Stage(name, timeout, future)
+    # Carry the caller's context over, so the lookup is traced as part of its request
+    return Stage(name, timeout, _executor.submit(contextvars.copy_context().run, function, *args))
+
+def iter_stages(stages):
+    """
+    Yield stages as each one finishes or reaches its deadline, whichever comes first.
+
+    Calling result() on a yielded stage never blocks.
+    """
+    pending = list(stages)
+    while pending:
+        timeout = max(0.0, min(stage.deadline for stage in pending) - time.monotonic())
+        wait([stage.future for stage in pending], timeout=timeout, return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+        for stage in [stage for stage in pending if stage.future.done() or stage.deadline <= now]:
+            pending.remove(stage)
+            yield stage
+
+def map_bounded(function, items, max_in_flight: int, default=None):
+    """
+    Run function on each item on the shared pool, never more than max_in_flight at once.
+
+    Returns:
+        list: Results in input order, with default for calls that failed
+    """
+    items = list(items)
+    context = contextvars.copy_context()
+    results = [default] * len(items)
+    pending = {}
+    next_index = 0
+    while next_index < len(items) or pending:
+        while next_index < len(items) and len(pending) < max_in_flight:
+            pending[_executor.submit(context.copy().run, function, items[next_index])] = next_index
+            next_index += 1
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                print(f"Batch lookup failed: {e}")
+    return results
+
+async def map_bounded_async(function, items, max_in_flight: int, default=None):
+    """Async version of map_bounded; function returns an awaitable."""
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def run(item):
+        async with semaphore:
+            try:
+                return await function(item)
+            except Exception as e:
+                print(f"Batch lookup failed: {e}")
+                return default
+
+    return list(await asyncio.gather(*(run(item) for item in items)))
+
+async def run_stage_async(name: str, timeout: float, awaitable, default=None):
+    """
+    Await a lookup with its own timeout.
+
+    Returns:
+        The lookup's result, or default if it failed or ran out of time
+    """
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        print(f"{name} timed out")
+    except Exception as e:
+        print(f"{name} failed: {e}")
+    return default
@@ -0,0 +1,24 @@
+"""
+Config for AI Cyber Protecting App
+Loads the environment once, before any service reads its settings.
+
+Services read their settings with os.getenv when they are imported, so the
+services package loads .env from its __init__, ahead of every service module.
+Variables already set in the environment take precedence over .env.
+"""
+import os
+
+from dotenv import load_dotenv
+
+_environment_loaded = False
+
+def load_environment():
+    """Load .env into the environment, the first time only."""
+    global _environment_loaded
+    if not _environment_loaded:
+        load_dotenv()
+        _environment_loaded = True
+
+def gemini_enabled() -> bool:
+    """Whether Gemini features (threat intel, safe location suggestions) are configured."""
+    return bool(os.getenv('GEMINI_API_KEY'))
@@ -1,82 +1,101 @@
 """
 Email Service for AI Cyber Protecting App
 Handles sending security alert emails for Red Zone incidents.
+
+Emails go out over SMTPConnection, which keeps one SMTP session open and reuses
+it, so STARTTLS and login happen once rather than per email. The alert queue
+(services/alert_queue.py) sends through it off the request path.
 """
+import html
 import os
 import smtplib
 import secrets
-from email.mime.text import MimeText
-from email.mime.multipart import MimeMultipart
+import threading
+import time
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 
+TARGET_EMAIL = os.getenv('TARGET_EMAIL', 'user@example.com')
+SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+SMTP_USERNAME = os.getenv('SMTP_USERNAME')
+SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'True').lower() == 'true'
+SMTP_TIMEOUT_SECONDS = float(os.getenv('SMTP_TIMEOUT_SECONDS', 10))
+# An open session unused for this long is closed and reopened on the next email,
+# before the server drops it on its side
+SMTP_IDLE_SECONDS = float(os.getenv('SMTP_IDLE_SECONDS', 60))
+# "smtp" to send emails, "console" to print them (the default without SMTP credentials)
+ALERT_EMAIL_DELIVERY = os.getenv('ALERT_EMAIL_DELIVERY', 'smtp' if SMTP_USERNAME and SMTP_PASSWORD else 'console')
+
+SUBJECT = "🚨 SECURITY ALERT: Red Zone Detected"
+CONFIRMATION_SUBJECT = "Confirm your AI Cyber Protection settings"
+ACTIONS = [
+    "Enable VPN immediately",
+    "Verify 2-Factor Authentication is active",
+    "Avoid accessing sensitive accounts",
+    "Consider relocating to a secure location",
+]
+
 def generate_security_code():
     """Generate a random 6-digit security code."""
     return f"{secrets.randbelow(900000) + 100000}"
 
-def send_red_alert_email(user_location, risk_factors):
+def compose_red_alert(alerts, security_code):
     """
-    Send a Red Zone security alert email.
-    
+    Write the text and HTML bodies of a Red Zone alert email.
+
     Args:
-        user_location (dict): User's location information
-        risk_factors (list): List of identified risk factors
-    
+        alerts (list): One dict per distinct Red Zone check, with latitude,
+                       longitude, riskFactors (list of str), count (checks it
+                       stands for) and time (datetime of the latest one)
+        security_code (str): Code the user can quote to support
+
     Returns:
-        dict: Email sending result with success status and security code
+        tuple: (text body, HTML body)
     """
-    try:
-        # Generate security code
-        security_code = generate_security_code()
-        
-        # Get email configuration from environment
-        target_email = os.getenv('TARGET_EMAIL', 'user@example.com')
-        smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-        smtp_port = int(os.getenv('SMTP_PORT', 587))
-        smtp_username = os.getenv('SMTP_USERNAME')
-        smtp_password = os.getenv('SMTP_PASSWORD')
-        
-        # Create email content
-        subject = "🚨 SECURITY ALERT: Red Zone Detected"
-        
-        # Format location info
-        city = user_location.get('city', 'Unknown')
-        lat = user_location.get('coordinates', {}).get('latitude', 'N/A')
-        lon = user_location.get('coordinates', {}).get('longitude', 'N/A')
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        # Create HTML email body
-        html_body = f"""
-        <html>
-        <body>
-            <h2 style="color: #dc2626;">🚨 SECURITY ALERT</h2>
-            <p><strong>Time:</strong> {timestamp}</p>
-            <p><strong>Security Code:</strong> <span style="font-size: 18px; font-weight: bold; color: #dc2626;">{security_code}</span></p>
-            
+    html_sections = []
+    text_sections = []
+    for alert in alerts:
+        lat = alert.get('latitude', 'N/A')
+        lon = alert.get('longitude', 'N/A')
+        timestamp = alert['time'].strftime("%Y-%m-%d %H:%M:%S")
+        repeated = f" ({alert['count']} checks)" if alert.get('count', 1) > 1 else ""
+
+        html_sections.append(f"""
             <h3>Location Information:</h3>
             <ul>
-                <li><strong>City:</strong> {city}</li>
+                <li><strong>Time:</strong> {timestamp}{repeated}</li>
                 <li><strong>Coordinates:</strong> {lat}, {lon}</li>
                 <li><strong>Maps Link:</strong> <a href="https://maps.google.com/maps?q={lat},{lon}">View on Google Maps</a></li>
             </ul>
-            
+
             <h3>Risk Factors Detected:</h3>
             <ul>
-        """
-        
-        for factor in risk_factors:
-            html_body += f"<li>{factor}</li>"
-        
-        html_body += """
+                {"".join(f"<li>{factor}</li>" for factor in alert['riskFactors'])}
             </ul>
-            
+        """)
+        text_sections.append(f"""
+Location Information:
+- Time: {timestamp}{repeated}
+- Coordinates: {lat}, {lon}
+- Maps Link: https://maps.google.com/maps?q={lat},{lon}
+
+Risk Factors Detected:
+""" + "".join(f"- {factor}\n" for factor in alert['riskFactors']))
+
+    html_body = f"""
+        <html>
+        <body>
+            <h2 style="color: #dc2626;">🚨 SECURITY ALERT</h2>
+            <p><strong>Security Code:</strong> <span style="font-size: 18px; font-weight: bold; color: #dc2626;">{security_code}</span></p>
+            {"".join(html_sections)}
             <h3>Immediate Actions Required:</h3>
             <ul>
-                <li>✅ Enable VPN immediately</li>
-                <li>✅ Verify 2-Factor Authentication is active</li>
-                <li>✅ Avoid accessing sensitive accounts</li>
-                <li>✅ Consider relocating to a secure location</li>
+                {"".join(f"<li>✅ {action}</li>" for action in ACTIONS)}
             </ul>
-            
+
             <p style="color: #dc2626; font-weight: bold;">
                 This alert was automatically generated by your AI Cyber Protection system.
                 If you did not request this alert, please contact support immediately.
@@ -84,78 +103,172 @@ def send_red_alert_email(user_location, risk_factors):
         </body>
         </html>
         """
-        
-        # Create plain text version
-        text_body = f"""
+
+    text_body = f"""
 SECURITY ALERT - Red Zone Detected
 
-Time: {timestamp}
 Security Code: {security_code}
-
-Location Information:
-- City: {city}
-- Coordinates: {lat}, {lon}
-- Maps Link: https://maps.google.com/maps?q={lat},{lon}
-
-Risk Factors Detected:
-"""
-        for factor in risk_factors:
-            text_body += f"- {factor}\n"
-        
-        text_body += """
+{"".join(text_sections)}
 Immediate Actions Required:
-- Enable VPN immediately
-- Verify 2-Factor Authentication is active
-- Avoid accessing sensitive accounts
-- Consider relocating to a secure location
-
+""" + "".join(f"- {action}\n" for action in ACTIONS) + """
 This alert was automatically generated by your AI Cyber Protection system.
 """
-        
-        # For development/demo purposes, print to console instead of sending real email
-        if not smtp_username or not smtp_password:
-            print("=" * 60)
-            print("📧 RED ZONE ALERT EMAIL (CONSOLE OUTPUT FOR DEMO)")
-            print("=" * 60)
-            print(f"To: {target_email}")
-            print(f"Subject: {subject}")
-            print(f"Security Code: {security_code}")
-            print("-" * 60)
-            print(text_body)
-            print("=" * 60)
-            
-            return {
-                "success": True,
-                "security_code": security_code,
-                "message": "Alert email printed to console (demo mode)",
-                "email_sent": True
-            }
-        
-        # Send actual email if SMTP credentials are provided
-        msg = MimeMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = smtp_username
-        msg['To'] = target_email
-        
-        # Attach both plain text and HTML versions
-        part1 = MimeText(text_body, 'plain')
-        part2 = MimeText(html_body, 'html')
-        msg.attach(part1)
-        msg.attach(part2)
-        
-        # Send email
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_username, smtp_password)
-            server.send_message(msg)
-        
+    return text_body, html_body
+
+def build_message(sender, recipient, text_body, html_body, subject=SUBJECT):
+    """Build a multipart email with plain text and HTML versions of the alert."""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = recipient
+
+    # Attach both plain text and HTML versions
+    msg.attach(MIMEText(text_body, 'plain'))
+    msg.attach(MIMEText(html_body, 'html'))
+    return msg
+
+class SMTPConnection:
+    """
+    A reused SMTP session.
+
+    The session is opened on the first email and kept for the next ones. It is
+    reopened when it has been idle for SMTP_IDLE_SECONDS, or once when the server
+    turns out to have dropped it.
+    """
+
+    def __init__(self, host=SMTP_SERVER, port=SMTP_PORT, username=SMTP_USERNAME, password=SMTP_PASSWORD,
+                 starttls=SMTP_STARTTLS, timeout=SMTP_TIMEOUT_SECONDS):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.sender = username or TARGET_EMAIL
+        self.sessions_opened = 0
+        self._smtp = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self.sessions_opened += 1
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                self._smtp.close()
+            self._smtp = None
+
+    def send(self, message):
+        """
+        Send a message on the open session, opening one if needed.
+
+        Raises:
+            smtplib.SMTPException, OSError: If the message could not be sent
+        """
+        with self._lock:
+            if self._smtp is not None and time.monotonic() - self._last_used > SMTP_IDLE_SECONDS:
+                self._close()
+            for attempt in range(2):
+                if self._smtp is None:
+                    self._open()
+                try:
+                    self._smtp.send_message(message)
+                    self._last_used = time.monotonic()
+                    return
+                except smtplib.SMTPServerDisconnected:
+                    self._smtp = None
+                    if attempt:
+                        raise
+                except OSError:
+                    # Broken socket: don't reuse the session, let the caller retry
+                    self._smtp.close()
+                    self._smtp = None
+                    raise
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+class ConsoleSender:
+    """Prints emails instead of sending them, for development and demos."""
+
+    sender = TARGET_EMAIL
+    sessions_opened = 0
+
+    def send(self, message):
+        print("=" * 60)
+        print("📧 EMAIL (CONSOLE OUTPUT FOR DEMO)")
+        print("=" * 60)
+        print(f"To: {message['To']}")
+        print(f"Subject: {message['Subject']}")
+        print("-" * 60)
+        print(message.get_payload(0).get_payload(decode=True).decode())
+        print("=" * 60)
+
+    def close(self):
+        pass
+
+def create_sender():
+    """Return the sender ALERT_EMAIL_DELIVERY asks for."""
+    return SMTPConnection() if ALERT_EMAIL_DELIVERY == 'smtp' else ConsoleSender()
+
+# Shared by direct calls to send_red_alert_email, created on first use
+_sender = None
+
+def send_red_alert_email(user_location, risk_factors):
+    """
+    Send a Red Zone security alert email right away, on the calling thread.
+
+    Request handlers should enqueue alerts with alert_queue.enqueue_red_alert
+    instead, which doesn't wait on SMTP.
+
+    Args:
+        user_location (dict): User's location information
+        risk_factors (list): List of identified risk factors
+
+    Returns:
+        dict: Email sending result with success status and security code
+    """
+    global _sender
+    try:
+        # Generate security code
+        security_code = generate_security_code()
+
+        coordinates = user_location.get('coordinates', {})
+        alert = {
+            'latitude': coordinates.get('latitude', 'N/A'),
+            'longitude': coordinates.get('longitude', 'N/A'),
+            'riskFactors': list(risk_factors),
+            'time': datetime.now(),
+        }
+        text_body, html_body = compose_red_alert([alert], security_code)
+
+        if _sender is None:
+            _sender = create_sender()
+        _sender.send(build_message(_sender.sender, TARGET_EMAIL, text_body, html_body))
+
         return {
             "success": True,
             "security_code": security_code,
             "message": "Red Zone alert email sent successfully",
             "email_sent": True
         }
-        
+
     except Exception as e:
         print(f"Email sending failed: {str(e)}")
         return {
@@ -164,3 +277,44 @@ This alert was automatically generated by your AI Cyber Protection system.
             "message": f"Failed to send alert email: {str(e)}",
             "email_sent": False
         }
+
+def compose_configuration_code(user_id, code):
+    """
+    Compose the email with the code that confirms a change to a user's configuration.
+
+    Returns:
+        tuple: (text body, html body)
+    """
+    text_body = f"""Someone asked to change the alert email and safe locations of {user_id}.
+
+Confirmation code: {code}
+
+Enter it to apply the change. If it wasn't you, ignore this email and nothing changes.
+"""
+    html_body = f"""
+<html>
+<body style="font-family: Arial, sans-serif;">
+    <p>Someone asked to change the alert email and safe locations of <strong>{html.escape(user_id)}</strong>.</p>
+    <p>Confirmation code: <strong>{code}</strong></p>
+    <p>Enter it to apply the change. If it wasn't you, ignore this email and nothing changes.</p>
+</body>
+</html>
+"""
+    return text_body, html_body
+
+def send_configuration_code(recipient, user_id, code):
+    """
+    Email the code that confirms a change to a user's configuration, right away,
+    on the calling thread.
+
+    Request handlers should queue it with alert_queue.enqueue_configuration_code
+    instead, which doesn't wait on SMTP.
+
+    Raises:
+        smtplib.SMTPException, OSError: If the email could not be sent
+    """
+    global _sender
+    text_body, html_body = compose_configuration_code(user_id, code)
+    if _sender is None:
+        _sender = create_sender()
+    _sender.send(build_message(_sender.sender, recipient, text_body, html_body, CONFIRMATION_SUBJECT))
@@ -0,0 +1,41 @@
+"""
+Gemini Client for AI Cyber Protecting App
+Shared Gemini model for the threat and safe location services.
+
+The Gemini SDK takes longer to import than the rest of the backend put together,
+so it is only imported when the model is first needed, and only if GEMINI_API_KEY
+is set.
+"""
+import os
+import threading
+
+from services.config import gemini_enabled
+
+GEMINI_MODEL_NAME = os.getenv('GEMINI_MODEL_NAME', 'gemini-2.5-flash')
+
+_model = None
+_model_lock = threading.Lock()
+
+def get_gemini_model():
+    """
+    Return the shared Gemini model, importing and configuring the SDK on first use.
+
+    Returns:
+        genai.GenerativeModel: The model, or None if GEMINI_API_KEY is not set or
+                               the SDK could not be configured
+    """
+    global _model
+    if _model is not None or not gemini_enabled():
+        return _model
+
+    with _model_lock:
+        if _model is None:
+            try:
+                import google.generativeai as genai
+
+                genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+                _model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+                print("Gemini client initialized successfully.")
+            except Exception as e:
+                print(f"Error initializing Gemini client: {e}")
+    return _model
@@ -0,0 +1,208 @@
+"""
+HTTP Client for AI Cyber Protecting App
+Shared outbound HTTP layer used by every service: pooled keep-alive connections,
+per-host connection limits, connect/read timeouts, jittered retries and
+per-upstream latency histograms.
+"""
+import asyncio
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+from services.circuit_breaker import CircuitOpenError, get_circuit_breaker
+from services.metrics import get_counter, get_histogram, summarize_histograms
+
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 200))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv('HTTP_MAX_CONNECTIONS_PER_HOST', 20))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv('HTTP_CONNECT_TIMEOUT_SECONDS', 3))
+HTTP_READ_TIMEOUT_SECONDS = float(os.getenv('HTTP_READ_TIMEOUT_SECONDS', 5))
+
+# Retries for transient failures: attempt n waits a random time up to
+# min(HTTP_RETRY_MAX_BACKOFF_SECONDS, HTTP_RETRY_BACKOFF_SECONDS * 2**n) ("full jitter")
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 2))
+HTTP_RETRY_BACKOFF_SECONDS = float(os.getenv('HTTP_RETRY_BACKOFF_SECONDS', 0.2))
+HTTP_RETRY_MAX_BACKOFF_SECONDS = float(os.getenv('HTTP_RETRY_MAX_BACKOFF_SECONDS', 2))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+UPSTREAM_LATENCY_METRIC = 'upstream_request_seconds'
+# Labelled with the HTTP status code, "error" for transport errors or "circuit_open"
+UPSTREAM_RESPONSES_METRIC = 'upstream_responses_total'
+
+_session = None
+_async_client = None
+_async_host_limits = {}
+
+def _retry_delay(attempt: int) -> float:
+    return random.uniform(0, min(HTTP_RETRY_MAX_BACKOFF_SECONDS, HTTP_RETRY_BACKOFF_SECONDS * 2 ** attempt))
+
+def _observe(upstream: str, started: float, status):
+    get_histogram(UPSTREAM_LATENCY_METRIC, upstream=upstream).observe(time.perf_counter() - started)
+    get_counter(UPSTREAM_RESPONSES_METRIC, upstream=upstream, status=str(status)).inc()
+
+def get_session():
+    """
+    Return the process-wide requests session, creating it on first use.
+
+    Connections are kept alive and reused across requests, so only the first call
+    to each upstream pays for the TCP/TLS handshake. Each host gets a pool of at
+    most HTTP_MAX_CONNECTIONS_PER_HOST connections; further callers wait for one.
+
+    requests is only imported here, since only the Flask serving mode uses it.
+    """
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=HTTP_MAX_CONNECTIONS // HTTP_MAX_CONNECTIONS_PER_HOST,
+            pool_maxsize=HTTP_MAX_CONNECTIONS_PER_HOST,
+            pool_block=True
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session = session
+    return _session
+
+def _allow(upstream: str, circuit_breaker: bool):
+    breaker = get_circuit_breaker(upstream) if circuit_breaker else None
+    if breaker is not None and not breaker.allow_request():
+        get_counter(UPSTREAM_RESPONSES_METRIC, upstream=upstream, status="circuit_open").inc()
+        raise CircuitOpenError(upstream)
+    return breaker
+
+def _record(breaker, response):
+    if breaker is None:
+        return
+    if response is None or response.status_code in RETRY_STATUS_CODES:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+def http_get(upstream: str, url: str, circuit_breaker: bool = True, **kwargs):
+    """
+    GET a URL on the shared session, retrying transient failures.
+
+    Args:
+        upstream (str): Name of the upstream service, used to label latency metrics
+                        and to pick its circuit breaker
+        circuit_breaker (bool): Set to False to bypass the circuit breaker, e.g. in probes
+        **kwargs: Passed through to requests (headers, params, ...)
+
+    Returns:
+        requests.Response: The last response; callers check its status as usual
+
+    Raises:
+        CircuitOpenError: If the upstream's circuit is open
+        requests.RequestException: If the last attempt failed to get a response
+    """
+    breaker = _allow(upstream, circuit_breaker)
+    try:
+        response = _http_get_with_retries(upstream, url, **kwargs)
+    except Exception:
+        _record(breaker, None)
+        raise
+    _record(breaker, response)
+    return response
+
+def _http_get_with_retries(upstream: str, url: str, **kwargs):
+    import requests # Imported on first use, see get_session
+
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_READ_TIMEOUT_SECONDS))
+
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            response = get_session().get(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            _observe(upstream, started, "error")
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+        else:
+            _observe(upstream, started, response.status_code)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == HTTP_MAX_RETRIES:
+                return response
+        time.sleep(_retry_delay(attempt))
+
+def get_async_client():
+    """
+    Return the process-wide async HTTP client, creating it on first use.
+
+    Connections are kept alive and reused across requests, so only the first
+    call to each upstream pays for the TCP/TLS handshake.
+
+    httpx is only imported here, since only the ASGI serving mode uses it.
+    """
+    global _async_client
+    if _async_client is None:
+        import httpx
+
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS
+            ),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS)
+        )
+    return _async_client
+
+def _async_host_limit(url: str):
+    # httpx only limits connections globally, so cap each host with a semaphore
+    host = urlsplit(url).netloc
+    limit = _async_host_limits.get(host)
+    if limit is None:
+        limit = _async_host_limits[host] = asyncio.Semaphore(HTTP_MAX_CONNECTIONS_PER_HOST)
+    return limit
+
+async def http_get_async(upstream: str, url: str, circuit_breaker: bool = True, **kwargs):
+    """
+    Async version of http_get, on the pooled async client.
+
+    Raises:
+        CircuitOpenError: If the upstream's circuit is open
+        httpx.HTTPError: If the last attempt failed to get a response
+    """
+    breaker = _allow(upstream, circuit_breaker)
+    try:
+        response = await _http_get_with_retries_async(upstream, url, **kwargs)
+    except BaseException:
+        # Includes cancellation by a stage timeout, which also means the upstream is too slow
+        _record(breaker, None)
+        raise
+    _record(breaker, response)
+    return response
+
+async def _http_get_with_retries_async(upstream: str, url: str, **kwargs):
+    import httpx # Imported on first use, see get_async_client
+
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            async with _async_host_limit(url):
+                response = await get_async_client().get(url, **kwargs)
+        except httpx.TransportError:
+            _observe(upstream, started, "error")
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+        else:
+            _observe(upstream, started, response.status_code)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == HTTP_MAX_RETRIES:
+                return response
+        await asyncio.sleep(_retry_delay(attempt))
+
+async def close_async_client():
+    """Close the async HTTP client and its pooled connections."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    _async_host_limits.clear()
+
+def get_upstream_latency_stats():
+    """
+    Returns:
+        dict: Request count and approximate p50/p95/p99 latency per upstream
+    """
+    return summarize_histograms(UPSTREAM_LATENCY_METRIC, 'upstream')
@@ -0,0 +1,108 @@
+"""
+IP Classifier for AI Cyber Protecting App
+Maps IP addresses to network types locally using a CIDR/ASN table and a prefix trie.
+
+The table (database/network_ranges) holds one rule per line, "<CIDR or ASN>|<network type>",
+where the network type is one of the names in network_service.NETWORK_TYPE:
+
+    10.0.0.0/8|Residential/Private Network
+    AS16509|VPN/Proxy Network
+
+Blank lines and lines starting with "#" are ignored.
+"""
+import ipaddress
+
+class PrefixTrie:
+    """
+    Binary trie over address bits answering longest-prefix-match queries.
+
+    Nodes live in flat lists rather than objects: node i has children
+    _children[i] = [zero_child, one_child] (0 meaning none) and an optional value.
+    A lookup walks at most one node per address bit, so it costs O(prefix length).
+    """
+
+    def __init__(self, address_bits: int):
+        self.address_bits = address_bits
+        self._children = [[0, 0]]
+        self._values = [None]
+
+    def insert(self, network, value):
+        """Associate value with every address inside network (an ipaddress network)."""
+        address = int(network.network_address)
+        node = 0
+        for depth in range(network.prefixlen):
+            bit = (address >> (self.address_bits - 1 - depth)) & 1
+            child = self._children[node][bit]
+            if not child:
+                child = len(self._children)
+                self._children.append([0, 0])
+                self._values.append(None)
+                self._children[node][bit] = child
+            node = child
+        self._values[node] = value
+
+    def lookup(self, address: int):
+        """Return the value of the longest prefix containing address, or None."""
+        children = self._children
+        values = self._values
+        node = 0
+        match = values[0]
+        for shift in range(self.address_bits - 1, -1, -1):
+            node = children[node][(address >> shift) & 1]
+            if not node:
+                break
+            if values[node] is not None:
+                match = values[node]
+        return match
+
+class IPClassifier:
+    """Longest-prefix CIDR rules plus an ASN lookup table, compiled from a rules file."""
+
+    def __init__(self, rules):
+        """
+        Args:
+            rules (list): (CIDR or "AS<number>", value) pairs
+        """
+        self._tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+        self._asns = {}
+        for target, value in rules:
+            if target.upper().startswith('AS'):
+                self._asns[int(target[2:])] = value
+            else:
+                network = ipaddress.ip_network(target, strict=False)
+                self._tries[network.version].insert(network, value)
+
+    @classmethod
+    def from_file(cls, filename, values=None):
+        """
+        Compile a classifier from a rules file.
+
+        Args:
+            values (dict): Optional mapping applied to each rule's value, e.g. network
+                           type name to code. Names missing from it raise ValueError.
+        """
+        rules = []
+        with open(filename, 'r') as file:
+            for line in file:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                target, value = (part.strip() for part in line.split("|", 1))
+                if values is not None:
+                    if value not in values:
+                        raise ValueError(f"Unknown value {value!r} for {target} in {filename}")
+                    value = values[value]
+                rules.append((target, value))
+        return cls(rules)
+
+    def classify_ip(self, ip_address: str):
+        """Return the value of the most specific CIDR rule covering ip_address, or None."""
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+        return self._tries[address.version].lookup(int(address))
+
+    def classify_asn(self, asn: int):
+        """Return the value of the rule for an autonomous system number, or None."""
+        return self._asns.get(asn)
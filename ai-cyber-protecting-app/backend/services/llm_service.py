@@ -4,12 +4,33 @@ Provides AI-powered security recommendations using OpenAI's API.
 """
 import json
 import os
+import threading
 from datetime import datetime
-import google.generativeai as genai
+
+from services.cache import TTLCache
+from services.concurrency import get_background_executor
+from services.config import gemini_enabled
+from services.gemini_client import get_gemini_model
+from services.metrics import register_cache
+from services.tracing import traced
 
 # Global variable for the Gemini model, initialized to None
 model = None
 
+# Suggestions are shared by everyone in the same coarse cell (~2km) during the same
+# hours of the day, since what is open nearby changes over the day
+SAFE_LOCATIONS_CELL_DEGREES = float(os.getenv('SAFE_LOCATIONS_CELL_DEGREES', 0.02))
+SAFE_LOCATIONS_HOURS_PER_BUCKET = int(os.getenv('SAFE_LOCATIONS_HOURS_PER_BUCKET', 2))
+SAFE_LOCATIONS_CACHE_SIZE = int(os.getenv('SAFE_LOCATIONS_CACHE_SIZE', 2048))
+# A cell whose suggestions failed to generate isn't retried for this long
+SAFE_LOCATIONS_ERROR_TTL_SECONDS = float(os.getenv('SAFE_LOCATIONS_ERROR_TTL_SECONDS', 60))
+
+_safe_locations_cache = TTLCache(SAFE_LOCATIONS_CACHE_SIZE, SAFE_LOCATIONS_HOURS_PER_BUCKET * 60 * 60)
+register_cache('safe_locations', _safe_locations_cache.stats)
+_safe_locations_errors = TTLCache(SAFE_LOCATIONS_CACHE_SIZE, SAFE_LOCATIONS_ERROR_TTL_SECONDS)
+_safe_locations_loading = set()
+_safe_locations_lock = threading.Lock()
+
 def initialize_gemini_client():
     """
     Initializes the Gemini client and model using the API key from environment variables.
@@ -18,24 +39,32 @@ def initialize_gemini_client():
         bool: True if initialization is successful, False otherwise.
     """
     global model
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
+    if not gemini_enabled():
         print("Error: GEMINI_API_KEY environment variable not found.")
         return False
-    
-    try:
-        genai.configure(api_key=api_key)
-        # Use a stable, recommended model
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        print("Gemini client initialized successfully.")
-        return True
-    except Exception as e:
-        print(f"Error initializing Gemini client: {e}")
-        return False
 
+    model = get_gemini_model()
+    return model is not None
+
+def _safe_locations_cell(latitude: float, longitude: float):
+    """
+    Returns:
+        tuple: (cache key, cell centre latitude, cell centre longitude)
+    """
+    row = round(latitude / SAFE_LOCATIONS_CELL_DEGREES)
+    column = round(longitude / SAFE_LOCATIONS_CELL_DEGREES)
+    hour_bucket = datetime.now().hour // SAFE_LOCATIONS_HOURS_PER_BUCKET
+    return (row, column, hour_bucket), row * SAFE_LOCATIONS_CELL_DEGREES, column * SAFE_LOCATIONS_CELL_DEGREES
+
+@traced('suggest_safe_locations')
 def suggest_safe_locations(latitude: float, longitude: float) -> dict:
     """
-    Finds nearby safe locations with good Wi-Fi using the Gemini API.
+    Finds nearby safe locations with good Wi-Fi using the Gemini API, without waiting on it.
+
+    Results are cached per coarse cell and hour-of-day bucket. On a miss no
+    locations are suggested, and a single Gemini call per cell fills the cache
+    in the background for the checks that follow. Failures are cached for
+    SAFE_LOCATIONS_ERROR_TTL_SECONDS.
 
     Args:
         lat (float): The user's current latitude.
@@ -44,12 +73,54 @@ def suggest_safe_locations(latitude: float, longitude: float) -> dict:
     Returns:
         dict: A dictionary containing a list of suggested locations or an error.
     """
+    if not gemini_enabled():
+        return {"error": "LLM client is not initialized."}
+
+    key, cell_latitude, cell_longitude = _safe_locations_cell(latitude, longitude)
+    cached = _safe_locations_cache.get(key)
+    if cached is None:
+        cached = _safe_locations_errors.get(key)
+    if cached is not None:
+        return cached
+
+    with _safe_locations_lock:
+        if key in _safe_locations_loading:
+            return {"suggestedLocations": []}
+        _safe_locations_loading.add(key)
+    get_background_executor().submit(_fill_safe_locations, key, cell_latitude, cell_longitude)
+    return {"suggestedLocations": []}
 
+def _fill_safe_locations(key, latitude: float, longitude: float):
+    try:
+        locations_data = _generate_safe_locations(latitude, longitude)
+        if "error" in locations_data:
+            _safe_locations_errors.set(key, locations_data)
+        else:
+            _safe_locations_cache.set(key, locations_data)
+    finally:
+        with _safe_locations_lock:
+            _safe_locations_loading.discard(key)
+
+@traced('generate_safe_locations')
+def _generate_safe_locations(latitude: float, longitude: float) -> dict:
     global model
     if not model:
         if not initialize_gemini_client():
             return {"error": "LLM client is not initialized."}
 
+    prompt = _build_safe_locations_prompt(latitude, longitude)
+    try:
+        response = model.generate_content(prompt)
+        return _parse_safe_locations_response(response)
+    except Exception as e:
+        print(f"Error calling Gemini API for safe locations: {e}")
+        return {"error": "Failed to generate safe location data."}
+
+def get_safe_locations_cache_stats():
+    """Return hit/miss counters for the safe location suggestion cache."""
+    return _safe_locations_cache.stats()
+
+def _build_safe_locations_prompt(latitude: float, longitude: float) -> str:
     # Context provided by the user
     current_time = datetime.now()
 
@@ -87,15 +158,13 @@ def suggest_safe_locations(latitude: float, longitude: float) -> dict:
     }}
     Generate the JSON object now for the user's location.
     """
-    try:
-        response = model.generate_content(prompt)
-        json_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        locations_data = json.loads(json_text)
-        print("Successfully generated safe locations from Gemini.")
-        return locations_data
-    except Exception as e:
-        print(f"Error calling Gemini API for safe locations: {e}")
-        return {"error": "Failed to generate safe location data."}
+    return prompt
+
+def _parse_safe_locations_response(response) -> dict:
+    json_text = response.text.strip().replace("```json", "").replace("```", "").strip()
+    locations_data = json.loads(json_text)
+    print("Successfully generated safe locations from Gemini.")
+    return locations_data
 
 def generate_static_recommendations(zone, risk_factors, location_context, threat_data):
     """
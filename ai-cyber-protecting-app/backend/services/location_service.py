@@ -2,38 +2,264 @@
 Location Service for AI Cyber Protecting App
 Provides location-based utilities including city lookup and distance calculations.
 """
+import asyncio
 import os
-from dotenv import load_dotenv
-
-import requests
-from requests.structures import CaseInsensitiveDict
 
 import math
+import threading
+import time
+
+import numpy as np
+
+from services.cache import TTLCache, open_shared_store
+from services.circuit_breaker import set_circuit_probe
+from services.http_client import http_get, http_get_async
+from services.metrics import register_cache
+from services.offline_geocoder import OfflineGeocoder
+from services.spatial_index import EARTH_RADIUS_KM, SphereKDTree
+from services.tracing import traced
+from services.user_store import get_user_whitelist_index
 
 WHITELISTED_LOCATIONS_FILENAME = '../database/whitelisted_locations'
 
+# Overridable so benchmarks can point at a local stand-in
+GEOAPIFY_BASE_URL = os.getenv('GEOAPIFY_BASE_URL', 'https://api.geoapify.com')
+GEOAPIFY_API_KEY = os.getenv('GEOAPIFY_API_KEY')
+
+# Reverse-geocode cache: coordinates are rounded to this many decimal places
+# before lookup (3 places is roughly 100 m), so nearby requests share an entry
+GEOCODE_CACHE_PRECISION = int(os.getenv('GEOCODE_CACHE_PRECISION', 3))
+GEOCODE_CACHE_SIZE = int(os.getenv('GEOCODE_CACHE_SIZE', 10000))
+GEOCODE_CACHE_TTL_SECONDS = float(os.getenv('GEOCODE_CACHE_TTL_SECONDS', 24 * 60 * 60))
+
+_geocode_cache = TTLCache(GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL_SECONDS, open_shared_store('geocode'))
+register_cache('geocode', _geocode_cache.stats)
+
+# Offline reverse geocoding from a compiled postcode centroid table (see
+# services/offline_geocoder.py). Enabled when the table path is set; Geoapify is
+# then only used as a fallback for points with no centroid nearby, if at all.
+OFFLINE_GEOCODER_PATH = os.getenv('OFFLINE_GEOCODER_PATH')
+OFFLINE_GEOCODER_MAX_DISTANCE_KM = float(os.getenv('OFFLINE_GEOCODER_MAX_DISTANCE_KM', 50))
+GEOAPIFY_FALLBACK_ENABLED = os.getenv('GEOAPIFY_FALLBACK_ENABLED', 'True').lower() == 'true'
+
+_offline_geocoder = None
+
+# Consider "home" if within 0.5 km radius
+SAFE_LOCATION_RADIUS_KM = 0.5
+
+# Seconds between checks of the whitelist file for edits
+WHITELIST_RELOAD_INTERVAL_SECONDS = float(os.getenv('WHITELIST_RELOAD_INTERVAL_SECONDS', 2))
+
+# Whitelist index, loaded once and replaced wholesale when the file changes.
+# Readers grab the reference once per call, so they never see a half-built index.
+_whitelist_index = None
+_whitelist_signature = None
+_whitelist_failed_signature = None
+# Bumped on every swap, so results derived from the whitelist can tell when they are stale
+_whitelist_generation = 0
+_whitelist_reload_lock = threading.Lock()
+_whitelist_watcher = None
+
+def geocode_cell(latitude, longitude):
+    """Return the cell of the reverse-geocode cache that covers the coordinates."""
+    return (round(latitude, GEOCODE_CACHE_PRECISION), round(longitude, GEOCODE_CACHE_PRECISION))
+
 def get_address(latitude, longitude):
-    load_dotenv()
-    api_key = os.getenv('GEOAPIFY_API_KEY')
+    """
+    Reverse-geocode coordinates to an address, reusing cached results for nearby points.
+
+    Returns:
+        dict: housenumber, street, state, country, country_code (ISO 3166-1 alpha-2)
+              and postcode
+    """
+    address = get_cached_address(latitude, longitude)
+    return address if address is not None else load_address(latitude, longitude)
+
+def get_cached_address(latitude, longitude):
+    """Return the cached address of the coordinates' cell, or None if it isn't cached."""
+    address = _geocode_cache.get(geocode_cell(latitude, longitude))
+    return dict(address) if address is not None else None
+
+def load_address(latitude, longitude):
+    """Reverse-geocode coordinates and cache the address, without checking the cache first."""
+    address = resolve_address(latitude, longitude)
+    _geocode_cache.set(geocode_cell(latitude, longitude), address)
+    return dict(address)
+
+async def get_address_async(latitude, longitude):
+    """Async version of get_address, for the ASGI serving mode."""
+    key = geocode_cell(latitude, longitude)
+    address = await _geocode_cache.get_async(key)
+    if address is None:
+        address = resolve_address_offline(latitude, longitude)
+        if address is None:
+            address = await fetch_address_async(latitude, longitude)
+        await _geocode_cache.set_async(key, address)
+    return dict(address)
+
+def get_offline_geocoder():
+    """Return the offline geocoder, opening its table on first use, or None if disabled."""
+    global _offline_geocoder, OFFLINE_GEOCODER_PATH
+    if _offline_geocoder is None and OFFLINE_GEOCODER_PATH:
+        try:
+            _offline_geocoder = OfflineGeocoder(OFFLINE_GEOCODER_PATH)
+        except (OSError, ValueError) as e:
+            print(f"Could not open offline geocoder table, using Geoapify: {e}")
+            OFFLINE_GEOCODER_PATH = None
+    return _offline_geocoder
+
+def resolve_address_offline(latitude, longitude):
+    """
+    Reverse-geocode from the offline centroid table, if one is configured.
+
+    Returns:
+        dict: The address, or None if Geoapify has to be asked instead
+    """
+    offline_geocoder = get_offline_geocoder()
+    if offline_geocoder is None:
+        return None
+
+    address = offline_geocoder.lookup(latitude, longitude, OFFLINE_GEOCODER_MAX_DISTANCE_KM)
+    if address is None and not GEOAPIFY_FALLBACK_ENABLED:
+        return {'housenumber': None, 'street': None, 'state': None, 'country': None, 'country_code': None,
+                'postcode': None}
+    return address
+
+def resolve_postcodes_offline(latitudes, longitudes):
+    """
+    Batch postcode lookup from the offline centroid table, e.g. for map tiles.
+
+    Returns:
+        list: Postcode of each point, None where none is within
+              OFFLINE_GEOCODER_MAX_DISTANCE_KM; or None if no table is configured
+    """
+    offline_geocoder = get_offline_geocoder()
+    if offline_geocoder is None:
+        return None
+    return offline_geocoder.lookup_postcodes(latitudes, longitudes, OFFLINE_GEOCODER_MAX_DISTANCE_KM)
+
+def resolve_address(latitude, longitude):
+    """Reverse-geocode offline when a centroid table is configured, else through Geoapify."""
+    address = resolve_address_offline(latitude, longitude)
+    if address is None:
+        address = fetch_address(latitude, longitude)
+    return address
 
-    url = f"https://api.geoapify.com/v1/geocode/reverse?lat={latitude}&lon={longitude}&apiKey={api_key}"
+def get_geocode_cache_stats():
+    """Return hit/miss counters for the reverse-geocode cache."""
+    return _geocode_cache.stats()
 
-    headers = CaseInsensitiveDict()
-    headers["Accept"] = "application/json"
+def _build_geoapify_request(latitude, longitude):
+    url = f"{GEOAPIFY_BASE_URL}/v1/geocode/reverse?lat={latitude}&lon={longitude}&apiKey={GEOAPIFY_API_KEY}"
+    headers = {"Accept": "application/json"}
 
-    response = requests.get(url, headers=headers)
-    location = response.json()['features'][0]['properties']
+    return url, headers
+
+def _parse_geoapify_response(data):
+    # No features means there is no address here, e.g. open water
+    features = data.get('features') or [{}]
+    location = features[0].get('properties', {})
     
+    # Not every place has every field (rural areas often lack a house number)
     address = {
-        'housenumber': location['housenumber'],
-        'street': location['street'],
-        'state': location['state'],
-        'country': location['country'],
-        'postcode': location['postcode']
+        'housenumber': location.get('housenumber'),
+        'street': location.get('street'),
+        'state': location.get('state'),
+        'country': location.get('country'),
+        'country_code': (location.get('country_code') or '').upper() or None,
+        'postcode': location.get('postcode')
     }
 
     return address
 
+def fetch_address(latitude, longitude):
+    """
+    Reverse-geocode coordinates with the Geoapify API.
+
+    Raises:
+        CircuitOpenError: If Geoapify is failing and its circuit is open
+        requests.RequestException: If the request failed
+    """
+    url, headers = _build_geoapify_request(latitude, longitude)
+    response = http_get('geoapify', url, headers=headers)
+    response.raise_for_status()
+    return _parse_geoapify_response(response.json())
+
+async def fetch_address_async(latitude, longitude):
+    """Reverse-geocode coordinates with the Geoapify API on the pooled async client."""
+    url, headers = _build_geoapify_request(latitude, longitude)
+    response = await http_get_async('geoapify', url, headers=headers)
+    response.raise_for_status()
+    return _parse_geoapify_response(response.json())
+
+def _build_geoapify_search_request(text):
+    url = f"{GEOAPIFY_BASE_URL}/v1/geocode/search"
+    params = {"text": text, "limit": 1, "apiKey": GEOAPIFY_API_KEY}
+    headers = {"Accept": "application/json"}
+
+    return url, params, headers
+
+def _parse_geoapify_search_response(data):
+    features = data.get('features') or [{}]
+    location = features[0].get('properties', {})
+    if location.get('lat') is None or location.get('lon') is None:
+        return None # No match for the address
+    return float(location['lat']), float(location['lon'])
+
+def _parse_coordinates_address(address):
+    """Coordinates written as "latitude|longitude", as in the whitelisted locations file, or None."""
+    parts = address.split("|")
+    if len(parts) != 2:
+        return None
+    try:
+        return float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+
+def _format_home_address(address):
+    """Turn the frontend's "number|street|city|state|zipcode" into a single line for geocoding."""
+    number, street, city, state, zipcode = (address.split("|") + [""] * 5)[:5]
+    return f"{number} {street}, {city}, {state} {zipcode}".strip(" ,")
+
+def geocode_home_address(address: str):
+    """
+    Find the coordinates of a home address with the Geoapify API.
+
+    Args:
+        address (str): "number|street|city|state|zipcode", or "latitude|longitude"
+
+    Returns:
+        tuple: (latitude, longitude), or None if the address wasn't found
+
+    Raises:
+        CircuitOpenError: If Geoapify is failing and its circuit is open
+        requests.RequestException: If the request failed
+    """
+    coordinates = _parse_coordinates_address(address)
+    if coordinates is not None:
+        return coordinates
+    url, params, headers = _build_geoapify_search_request(_format_home_address(address))
+    response = http_get('geoapify', url, params=params, headers=headers)
+    response.raise_for_status()
+    return _parse_geoapify_search_response(response.json())
+
+async def geocode_home_address_async(address: str):
+    """Async version of geocode_home_address, for the ASGI serving mode."""
+    coordinates = _parse_coordinates_address(address)
+    if coordinates is not None:
+        return coordinates
+    url, params, headers = _build_geoapify_search_request(_format_home_address(address))
+    response = await http_get_async('geoapify', url, params=params, headers=headers)
+    response.raise_for_status()
+    return _parse_geoapify_search_response(response.json())
+
+def _probe_geoapify():
+    url, headers = _build_geoapify_request(0, 0)
+    # Rate limiting (429) and a rejected API key (401/403) mean Geoapify still can't serve lookups
+    return 200 <= http_get('geoapify', url, circuit_breaker=False, headers=headers).status_code < 400
+
+set_circuit_probe('geoapify', _probe_geoapify)
+
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float):
     """
     Calculate the distance between two points on Earth using the Haversine formula.
@@ -59,11 +285,46 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float):
          math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2)
     c = 2 * math.asin(math.sqrt(a))
     
-    # Radius of Earth in kilometers
-    earth_radius_km = 6371
+    return EARTH_RADIUS_KM * c
+
+def calculate_distances(latitude, longitude, latitudes, longitudes):
+    """
+    Vectorized Haversine distance from one or more points to many sites.
+
+    Inputs broadcast against each other like NumPy arrays, so this covers one point
+    against N sites (scalar latitude/longitude) as well as N point/site pairs.
+    
+    Args:
+        latitude, longitude: Latitude and longitude of the point(s)
+        latitudes, longitudes: Latitudes and longitudes of the sites
+    
+    Returns:
+        np.ndarray: Distances in kilometers
+    """
+    lat1_rad = np.radians(np.asarray(latitude, dtype=np.float64))
+    lon1_rad = np.radians(np.asarray(longitude, dtype=np.float64))
+    lat2_rad = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon2_rad = np.radians(np.asarray(longitudes, dtype=np.float64))
     
-    return earth_radius_km * c
+    a = (np.sin((lat2_rad - lat1_rad) / 2) ** 2 +
+         np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin((lon2_rad - lon1_rad) / 2) ** 2)
+    # Rounding can push a a hair above 1 for antipodal points
+    c = 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    
+    return EARTH_RADIUS_KM * c
 
+def calculate_distance_matrix(latitudes1, longitudes1, latitudes2, longitudes2):
+    """
+    Vectorized Haversine distance from each of M points to each of N sites.
+    
+    Returns:
+        np.ndarray: Array of shape (M, N) with distances in kilometers
+    """
+    latitudes1 = np.asarray(latitudes1, dtype=np.float64).reshape(-1, 1)
+    longitudes1 = np.asarray(longitudes1, dtype=np.float64).reshape(-1, 1)
+    return calculate_distances(latitudes1, longitudes1, np.ravel(latitudes2), np.ravel(longitudes2))
+
+@traced('get_location_context')
 def get_location_context(latitude, longitude):
     """
     Get contextual information about a location.
@@ -73,22 +334,170 @@ def get_location_context(latitude, longitude):
     """
     return get_address(latitude, longitude)
 
-def check_location_is_whitelisted(user_latitude: float, user_longitude: float):
-    
-    distance_from_closest_safe_location = math.inf
-    
-    with open(WHITELISTED_LOCATIONS_FILENAME, 'r') as file:
-        
+def get_cached_location_context(latitude, longitude):
+    """Return the location context if it is cached, else None; see concurrency.run_stage."""
+    return get_cached_address(latitude, longitude)
+
+@traced('get_location_context')
+def load_location_context(latitude, longitude):
+    """get_location_context for coordinates whose context isn't cached."""
+    return load_address(latitude, longitude)
+
+@traced('get_location_context')
+async def get_location_context_async(latitude, longitude):
+    """Async version of get_location_context."""
+    return await get_address_async(latitude, longitude)
+
+def load_whitelisted_locations(filename=WHITELISTED_LOCATIONS_FILENAME):
+    """
+    Read the whitelisted locations file.
+
+    Each non-empty line holds one safe location formatted as "latitude|longitude".
+
+    Returns:
+        list: (latitude, longitude) tuples
+    """
+    locations = []
+    with open(filename, 'r') as file:
         for line in file:
-            
+            line = line.strip()
+            if not line:
+                continue
             safe_latitude, safe_longitude = map(float, line.split("|"))
-            
-            distance_from_safe_location = calculate_distance(user_latitude, user_longitude, safe_latitude, safe_longitude)
-            
-            # Consider "home" if within 0.5 km radius
-            if distance_from_safe_location <= 0.5:
-                return True, distance_from_safe_location # User is at a safe location :)
-            
-            distance_from_closest_safe_location = min(distance_from_closest_safe_location, distance_from_safe_location)
-                
-        return False, distance_from_closest_safe_location # User is at unknown location :(
\ No newline at end of file
+            locations.append((safe_latitude, safe_longitude))
+    return locations
+
+def build_whitelist_index(filename=WHITELISTED_LOCATIONS_FILENAME):
+    """Build a spatial index over the whitelisted locations file."""
+    return SphereKDTree(load_whitelisted_locations(filename))
+
+def _get_file_signature(filename):
+    """Identify a version of a file by inode, modification time and size."""
+    stat = os.stat(filename)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def reload_whitelist_index(filename=WHITELISTED_LOCATIONS_FILENAME):
+    """
+    Rebuild the whitelist index if the file changed since it was last loaded.
+
+    The new index is built off to the side and published with a single reference
+    assignment. If the file cannot be read or parsed (e.g. it is mid-write), the
+    current index is kept and the reload is retried on the next check.
+
+    Returns:
+        bool: True if a new index was swapped in
+    """
+    global _whitelist_index, _whitelist_signature, _whitelist_failed_signature, _whitelist_generation
+
+    with _whitelist_reload_lock:
+        signature = None
+        try:
+            # Stat before reading so a write racing with the rebuild triggers another reload
+            signature = _get_file_signature(filename)
+            if signature in (_whitelist_signature, _whitelist_failed_signature) and _whitelist_index is not None:
+                return False
+            index = build_whitelist_index(filename)
+        except (OSError, ValueError) as e:
+            if signature != _whitelist_failed_signature:
+                print(f"Could not reload whitelisted locations: {e}")
+            _whitelist_failed_signature = signature
+            return False
+
+        _whitelist_index = index
+        _whitelist_signature = signature
+        _whitelist_generation += 1
+        print(f"Loaded {len(index)} whitelisted locations.")
+        return True
+
+def _watch_whitelist(filename, interval):
+    while True:
+        time.sleep(interval)
+        reload_whitelist_index(filename)
+
+def start_whitelist_watcher(filename=WHITELISTED_LOCATIONS_FILENAME, interval=WHITELIST_RELOAD_INTERVAL_SECONDS):
+    """
+    Load the whitelist index and keep it in sync with the file in a background thread.
+
+    Rebuilds happen on the watcher thread, so no request ever pays for one.
+    """
+    global _whitelist_watcher
+
+    reload_whitelist_index(filename)
+    if _whitelist_watcher is None:
+        _whitelist_watcher = threading.Thread(
+            target=_watch_whitelist, args=(filename, interval), name="whitelist-watcher", daemon=True
+        )
+        _whitelist_watcher.start()
+
+def get_whitelist_index():
+    """Return the current whitelist index, loading it from disk if no watcher has yet."""
+    if _whitelist_index is None:
+        reload_whitelist_index()
+    if _whitelist_index is None:
+        return SphereKDTree([]) # File missing or unreadable, treat as no safe locations
+    return _whitelist_index
+
+def get_whitelist_generation():
+    """Return a number that changes every time a new whitelist index is swapped in."""
+    return _whitelist_generation
+
+def get_safe_location_index(user_id: str = None):
+    """
+    Return the index check_location_is_whitelisted searches for user_id: their
+    saved safe locations, or the shared whitelist if they saved none. A new index
+    object is returned once either is rebuilt.
+    """
+    index = get_user_whitelist_index(user_id) if user_id else None
+    return index if index is not None else get_whitelist_index()
+
+async def get_safe_location_index_async(user_id: str = None):
+    """Async version of get_safe_location_index. A user's index is read from SQLite, so in a worker thread."""
+    if not user_id:
+        return get_whitelist_index()
+    return await asyncio.to_thread(get_safe_location_index, user_id)
+
+@traced('check_location_is_whitelisted')
+def check_location_is_whitelisted(user_latitude: float, user_longitude: float, user_id: str = None, index=None):
+    """
+    Check whether the user is within SAFE_LOCATION_RADIUS_KM of a whitelisted location.
+
+    Args:
+        user_id (str): Checks against this user's saved safe locations; without one,
+                       or if they saved none, against the shared whitelist
+        index (SphereKDTree): Index to search instead, from get_safe_location_index
+
+    Returns:
+        tuple: (is_safe, distance in km to the closest safe location)
+    """
+    if index is None:
+        index = get_safe_location_index(user_id)
+    closest_safe_location, _ = index.nearest(user_latitude, user_longitude)
+
+    if closest_safe_location is None:
+        return False, math.inf # No safe locations configured
+
+    safe_latitude, safe_longitude = closest_safe_location
+    distance_from_closest_safe_location = calculate_distance(user_latitude, user_longitude, safe_latitude, safe_longitude)
+
+    if distance_from_closest_safe_location <= SAFE_LOCATION_RADIUS_KM:
+        return True, distance_from_closest_safe_location # User is at a safe location :)
+
+    return False, distance_from_closest_safe_location # User is at unknown location :(
+
+def check_locations_are_whitelisted(user_latitudes, user_longitudes):
+    """
+    Batch version of check_location_is_whitelisted for many user coordinates.
+
+    Returns:
+        tuple: (is_safe, distances) arrays in input order, distances in km
+    """
+    user_latitudes = np.ravel(np.asarray(user_latitudes, dtype=np.float64))
+    user_longitudes = np.ravel(np.asarray(user_longitudes, dtype=np.float64))
+
+    nearest = get_whitelist_index().nearest_many(user_latitudes, user_longitudes)
+    if nearest is None:
+        distances = np.full(len(user_latitudes), math.inf) # No safe locations configured
+    else:
+        distances = calculate_distances(user_latitudes, user_longitudes, *nearest)
+
+    return distances <= SAFE_LOCATION_RADIUS_KM, distances
@@ -0,0 +1,199 @@
+"""
+Metrics for AI Cyber Protecting App
+Lightweight in-process latency histograms and counters, exportable in the
+Prometheus text format.
+"""
+import math
+import threading
+
+# Upper bounds of the latency buckets, in seconds. The sub-millisecond ones are
+# for local stages such as the whitelist check.
+LATENCY_BUCKETS_SECONDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Thread-safe fixed-bucket histogram."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_SECONDS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot counts values above every bucket
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        slot = len(self.buckets)
+        for position, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                slot = position
+                break
+        with self._lock:
+            self._counts[slot] += 1
+            self._sum += value
+            self._count += 1
+
+    def quantile(self, q: float):
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in.
+
+        Returns:
+            float: The estimate, math.inf if it is above every bucket, or None if empty
+        """
+        with self._lock:
+            counts, total = list(self._counts), self._count
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for upper_bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            if cumulative >= rank:
+                return upper_bound
+        return float('inf')
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Count, sum and cumulative bucket counts keyed by upper bound
+        """
+        with self._lock:
+            counts, total, value_sum = list(self._counts), self._count, self._sum
+        cumulative = 0
+        buckets = {}
+        for upper_bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            buckets['+Inf' if upper_bound == float('inf') else str(upper_bound)] = cumulative
+        return {"count": total, "sum": value_sum, "buckets": buckets}
+
+class Counter:
+    """Thread-safe monotonically increasing counter."""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+_counters = {}
+_counters_lock = threading.Lock()
+_cache_stats = {}  # cache name -> function returning its stats() dict
+
+def get_histogram(name: str, **labels):
+    """Return the histogram for a metric name and label set, creating it on first use."""
+    key = (name, tuple(sorted(labels.items())))
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(key, Histogram())
+    return histogram
+
+def get_counter(name: str, **labels):
+    """Return the counter for a metric name and label set, creating it on first use."""
+    key = (name, tuple(sorted(labels.items())))
+    counter = _counters.get(key)
+    if counter is None:
+        with _counters_lock:
+            counter = _counters.setdefault(key, Counter())
+    return counter
+
+def register_cache(name: str, stats_function):
+    """
+    Export a cache's hit/miss counters, read from stats_function() on every scrape.
+
+    Args:
+        stats_function (callable): Returns a dict with hits and misses (and
+                                   optionally staleHits and size), like TTLCache.stats
+    """
+    _cache_stats[name] = stats_function
+
+def summarize_histograms(name: str, label: str):
+    """
+    Summarize every histogram of a metric, keyed by one of its labels.
+
+    Returns:
+        dict: label value -> count and approximate p50/p95/p99 in seconds
+    """
+    def estimate(histogram, q):
+        value = histogram.quantile(q)
+        return '+Inf' if value == float('inf') else value
+
+    summary = {}
+    for (metric_name, labels), histogram in list(_histograms.items()):
+        if metric_name != name:
+            continue
+        summary[dict(labels).get(label)] = {
+            "count": histogram.snapshot()["count"],
+            "p50": estimate(histogram, 0.5),
+            "p95": estimate(histogram, 0.95),
+            "p99": estimate(histogram, 0.99),
+        }
+    return summary
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    return '+Inf' if value == math.inf else repr(float(value))
+
+def _grouped(metrics):
+    groups = {}
+    for (name, labels), metric in sorted(metrics.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        groups.setdefault(name, []).append((labels, metric))
+    return groups.items()
+
+def render_prometheus():
+    """
+    Render every histogram, counter and registered cache in the Prometheus text
+    exposition format (version 0.0.4).
+
+    Returns:
+        str: The scrape body
+    """
+    lines = []
+    for name, series in _grouped(dict(_histograms)):
+        lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in series:
+            snapshot = histogram.snapshot()
+            for upper_bound, count in snapshot["buckets"].items():
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", upper_bound),))} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(snapshot["sum"])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {snapshot["count"]}')
+
+    for name, series in _grouped(dict(_counters)):
+        lines.append(f'# TYPE {name} counter')
+        for labels, counter in series:
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(counter.value)}')
+
+    cache_stats = {}
+    for cache, stats_function in sorted(_cache_stats.items()):
+        try:
+            cache_stats[cache] = stats_function()
+        except Exception as e:
+            print(f"Could not read stats of cache {cache}: {e}")
+    for name, field, kind in (
+        ('cache_hits_total', 'hits', 'counter'),
+        ('cache_stale_hits_total', 'staleHits', 'counter'),
+        ('cache_misses_total', 'misses', 'counter'),
+        ('cache_entries', 'size', 'gauge'),
+    ):
+        series = [(cache, stats[field]) for cache, stats in cache_stats.items() if field in stats]
+        if series:
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{_format_labels((("cache", cache),))} {_format_value(value)}' for cache, value in series)
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,121 @@
+"""
+Network Ranges Updater for AI Cyber Protecting App
+Expands the ASN rules of database/network_ranges into the prefixes those ASNs announce.
+
+Each "AS<number>|<network type>" rule only helps once ip-api.com has named an
+address's ASN. This tool asks RIPEstat which prefixes every listed ASN currently
+announces and writes them, merged per network type, to a generated section at
+the end of the table, so classify_network_offline resolves those addresses
+without any remote call. Rules outside the generated section are kept as they
+are, and a generated prefix that repeats one of them is left out. If any ASN
+can't be fetched the table is left untouched.
+
+Run from the backend directory:
+    python -m services.network_ranges_updater
+"""
+import argparse
+import ipaddress
+import os
+import time
+
+from services.http_client import http_get
+from services.network_service import NETWORK_RANGES_FILENAME, NETWORK_TYPE
+
+RIPESTAT_URL = os.getenv('RIPESTAT_URL', 'https://stat.ripe.net/data/announced-prefixes/data.json')
+
+GENERATED_BEGIN = "# BEGIN announced prefixes, generated by services.network_ranges_updater"
+GENERATED_END = "# END announced prefixes"
+
+def read_rules(filename):
+    """
+    Returns:
+        tuple: (lines outside the generated section, {ASN: network type name}, set of CIDRs they list)
+    """
+    lines, asns, cidrs = [], {}, set()
+    generated = False
+    with open(filename, 'r') as file:
+        for line in file:
+            line = line.rstrip("\n")
+            if line == GENERATED_BEGIN:
+                generated = True
+            elif line == GENERATED_END:
+                generated = False
+            elif not generated:
+                lines.append(line)
+                rule = line.strip()
+                if not rule or rule.startswith('#'):
+                    continue
+                target, value = (part.strip() for part in rule.split("|", 1))
+                if value not in NETWORK_TYPE:
+                    raise ValueError(f"Unknown value {value!r} for {target} in {filename}")
+                if target.upper().startswith('AS'):
+                    asns[int(target[2:])] = value
+                else:
+                    cidrs.add(str(ipaddress.ip_network(target, strict=False)))
+    return lines, asns, cidrs
+
+def fetch_announced_prefixes(asn):
+    """
+    Returns:
+        list: ipaddress networks the ASN announces
+
+    Raises:
+        requests.RequestException: If RIPEstat could not be reached
+    """
+    response = http_get('ripestat', RIPESTAT_URL, circuit_breaker=False, params={"resource": f"AS{asn}"})
+    response.raise_for_status()
+    return [ipaddress.ip_network(entry["prefix"], strict=False) for entry in response.json()["data"]["prefixes"]]
+
+def generate_rules(asns, cidrs):
+    """
+    Args:
+        asns (dict): ASN -> network type name
+        cidrs (set): CIDRs already listed by hand, which are left out
+
+    Returns:
+        list: "<CIDR>|<network type>" lines, the announced prefixes merged per network type
+    """
+    networks = {}  # (network type, IP version) -> networks
+    claimed = set()  # The first ASN to announce a prefix decides its type
+    for asn, network_type in asns.items():
+        prefixes = fetch_announced_prefixes(asn)
+        print(f"AS{asn}: {len(prefixes)} prefixes")
+        for network in prefixes:
+            if str(network) in cidrs or network in claimed:
+                continue
+            claimed.add(network)
+            networks.setdefault((network_type, network.version), []).append(network)
+
+    rules = []
+    for (network_type, _), group in sorted(networks.items()):
+        rules.extend(f"{network}|{network_type}" for network in ipaddress.collapse_addresses(group)
+                     if str(network) not in cidrs)
+    return rules
+
+def write_rules(filename, lines, rules):
+    while lines and not lines[-1].strip():
+        lines.pop()
+    generated = [
+        GENERATED_BEGIN,
+        f"# From RIPEstat on {time.strftime('%Y-%m-%d')}; edit the rules above instead, then run the updater again",
+        *rules,
+        GENERATED_END,
+    ]
+    # Written to a temporary file first so a running server never reads half a table
+    temporary = f"{filename}.tmp"
+    with open(temporary, 'w') as file:
+        file.write("\n".join([*lines, "", *generated]) + "\n")
+    os.replace(temporary, filename)
+
+def main():
+    parser = argparse.ArgumentParser(description="Add the prefixes announced by each ASN rule to the network ranges table.")
+    parser.add_argument('--table', default=NETWORK_RANGES_FILENAME, help="Network ranges table to update")
+    args = parser.parse_args()
+
+    lines, asns, cidrs = read_rules(args.table)
+    rules = generate_rules(asns, cidrs)
+    write_rules(args.table, lines, rules)
+    print(f"Wrote {len(rules)} generated rules for {len(asns)} ASNs to {args.table}")
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,13 @@
-import requests
+import ipaddress
+import os
+import re
+
+from services.cache import TTLCache, open_shared_store
+from services.circuit_breaker import CircuitOpenError, set_circuit_probe
+from services.http_client import http_get, http_get_async
+from services.ip_classifier import IPClassifier
+from services.metrics import register_cache
+from services.tracing import traced
 
 NETWORK_TYPE = {
     "Residential/Private Network": 0,
@@ -8,33 +17,176 @@ NETWORK_TYPE = {
     "Unknown Network": 4,
 }
 
-def get_network_info(ip_address: str) -> int:
-    """Gets network metadata from an IP address."""
+NETWORK_RANGES_FILENAME = os.getenv('NETWORK_RANGES_FILENAME', '../database/network_ranges')
+
+# Overridable so benchmarks can point at a local stand-in
+IP_API_BASE_URL = os.getenv('IP_API_BASE_URL', 'http://ip-api.com')
+
+# Remote classifications are reused for this long before ip-api.com is asked again
+IP_CACHE_SIZE = int(os.getenv('IP_CACHE_SIZE', 10000))
+IP_CACHE_TTL_SECONDS = float(os.getenv('IP_CACHE_TTL_SECONDS', 60 * 60))
+
+_ip_cache = TTLCache(IP_CACHE_SIZE, IP_CACHE_TTL_SECONDS, open_shared_store('ip_network_types'))
+register_cache('ip', _ip_cache.stats)
+
+# Local CIDR/ASN classifier, loaded once on first use
+_ip_classifier = None
+
+def load_ip_classifier(filename: str = NETWORK_RANGES_FILENAME):
+    """Load the local IP classifier from a network ranges table, replacing the one in use."""
+    global _ip_classifier
+    try:
+        _ip_classifier = IPClassifier.from_file(filename, NETWORK_TYPE)
+    except (OSError, ValueError) as e:
+        print(f"Could not load network ranges, classifying remotely only: {e}")
+        _ip_classifier = IPClassifier([])
+
+def get_ip_classifier():
+    """Return the local IP classifier, loading the network ranges table on first use."""
+    if _ip_classifier is None:
+        load_ip_classifier()
+    return _ip_classifier
+
+def _classify_without_lookup(ip_address: str):
+    """
+    Classify an IP address without asking ip-api.com, if possible.
+
+    Returns:
+        int: The network type, or None if a remote lookup is needed
+    """
+    network_type = _classify_locally(ip_address)
+    if network_type is not None:
+        return network_type
+    return _ip_cache.get(ip_address)
+
+def _classify_locally(ip_address: str):
+    """
+    Classify an IP address from the local CIDR table alone, without the cache.
+
+    Returns:
+        int: The network type, or None if the cache or ip-api.com has to tell
+    """
     if ip_address == "127.0.0.1":
         return 0 # "Local Development Network"
 
     try:
-        response = requests.get(f"http://ip-api.com/json/{ip_address}?fields=isp,org")
+        ipaddress.ip_address(ip_address)
+    except ValueError:
+        return NETWORK_TYPE["Unknown Network"]
+
+    # Local CIDR table first: no network round trip at all
+    return get_ip_classifier().classify_ip(ip_address)
+
+def classify_network_offline(ip_address: str) -> int:
+    """
+    Classify an IP address from the local CIDR table only, e.g. for offline scoring.
+    Addresses outside the table's ranges, and not classified remotely before, stay unknown.
+
+    Returns:
+        int: The network type, "Unknown Network" if only ip-api.com could tell
+    """
+    network_type = _classify_without_lookup(ip_address)
+    if network_type is None:
+        return NETWORK_TYPE["Unknown Network"]
+    return network_type
+
+def _remember_network_type(ip_address: str, network_type: int):
+    # Don't pin failed lookups for a whole TTL
+    if network_type != NETWORK_TYPE["Unknown Network"]:
+        _ip_cache.set(ip_address, network_type)
+
+@traced('get_network_info')
+def get_network_info(ip_address: str) -> int:
+    """Gets network metadata from an IP address."""
+    network_type = _classify_without_lookup(ip_address)
+    if network_type is None:
+        network_type = fetch_network_info(ip_address)
+        _remember_network_type(ip_address, network_type)
+    return network_type
+
+def get_cached_network_info(ip_address: str):
+    """Return the network type if it is known without a lookup, else None; see concurrency.run_stage."""
+    return _classify_without_lookup(ip_address)
+
+@traced('get_network_info')
+def load_network_info(ip_address: str) -> int:
+    """get_network_info for an IP address that needs a remote lookup."""
+    network_type = fetch_network_info(ip_address)
+    _remember_network_type(ip_address, network_type)
+    return network_type
+
+@traced('get_network_info')
+async def get_network_info_async(ip_address: str) -> int:
+    """Async version of get_network_info, for the ASGI serving mode."""
+    network_type = _classify_locally(ip_address)
+    if network_type is None:
+        network_type = await _ip_cache.get_async(ip_address)
+    if network_type is None:
+        network_type = await fetch_network_info_async(ip_address)
+        # Don't pin failed lookups for a whole TTL
+        if network_type != NETWORK_TYPE["Unknown Network"]:
+            await _ip_cache.set_async(ip_address, network_type)
+    return network_type
+
+def get_ip_cache_stats():
+    """Return hit/miss counters for the remote IP classification cache."""
+    return _ip_cache.stats()
+
+def _ip_api_url(ip_address: str) -> str:
+    return f"{IP_API_BASE_URL}/json/{ip_address}?fields=isp,org,as"
+
+def _classify_ip_api_response(data: dict) -> int:
+    # The "as" field looks like "AS7922 Comcast Cable Communications, LLC"
+    asn_match = re.match(r"AS(\d+)", data.get("as", ""))
+    if asn_match:
+        network_type = get_ip_classifier().classify_asn(int(asn_match.group(1)))
+        if network_type is not None:
+            return network_type
+
+    # Simple logic to determine network type
+    isp = data.get("isp", "").lower()
+    org = data.get("org", "").lower()
+
+    if any(term in isp for term in ["comcast", "verizon", "cox", "spectrum", "at&t"]):
+        return NETWORK_TYPE["Residential/Private Network"]
+    if any(term in isp for term in ["boingo", "gogo"]):
+        return NETWORK_TYPE["Untrusted/Unknown Public Network"]
+    if any(term in org for term in ["amazon", "google", "digitalocean"]):
+        return NETWORK_TYPE["VPN/Proxy Network"]
+    
+    # TODO: Call Chat to verify this is a trusted institution => Type: 2 or 1
+    return NETWORK_TYPE["Untrusted/Unknown Public Network"]
+
+def fetch_network_info(ip_address: str) -> int:
+    """Classifies an IP address from its ip-api.com ISP, organization and ASN."""
+    import requests # Imported on first use, see http_client.get_session
+
+    try:
+        response = http_get('ip-api', _ip_api_url(ip_address))
         response.raise_for_status()
-        data = response.json()
-
-        # Simple logic to determine network type
-        isp = data.get("isp", "").lower()
-        org = data.get("org", "").lower()
-
-        if any(term in isp for term in ["comcast", "verizon", "cox", "spectrum", "at&t"]):
-            return NETWORK_TYPE["Residential/Private"]
-        if any(term in isp for term in ["boingo", "gogo"]):
-            return NETWORK_TYPE["Untrusted/Unknown Public Hotspot"]
-        if any(term in org for term in ["amazon", "google", "digitalocean"]):
-            return NETWORK_TYPE["VPN/Proxy"]
-        
-        # TODO: Call Chat to verify this is a trusted institution => Type: 2 or 1
-        return NETWORK_TYPE["Untrusted/Unknown Public Hotspot"]
+        return _classify_ip_api_response(response.json())
     
-    except requests.RequestException as e:
+    except (requests.RequestException, CircuitOpenError) as e:
         print(f"Could not get network info for {ip_address}: {e}")
-        return NETWORK_TYPE["Unknown"]
+        return NETWORK_TYPE["Unknown Network"]
+
+async def fetch_network_info_async(ip_address: str) -> int:
+    """Async version of fetch_network_info, on the pooled async client."""
+    import httpx # Imported on first use, see http_client.get_async_client
+
+    try:
+        response = await http_get_async('ip-api', _ip_api_url(ip_address))
+        response.raise_for_status()
+        return _classify_ip_api_response(response.json())
+
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        print(f"Could not get network info for {ip_address}: {e}")
+        return NETWORK_TYPE["Unknown Network"]
+
+def _probe_ip_api():
+    return http_get('ip-api', _ip_api_url("8.8.8.8"), circuit_breaker=False).ok
+
+set_circuit_probe('ip-api', _probe_ip_api)
     
 def get_user_ip(request) -> str:
     """
@@ -47,5 +199,9 @@ def get_user_ip(request) -> str:
     else:
         # If the header is not present, fall back to remote_addr.
         # This is useful for development or direct connections.
-        ip_address = request.remote_addr
-    return ip_address
\ No newline at end of file
+        # Flask requests carry it as remote_addr, Starlette ones as client.host.
+        if hasattr(request, 'remote_addr'):
+            ip_address = request.remote_addr
+        else:
+            ip_address = request.client.host if request.client else None
+    return ip_address
@@ -0,0 +1,173 @@
+"""
+Offline Reverse Geocoder for AI Cyber Protecting App
+Resolves coordinates to postcode/state/country code from a local table of postcode centroids.
+
+The table is compiled once from a GeoNames-style postal code dump (tab or comma
+separated: country code, postal code, place name, admin name1, ..., latitude,
+longitude in columns 10 and 11) into a compact binary file that is memory-mapped
+at runtime. Records are stored in the implicit KD-tree order of SphereKDTree, so
+the file itself is the nearest-neighbour index and nothing is rebuilt on load.
+
+Compile a table from the backend directory:
+    python -m services.offline_geocoder allCountries.txt ../database/postcode_centroids.bin
+"""
+import csv
+import math
+import mmap
+import struct
+import sys
+
+import numpy as np
+
+from services.spatial_index import EARTH_RADIUS_KM, SphereKDTree, chord_to_km, to_unit_vectors
+
+FILE_MAGIC = b'PCCENT01'
+
+# Magic, record count, string table length
+HEADER_FORMAT = '<8sIQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Unit vector of the centroid plus offsets of its strings in the string table
+RECORD_DTYPE = np.dtype([
+    ('vector', '<f4', (3,)),
+    ('postcode', '<u4'),
+    ('state', '<u4'),
+    ('country', '<u4'),
+])
+
+# GeoNames postal code dump column positions
+COUNTRY_COLUMN = 0
+POSTCODE_COLUMN = 1
+STATE_COLUMN = 3
+LATITUDE_COLUMN = 9
+LONGITUDE_COLUMN = 10
+
+def _read_centroid_rows(csv_path):
+    with open(csv_path, 'r', encoding='utf-8', newline='') as file:
+        delimiter = '\t' if '\t' in file.readline() else ','
+        file.seek(0)
+        for row in csv.reader(file, delimiter=delimiter):
+            try:
+                latitude = float(row[LATITUDE_COLUMN])
+                longitude = float(row[LONGITUDE_COLUMN])
+            except (IndexError, ValueError):
+                continue # Header or incomplete row
+            yield row[POSTCODE_COLUMN], row[STATE_COLUMN], row[COUNTRY_COLUMN], latitude, longitude
+
+def compile_postcode_table(csv_path, output_path):
+    """
+    Compile a GeoNames-style postcode centroid CSV into the binary lookup format.
+
+    Returns:
+        int: Number of centroids written
+    """
+    strings = bytearray()
+    string_offsets = {}
+
+    def intern(value):
+        offset = string_offsets.get(value)
+        if offset is None:
+            offset = string_offsets[value] = len(strings)
+            strings.extend(value.encode('utf-8') + b'\0')
+        return offset
+
+    rows = []
+    coordinates = []
+    for postcode, state, country, latitude, longitude in _read_centroid_rows(csv_path):
+        rows.append((intern(postcode), intern(state), intern(country)))
+        coordinates.append((latitude, longitude))
+
+    records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+    if rows:
+        coordinates = np.asarray(coordinates)
+        records['vector'] = to_unit_vectors(coordinates[:, 0], coordinates[:, 1])
+        offsets = np.asarray(rows, dtype=np.uint32)
+        records['postcode'], records['state'], records['country'] = offsets.T
+        records = records[SphereKDTree.tree_order(records['vector'].astype(np.float64))]
+
+    with open(output_path, 'wb') as file:
+        file.write(struct.pack(HEADER_FORMAT, FILE_MAGIC, len(records), len(strings)))
+        file.write(records.tobytes())
+        file.write(strings)
+
+    return len(records)
+
+class OfflineGeocoder:
+    """Memory-mapped nearest-centroid lookup over a compiled postcode table."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, strings_length = struct.unpack_from(HEADER_FORMAT, self._buffer)
+        if magic != FILE_MAGIC:
+            raise ValueError(f"{path} is not a compiled postcode table")
+
+        self._records = np.frombuffer(self._buffer, dtype=RECORD_DTYPE, count=count, offset=HEADER_SIZE)
+        self._strings_offset = HEADER_SIZE + count * RECORD_DTYPE.itemsize
+        self._tree = SphereKDTree.from_ordered_vectors(self._records['vector'])
+
+    def __len__(self):
+        return len(self._records)
+
+    def _string(self, offset):
+        start = self._strings_offset + int(offset)
+        return self._buffer[start:self._buffer.find(b'\0', start)].decode('utf-8')
+
+    def lookup(self, latitude: float, longitude: float, max_distance_km: float):
+        """
+        Find the postcode whose centroid is closest to the given coordinates.
+
+        Args:
+            max_distance_km (float): Give up if the closest centroid is farther than this
+
+        Returns:
+            dict: Address in the same shape as location_service.get_address, or None
+        """
+        position, chord = self._tree.nearest_position(latitude, longitude)
+        if position is None:
+            return None
+
+        if chord_to_km(chord) > max_distance_km:
+            return None
+
+        record = self._records[position]
+        return {
+            'housenumber': None,
+            'street': None,
+            'state': self._string(record['state']),
+            # The table only holds ISO country codes, not the names Geoapify returns
+            'country': None,
+            'country_code': self._string(record['country']),
+            'postcode': self._string(record['postcode']),
+        }
+
+    def lookup_postcodes(self, latitudes, longitudes, max_distance_km: float):
+        """
+        Batch version of lookup that only resolves postcodes, for grids of points.
+
+        All nearest centroids are found in one pass over the tree, and each distinct
+        centroid's postcode is decoded once.
+
+        Returns:
+            list: Postcode of each point, None where the closest centroid is
+                  farther than max_distance_km
+        """
+        nearest = self._tree.nearest_positions(latitudes, longitudes)
+        if nearest is None:
+            return [None] * np.size(latitudes)
+
+        positions, chords = nearest
+        max_chord = 2 * math.sin(min(max_distance_km / EARTH_RADIUS_KM / 2, math.pi / 2))
+        within = chords <= max_chord
+        postcodes = {}
+        for position in np.unique(positions[within]).tolist():
+            postcodes[position] = self._string(self._records[position]['postcode'])
+        return [postcodes[position] if ok else None for position, ok in zip(positions.tolist(), within.tolist())]
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python -m services.offline_geocoder <postcodes.csv> <output.bin>")
+        sys.exit(1)
+    count = compile_postcode_table(sys.argv[1], sys.argv[2])
+    print(f"Compiled {count} postcode centroids into {sys.argv[2]}")
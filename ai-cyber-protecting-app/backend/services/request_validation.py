@@ -0,0 +1,185 @@
+"""
+Request Validation for AI Cyber Protecting App
+Parsing of request payloads shared by the Flask and ASGI backends.
+"""
+import ipaddress
+import math
+import os
+from collections.abc import Mapping
+
+from services.user_store import USER_MAX_SAFE_LOCATIONS
+
+BATCH_MAX_RECORDS = int(os.getenv('BATCH_MAX_RECORDS', 5000))
+USER_ID_MAX_LENGTH = 254 # Longest email address
+SESSION_ID_MAX_LENGTH = 128
+USER_TOKEN_MAX_LENGTH = 128
+
+def parse_coordinates(data):
+    """
+    Extract and validate latitude/longitude from a check-security payload.
+
+    Returns:
+        tuple: ((latitude, longitude), None) on success, or (None, error message)
+    """
+    if not data:
+        return None, "No JSON data provided"
+    if not isinstance(data, Mapping):
+        return None, "JSON body must be an object"
+
+    # Extract required fields
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+
+    # Validate required fields
+    if latitude is None or longitude is None:
+        return None, "Missing required fields: latitude and longitude"
+
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (ValueError, TypeError):
+        return None, "Invalid latitude or longitude format"
+
+    # float() also accepts "nan" and "inf"
+    if not (math.isfinite(latitude) and math.isfinite(longitude)):
+        return None, "Invalid latitude or longitude format"
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None, "Latitude must be within [-90, 90] and longitude within [-180, 180]"
+    return (latitude, longitude), None
+
+def parse_batch_records(data):
+    """
+    Extract and validate the records of a batch check-security payload,
+    {"records": [{"latitude": ..., "longitude": ..., "ip": ...}, ...]}.
+
+    Invalid records don't fail the batch; they carry their own error instead.
+    The ip is optional, but must be an IPv4 or IPv6 address string if present.
+
+    Returns:
+        tuple: (records, None) on success, where each record is
+               ((latitude, longitude) or None, ip, error message or None),
+               or (None, error message)
+    """
+    if not data:
+        return None, "No JSON data provided"
+    if not isinstance(data, Mapping):
+        return None, "JSON body must be an object"
+
+    records = data.get('records')
+    if not isinstance(records, list):
+        return None, "Missing required field: records"
+    if len(records) > BATCH_MAX_RECORDS:
+        return None, f"Too many records: at most {BATCH_MAX_RECORDS} per batch"
+
+    parsed = []
+    for record in records:
+        if not isinstance(record, dict):
+            parsed.append((None, None, "Invalid record format"))
+            continue
+        coordinates, error = parse_coordinates(record)
+        ip = record.get('ip')
+        if error is None and ip is not None and not _is_ip_address(ip):
+            coordinates, error = None, "Invalid ip format"
+        parsed.append((coordinates, ip, error))
+    return parsed, None
+
+def _is_ip_address(ip):
+    if not isinstance(ip, str):
+        return False
+    try:
+        ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return True
+
+def parse_user_id(data):
+    """
+    Extract the optional userId of a check-security payload or query string.
+
+    Returns:
+        str: The user id, or None if the payload doesn't carry a valid one
+    """
+    user_id = data.get('userId') if isinstance(data, Mapping) else None
+    if not isinstance(user_id, str) or not user_id.strip() or len(user_id) > USER_ID_MAX_LENGTH:
+        return None
+    return user_id
+
+def parse_user_credentials(data):
+    """
+    Extract the optional userId and userToken of a check-security payload.
+
+    Returns:
+        tuple: (user id, user token), or (None, None) if the payload doesn't carry
+               a valid pair; the token still has to be checked with user_store.authenticate_user
+    """
+    user_id = parse_user_id(data)
+    token = data.get('userToken') if user_id is not None else None
+    if not isinstance(token, str) or not token or len(token) > USER_TOKEN_MAX_LENGTH:
+        return None, None
+    return user_id, token
+
+def parse_session(data):
+    """
+    Extract the optional sessionId and revision of a check-security payload.
+
+    Returns:
+        tuple: (session id, revision of the client's last response or None), or
+               (None, None) if the payload doesn't carry a valid session id
+    """
+    session_id = data.get('sessionId') if isinstance(data, Mapping) else None
+    if not isinstance(session_id, str) or not session_id.strip() or len(session_id) > SESSION_ID_MAX_LENGTH:
+        return None, None
+    revision = data.get('revision')
+    return session_id, revision if isinstance(revision, str) else None
+
+def parse_user_config(data):
+    """
+    Extract and validate a configure-user payload,
+    {"userId": ..., "2faEmail": ..., "homeAddresses": ["number|street|city|state|zipcode", ...]}.
+
+    userId is optional and defaults to the 2FA email, which is required: it is
+    where changes to the configuration are confirmed from.
+
+    Returns:
+        tuple: ((user id, alert email, home addresses), None) on success,
+               or (None, error message)
+    """
+    if not data:
+        return None, "No JSON data provided"
+    if not isinstance(data, Mapping):
+        return None, "JSON body must be an object"
+
+    alert_email = data.get('2faEmail') or None
+    if alert_email is None:
+        return None, "Missing required field: 2faEmail"
+    if not isinstance(alert_email, str) or '@' not in alert_email:
+        return None, "Invalid 2faEmail format"
+
+    user_id = parse_user_id(data) or alert_email
+
+    addresses = data.get('homeAddresses', [])
+    if not isinstance(addresses, list) or not all(isinstance(address, str) and address.strip() for address in addresses):
+        return None, "Invalid homeAddresses format"
+    if len(addresses) > USER_MAX_SAFE_LOCATIONS:
+        return None, f"Too many homeAddresses: at most {USER_MAX_SAFE_LOCATIONS}"
+
+    return (user_id, alert_email, addresses), None
+
+def parse_confirmation(data):
+    """
+    Extract and validate a configure-user confirmation payload,
+    {"userId": ..., "confirmationCode": "123456"}.
+
+    Returns:
+        tuple: ((user id, confirmation code), None) on success, or (None, error message)
+    """
+    if not data:
+        return None, "No JSON data provided"
+
+    user_id = parse_user_id(data)
+    if user_id is None:
+        return None, "Missing required field: userId"
+
+    code = data.get('confirmationCode')
+    if not isinstance(code, str) or not code.strip():
+        return None, "Missing required field: confirmationCode"
+    return (user_id, code.strip()), None
@@ -1,21 +1,119 @@
 """
 Risk Scoring Engine for AI Cyber Protecting App
 Implements a weighted risk scoring system based on location, WiFi, and threat intelligence.
+
+The factors themselves are plugins (services/risk_factors.py) scored by the rules
+in database/risk_rules.json; this module gathers their inputs for each way of
+running an assessment.
 """
-from services.location_service import check_location_is_whitelisted
-from services.network_service import get_network_info
-from services.threat_service import get_cyber_threats_by_zip
-
-# TODO: Make this a tuple
-NETWORK_TYPE = {
-    0: "Residential/Private Network",
-    1: "Untrusted/Unknown Public Network",
-    2: "Trusted Public Network",
-    3: "VPN/Proxy Network",
-    4: "Unknown Network",
-}
-
-def calculate_risk(latitude, longitude, ip, zipcode):
+import asyncio
+import os
+
+import services.risk_factors  # Registers the built-in risk factors
+from services.concurrency import iter_stages, map_bounded, map_bounded_async, run_stage, run_stage_async
+from services.location_service import (
+    check_location_is_whitelisted, check_locations_are_whitelisted, geocode_cell, get_cached_location_context,
+    get_location_context, get_location_context_async, get_safe_location_index_async, load_location_context,
+    resolve_address_offline,
+)
+from services.network_service import (
+    NETWORK_TYPE as NETWORK_TYPE_CODES, classify_network_offline, get_cached_network_info, get_network_info,
+    get_network_info_async, load_network_info,
+)
+from services.risk_engine import FactorInputs, LazyInput, RiskRules
+from services.threat_prefetcher import track_active_zipcode
+from services.threat_service import get_cached_threat_count, get_cached_threat_count_async, get_stored_threat_count
+
+RISK_RULES_FILENAME = os.getenv('RISK_RULES_FILENAME', '../database/risk_rules.json')
+
+# Per-stage time limits for the upstream lookups in assess_risk
+GEOCODE_TIMEOUT_SECONDS = float(os.getenv('GEOCODE_TIMEOUT_SECONDS', 3))
+NETWORK_TIMEOUT_SECONDS = float(os.getenv('NETWORK_TIMEOUT_SECONDS', 3))
+# Upstream lookups a batch assessment may have in flight at once
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 16))
+
+# Compiled risk rules, loaded once on first use
+_risk_rules = None
+
+def get_risk_rules():
+    """Return the compiled risk rules, loading the rules file on first use."""
+    global _risk_rules
+    if _risk_rules is None:
+        _risk_rules = RiskRules.from_file(RISK_RULES_FILENAME)
+    return _risk_rules
+
+def get_zone(risk_score):
+    """Determine security zone based on total score."""
+    return get_risk_rules().zone(risk_score)
+
+def lookup_threat_count(zipcode):
+    """
+    Served from the zipcode threat cache, so no request ever waits on Gemini.
+    Zipcodes seen here are kept warm by the threat prefetcher.
+    """
+    if not zipcode:
+        return None
+    track_active_zipcode(zipcode)
+    return get_cached_threat_count(zipcode)
+
+async def lookup_threat_count_async(zipcode):
+    """Async version of lookup_threat_count, which reads the on-disk threat cache off the event loop."""
+    if not zipcode:
+        return None
+    track_active_zipcode(zipcode)
+    return await get_cached_threat_count_async(zipcode)
+
+def assess_risk(latitude, longitude, ip, user_id=None):
+    """
+    Run the full security assessment for a request.
+
+    With a user_id, the location factor uses that user's saved safe locations.
+
+    Reverse geocoding and the network lookup are independent, so they run
+    concurrently on the shared pool while the whitelist check runs here. Each has
+    its own timeout, so the total latency is roughly that of the slowest lookup,
+    or less when the factors that need the slow one end up being skipped.
+    
+    Returns:
+        dict: Same as calculate_risk
+    """
+    location_stage = run_stage("Reverse geocoding", GEOCODE_TIMEOUT_SECONDS, load_location_context,
+                               latitude, longitude, cached=get_cached_location_context)
+    network_stage = run_stage("Network lookup", NETWORK_TIMEOUT_SECONDS, load_network_info, ip,
+                              cached=get_cached_network_info)
+
+    return get_risk_rules().score(FactorInputs(
+        whitelist=LazyInput(check_location_is_whitelisted, latitude, longitude, user_id),
+        network_type=LazyInput(network_stage.result, NETWORK_TYPE_CODES["Unknown Network"]),
+        threat_count=LazyInput(lambda: lookup_threat_count(location_stage.result(default={}).get('postcode'))),
+    ))
+
+async def assess_risk_async(latitude, longitude, ip, user_id=None):
+    """Async version of assess_risk, for the ASGI serving mode."""
+    location_context, network_type, index = await asyncio.gather(
+        run_stage_async("Reverse geocoding", GEOCODE_TIMEOUT_SECONDS,
+                        get_location_context_async(latitude, longitude), default={}),
+        run_stage_async("Network lookup", NETWORK_TIMEOUT_SECONDS,
+                        get_network_info_async(ip), default=NETWORK_TYPE_CODES["Unknown Network"]),
+        get_safe_location_index_async(user_id),
+    )
+
+    # The threat count is awaited between rounds, only if the other factors leave the zone open
+    rules = get_risk_rules()
+    assessment, done = rules.new_assessment(), set()
+    inputs = FactorInputs(
+        whitelist=LazyInput(check_location_is_whitelisted, latitude, longitude, user_id, index),
+        network_type=network_type,
+    )
+    for _ in rules.evaluate(assessment, inputs, done):
+        pass
+    if not rules.is_complete(done):
+        inputs["threat_count"] = await lookup_threat_count_async(location_context.get('postcode'))
+        for _ in rules.evaluate(assessment, inputs, done):
+            pass
+    return assessment
+
+def calculate_risk(latitude, longitude, ip, zipcode, network_type=None, user_id=None, index=None):
     """
     Calculate weighted risk score based on multiple factors.
     
@@ -24,61 +122,242 @@ def calculate_risk(latitude, longitude, ip, zipcode):
         longitude (float): User's current longitude
         ip (str): Connected WiFi network SSID
         zipcode (int): Threat intelligence for the user's location
+        network_type (int): Network type of ip if already looked up
+        user_id (str): User whose saved safe locations the location factor uses
+        index (SphereKDTree): Safe location index of user_id if already loaded
     
     Returns:
-        dict: Contains risk_score, zone, and risk_factors
+        dict: Contains risk_score, zone, and risk_factors. Factors whose lookup
+              failed are listed with an "Unknown" status and add no points; factors
+              that could no longer change the zone are skipped and not listed.
     """
-    
-    risk_score = 0
-    risk_reasons = []
-    risk_actions = []
-    
-    # Factor 1: Location-based risk (+2 points if not at home)
-    isAtSafeLocation, distanceFromSafeLocation = check_location_is_whitelisted(latitude, longitude)
-    if isAtSafeLocation:
-        risk_reasons.append(["Good", f"Location: You are {distanceFromSafeLocation:.1f}km from the closest safe location"])
-        risk_actions.append("")
-    else:
-        risk_score += 2
-        risk_reasons.append(["Bad", f"Location: {distanceFromSafeLocation:.1f}km from the closest safe location"])
-        risk_actions.append("Turn on the VPN")
-    
-    # Factor 2: WiFi Security risk (+4 points for unsafe networks)
-    network_type = get_network_info(ip)
-    if network_type in [1, 4]:
-        risk_reasons.append(["Good", f"Network: 'You are on {NETWORK_TYPE[network_type]}"])
-        risk_actions.append("")
-    else:
-        risk_score += 4
-        risk_reasons.append(["Bad", f"Network: 'You are on {NETWORK_TYPE[network_type]}"])
-        risk_actions.append("Activate 2-Factor Authentication for Your Laptop")
-        risk_actions.append("Find a new work location")
-    
-    # # Factor 3: Local cyber threat intelligence (+5 points if threats present)
-    # num_threats = get_cyber_threats_by_zip(zipcode)
-    # if num_threats == 0:
-    #     risk_reasons.append(["Good", f"Threats: 'There are {num_threats} active cyber threats in your area."])
-    # else:
-    #     risk_score += 5
-    #     risk_reasons.append(["Bad", f"Threats: 'There are {num_threats} active cyber threats in your area."])
-    #     if len(risk_actions) != 3:
-    #         risk_actions.append("Activate 2-Factor Authentication for Your Laptop")
-    #         risk_actions.append("Find a new work location")
-    
-    # Determine security zone based on total score
-    if risk_score == 0:
-        zone = "Green"
-    elif 1 <= risk_score <= 5:
-        zone = "Yellow"
-    else:  # 6+ points
-        zone = "Red"
-    
-    return {
-        'score': risk_score,
-        'zone': zone,
-        'reasons': risk_reasons,
-        'actions': risk_actions,
-    }
+    return get_risk_rules().score(FactorInputs(
+        whitelist=LazyInput(check_location_is_whitelisted, latitude, longitude, user_id, index),
+        network_type=network_type if network_type is not None else LazyInput(get_network_info, ip),
+        threat_count=LazyInput(lookup_threat_count, zipcode),
+    ))
+
+def stream_risk(latitude, longitude, ip, user_id=None):
+    """
+    Run the security assessment, yielding each factor as soon as it is scored.
+
+    Yields:
+        dict: A "factor" event per factor, in completion order, carrying its reason,
+              the actions it added and the running score and zone; then a "summary"
+              event holding the full assessment, as returned by assess_risk
+    """
+    location_stage = run_stage("Reverse geocoding", GEOCODE_TIMEOUT_SECONDS, load_location_context,
+                               latitude, longitude, cached=get_cached_location_context)
+    network_stage = run_stage("Network lookup", NETWORK_TIMEOUT_SECONDS, load_network_info, ip,
+                              cached=get_cached_network_info)
+
+    # The whitelist check is local, so the location factor is ready immediately
+    rules = get_risk_rules()
+    assessment = rules.new_assessment()
+    inputs = FactorInputs(whitelist=check_location_is_whitelisted(latitude, longitude, user_id))
+    done = set()
+    yield from _factor_events(rules, assessment, inputs, done)
+
+    for stage in iter_stages([location_stage, network_stage]):
+        if stage is network_stage:
+            inputs["network_type"] = stage.result(default=NETWORK_TYPE_CODES["Unknown Network"])
+        else:
+            inputs["threat_count"] = LazyInput(lookup_threat_count, stage.result(default={}).get('postcode'))
+        yield from _factor_events(rules, assessment, inputs, done)
+        if rules.is_complete(done):
+            break # Nothing left that could change the zone
+
+    yield {"type": "summary", **assessment}
+
+async def stream_risk_async(latitude, longitude, ip, user_id=None):
+    """Async version of stream_risk, for the ASGI serving mode."""
+    async def network_type():
+        return "network_type", await run_stage_async("Network lookup", NETWORK_TIMEOUT_SECONDS, get_network_info_async(ip),
+                                                     default=NETWORK_TYPE_CODES["Unknown Network"])
+
+    async def threat_count():
+        location_context = await run_stage_async("Reverse geocoding", GEOCODE_TIMEOUT_SECONDS,
+                                                 get_location_context_async(latitude, longitude), default={})
+        return "threat_count", await lookup_threat_count_async(location_context.get('postcode'))
+
+    pending = [asyncio.ensure_future(network_type()), asyncio.ensure_future(threat_count())]
+
+    rules = get_risk_rules()
+    assessment = rules.new_assessment()
+    index = await get_safe_location_index_async(user_id)
+    inputs = FactorInputs(whitelist=check_location_is_whitelisted(latitude, longitude, user_id, index))
+    done = set()
+    try:
+        for event in _factor_events(rules, assessment, inputs, done):
+            yield event
+        for next_input in asyncio.as_completed(pending):
+            name, value = await next_input
+            inputs[name] = value
+            for event in _factor_events(rules, assessment, inputs, done):
+                yield event
+            if rules.is_complete(done):
+                break # Nothing left that could change the zone
+    finally:
+        # Lookups no factor needs any more, or the client disconnected mid-stream
+        for task in pending:
+            task.cancel()
+
+    yield {"type": "summary", **assessment}
+
+def _factor_events(rules, assessment, inputs, done):
+    for reason, actions in rules.evaluate(assessment, inputs, done):
+        yield {
+            "type": "factor",
+            "reason": reason,
+            "actions": actions,
+            "score": assessment['score'],
+            "zone": assessment['zone'],
+        }
+
+def assess_risk_batch(records):
+    """
+    Run the security assessment for many devices at once.
+
+    The whitelist check runs vectorized over all records and the network lookup
+    once per distinct IP. Reverse geocoding then runs once per geocode cache cell,
+    and only for records whose zone the threat factor could still change. At most
+    BATCH_MAX_CONCURRENCY lookups are in flight at a time.
+
+    Args:
+        records (list): (latitude, longitude, ip) tuples
+
+    Returns:
+        list: One assessment per record, as returned by assess_risk, in input order
+    """
+    if not records:
+        return []
+
+    ips = list(dict.fromkeys(ip for _, _, ip in records))
+    network_types = map_bounded(get_network_info, ips, BATCH_MAX_CONCURRENCY)
+    batch = _BatchAssessment(records, dict(zip(ips, network_types)))
+
+    cells = batch.cells_to_geocode()
+    location_contexts = map_bounded(lambda coordinates: get_location_context(*coordinates),
+                                    cells.values(), BATCH_MAX_CONCURRENCY)
+    return batch.finish(dict(zip(cells, location_contexts)))
+
+async def assess_risk_batch_async(records):
+    """Async version of assess_risk_batch, for the ASGI serving mode."""
+    if not records:
+        return []
+
+    ips = list(dict.fromkeys(ip for _, _, ip in records))
+    network_types = await map_bounded_async(get_network_info_async, ips, BATCH_MAX_CONCURRENCY)
+    batch = _BatchAssessment(records, dict(zip(ips, network_types)))
+
+    cells = batch.cells_to_geocode()
+    location_contexts = await map_bounded_async(lambda coordinates: get_location_context_async(*coordinates),
+                                                cells.values(), BATCH_MAX_CONCURRENCY)
+    return batch.finish(dict(zip(cells, location_contexts)))
+
+class _BatchAssessment:
+    """
+    Batch scoring in two rounds: every factor but the threat factor first, then
+    the threat factor once the records that still need it have been geocoded.
+    """
+
+    def __init__(self, records, network_types):
+        """
+        Args:
+            network_types (dict): IP -> network type; None where the lookup failed
+        """
+        self.rules = get_risk_rules()
+        self.records = records
+        latitudes, longitudes, _ = zip(*records)
+        is_safe, distances = check_locations_are_whitelisted(latitudes, longitudes)
+
+        self.assessments = []
+        self.inputs = []
+        self.done = []
+        for index, (_, _, ip) in enumerate(records):
+            network_type = network_types[ip]
+            inputs = FactorInputs(
+                whitelist=(bool(is_safe[index]), float(distances[index])),
+                network_type=network_type if network_type is not None else NETWORK_TYPE_CODES["Unknown Network"],
+            )
+            assessment, done = self.rules.new_assessment(), set()
+            for _ in self.rules.evaluate(assessment, inputs, done):
+                pass
+            self.assessments.append(assessment)
+            self.inputs.append(inputs)
+            self.done.append(done)
+
+    def cells_to_geocode(self):
+        """
+        Returns:
+            dict: Geocode cell -> coordinates of its first record, for records still being scored
+        """
+        cells = {}
+        for (latitude, longitude, _), done in zip(self.records, self.done):
+            if not self.rules.is_complete(done):
+                cells.setdefault(geocode_cell(latitude, longitude), (latitude, longitude))
+        return cells
+
+    def finish(self, location_contexts):
+        """
+        Args:
+            location_contexts (dict): Geocode cell -> location context; None where the lookup failed
+
+        Returns:
+            list: The assessments, in input order
+        """
+        for (latitude, longitude, _), assessment, inputs, done in zip(self.records, self.assessments, self.inputs, self.done):
+            if self.rules.is_complete(done):
+                continue
+            location_context = location_contexts[geocode_cell(latitude, longitude)] or {}
+            inputs["threat_count"] = LazyInput(lookup_threat_count, location_context.get('postcode'))
+            for _ in self.rules.evaluate(assessment, inputs, done):
+                pass
+        return self.assessments
+
+def calculate_risk_offline(records):
+    """
+    Score historical records without contacting any upstream service, e.g. for audits.
+
+    Whitelist distances are computed vectorized over all records. Network types come
+    from the local CIDR table only (database/network_ranges, which covers private
+    ranges and the main blocks of large ISPs, cloud providers and mobile carriers),
+    threat counts from the stored threat cache, and
+    records without a zipcode are geocoded through the offline postcode table if one
+    is configured. Anything these can't answer is reported as "Unknown".
+
+    Args:
+        records (list): (latitude, longitude, ip, zipcode) tuples; zipcode may be None
+
+    Returns:
+        list: One assessment per record, as returned by calculate_risk, in input order
+    """
+    if not records:
+        return []
+
+    rules = get_risk_rules()
+    latitudes, longitudes, ips, _ = zip(*records)
+    is_safe, distances = check_locations_are_whitelisted(latitudes, longitudes)
+    network_types = {ip: classify_network_offline(ip) for ip in set(ips)}
+    threat_counts = {}
+
+    def stored_threat_count(latitude, longitude, zipcode):
+        if not zipcode:
+            zipcode = (resolve_address_offline(latitude, longitude) or {}).get('postcode')
+        if not zipcode:
+            return None
+        if zipcode not in threat_counts:
+            threat_counts[zipcode] = get_stored_threat_count(zipcode)
+        return threat_counts[zipcode]
+
+    return [
+        rules.score(FactorInputs(
+            whitelist=(bool(is_safe[index]), float(distances[index])),
+            network_type=network_types[ip],
+            threat_count=LazyInput(stored_threat_count, latitude, longitude, zipcode),
+        ))
+        for index, (latitude, longitude, ip, zipcode) in enumerate(records)
+    ]
 
 def get_base_recommendations(zone):
     """Get base security recommendations for each zone."""
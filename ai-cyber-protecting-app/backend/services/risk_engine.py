@@ -0,0 +1,175 @@
+"""
+Risk Engine for AI Cyber Protecting App
+Scores pluggable risk factors against rules loaded from a config file.
+
+Factors are registered with @risk_factor, declaring the inputs they need and how
+costly those are to obtain. A rules file picks the factors to run, with the points
+and actions each adds when it reports "Bad", and sets the zone thresholds:
+
+    {
+      "zones": [{"name": "Green", "maxScore": 0}, {"name": "Yellow", "maxScore": 5}, {"name": "Red"}],
+      "factors": [
+        {"factor": "location", "points": 2, "actions": ["Turn on the VPN"]},
+        ...
+      ]
+    }
+
+Rules are compiled once into a RiskRules object. It runs the cheapest factors
+first, and once no remaining factor could move the score into another zone it
+stops, so their inputs (e.g. a Gemini threat lookup) are never fetched.
+"""
+import json
+import math
+
+_factors = {}
+
+class RiskFactor:
+    """A registered factor: its inputs, relative cost and evaluate function."""
+
+    def __init__(self, name: str, requires: tuple, cost: int, evaluate, compile_rule=None):
+        self.name = name
+        self.requires = requires
+        self.cost = cost
+        self.evaluate = evaluate
+        self.compile_rule = compile_rule
+
+def risk_factor(name: str, requires=(), cost: int = 0, compile_rule=None):
+    """
+    Register evaluate(inputs, rule) as a risk factor.
+
+    evaluate reads the inputs it requires and returns (status, description), where
+    status is "Good", "Bad" or "Unknown" (the factor could not be checked).
+
+    Args:
+        requires (tuple): Names of the inputs evaluate reads
+        cost (int): Relative cost of obtaining those inputs; cheaper factors run first
+        compile_rule (callable): Optional; turns the factor's rule from the rules
+                                 file into the form evaluate expects, raising
+                                 ValueError if it is invalid
+    """
+    def register(evaluate):
+        _factors[name] = RiskFactor(name, tuple(requires), cost, evaluate, compile_rule)
+        return evaluate
+    return register
+
+class LazyInput:
+    """A factor input that is only computed if a factor actually reads it."""
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+class FactorInputs(dict):
+    """Input name -> value mapping that resolves LazyInput values on first access."""
+
+    def __getitem__(self, name):
+        value = super().__getitem__(name)
+        if isinstance(value, LazyInput):
+            value = value.function(*value.args)
+            self[name] = value
+        return value
+
+class RiskRules:
+    """A rules file compiled against the registered factors."""
+
+    def __init__(self, config: dict):
+        self._zones = []  # (max score, name), ascending
+        for zone in config["zones"]:
+            max_score = zone.get("maxScore", math.inf)
+            if self._zones and max_score <= self._zones[-1][0]:
+                raise ValueError(f"Zone {zone['name']} must have a higher maxScore than {self._zones[-1][1]}")
+            self._zones.append((max_score, zone["name"]))
+        if not self._zones or self._zones[-1][0] != math.inf:
+            raise ValueError("The last zone must have no maxScore")
+
+        self.factors = []  # (factor, rule), cheapest first
+        for rule in config["factors"]:
+            factor = _factors.get(rule["factor"])
+            if factor is None:
+                raise ValueError(f"Unknown risk factor {rule['factor']!r}")
+            rule = dict(rule, points=rule.get("points", 0), actions=rule.get("actions", []))
+            if rule["points"] < 0:
+                raise ValueError(f"Risk factor {factor.name!r} must not have negative points")
+            if factor.compile_rule is not None:
+                rule = factor.compile_rule(rule)
+            self.factors.append((factor, rule))
+        self.factors.sort(key=lambda item: item[0].cost)
+
+    @classmethod
+    def from_file(cls, filename):
+        with open(filename, 'r') as file:
+            return cls(json.load(file))
+
+    def zone(self, score):
+        """Return the name of the zone a score falls in."""
+        for max_score, name in self._zones:
+            if score <= max_score:
+                return name
+
+    def new_assessment(self):
+        return {
+            'score': 0,
+            'zone': self.zone(0),
+            'reasons': [],
+            'actions': [],
+        }
+
+    def is_complete(self, done):
+        """True once every factor has either run or been skipped."""
+        return len(done) == len(self.factors)
+
+    def evaluate(self, assessment, inputs, done):
+        """
+        Run every factor that hasn't run yet and whose inputs are all present, cheapest first.
+
+        Once the factors still outstanding couldn't change the zone even if they all
+        reported "Bad", they are skipped and marked done without running. Actions
+        already recommended by another factor are not repeated.
+
+        Args:
+            assessment (dict): Updated in place
+            inputs (FactorInputs): Inputs available so far
+            done (set): Names of factors that already ran; updated in place
+
+        Yields:
+            tuple: (reason, actions added) for each factor that ran
+        """
+        for factor, rule in self.factors:
+            if factor.name in done or self._skip_if_settled(assessment, done):
+                continue
+            if not all(name in inputs for name in factor.requires):
+                continue
+
+            done.add(factor.name)
+            status, description = factor.evaluate(inputs, rule)
+            added = []
+            if status == "Bad":
+                assessment['score'] += rule["points"]
+                added = [action for action in rule["actions"] if action not in assessment['actions']]
+                assessment['actions'].extend(added)
+            assessment['reasons'].append([status, description])
+            assessment['zone'] = self.zone(assessment['score'])
+            yield assessment['reasons'][-1], added
+
+        # Also covers factors still waiting for their inputs
+        self._skip_if_settled(assessment, done)
+
+    def _skip_if_settled(self, assessment, done):
+        """Mark every factor done if the outstanding ones can no longer change the zone."""
+        outstanding = sum(rule["points"] for factor, rule in self.factors if factor.name not in done)
+        if self.zone(assessment['score'] + outstanding) != assessment['zone']:
+            return False
+        done.update(factor.name for factor, _ in self.factors)
+        return True
+
+    def score(self, inputs):
+        """
+        Run all factors on inputs, cheapest first.
+
+        Returns:
+            dict: score, zone, reasons and actions
+        """
+        assessment = self.new_assessment()
+        for _ in self.evaluate(assessment, inputs, set()):
+            pass
+        return assessment
@@ -0,0 +1,58 @@
+"""
+Risk Factors for AI Cyber Protecting App
+Built-in risk factor plugins for the risk engine: location, network and local threats.
+"""
+from services.network_service import NETWORK_TYPE
+from services.risk_engine import risk_factor
+
+NETWORK_TYPE_NAMES = {code: name for name, code in NETWORK_TYPE.items()}
+
+@risk_factor("location", requires=("whitelist",), cost=0)
+def location_factor(inputs, rule):
+    """
+    Whether the user is at one of their safe locations.
+
+    Inputs:
+        whitelist: (is at a safe location, km from the closest one)
+    """
+    isAtSafeLocation, distanceFromSafeLocation = inputs["whitelist"]
+    if isAtSafeLocation:
+        return "Good", f"Location: You are {distanceFromSafeLocation:.1f}km from the closest safe location"
+    return "Bad", f"Location: {distanceFromSafeLocation:.1f}km from the closest safe location"
+
+def _compile_network_rule(rule):
+    for name in rule.get("goodNetworkTypes", []):
+        if name not in NETWORK_TYPE:
+            raise ValueError(f"Unknown network type {name!r} in goodNetworkTypes")
+    return dict(rule, goodNetworkTypes={NETWORK_TYPE[name] for name in rule.get("goodNetworkTypes", [])})
+
+@risk_factor("network", requires=("network_type",), cost=1, compile_rule=_compile_network_rule)
+def network_factor(inputs, rule):
+    """
+    Whether the user's network is one of the rule's goodNetworkTypes.
+
+    Inputs:
+        network_type: network_service.NETWORK_TYPE code
+    """
+    network_type = inputs["network_type"]
+    if network_type == NETWORK_TYPE["Unknown Network"]:
+        # Lookup failed, timed out or its upstream is down: report a partial assessment
+        return "Unknown", "Network: Your network type could not be determined right now"
+    if network_type in rule["goodNetworkTypes"]:
+        return "Good", f"Network: 'You are on {NETWORK_TYPE_NAMES[network_type]}"
+    return "Bad", f"Network: 'You are on {NETWORK_TYPE_NAMES[network_type]}"
+
+@risk_factor("threat", requires=("threat_count",), cost=2)
+def threat_factor(inputs, rule):
+    """
+    Whether cyber threats are active in the user's zipcode.
+
+    Inputs:
+        threat_count: Number of active threats, or None if not known
+    """
+    num_threats = inputs["threat_count"]
+    if num_threats is None:
+        return "Unknown", "Threats: Threat intelligence for your area is not available yet"
+    if num_threats == 0:
+        return "Good", f"Threats: 'There are {num_threats} active cyber threats in your area."
+    return "Bad", f"Threats: 'There are {num_threats} active cyber threats in your area."
@@ -0,0 +1,318 @@
+"""
+Risk Sessions for AI Cyber Protecting App
+Incremental re-assessment for clients that poll /api/check-security.
+
+A client that sends a sessionId has the factor inputs of its last check
+remembered, and the next check only looks up again the ones whose own inputs
+changed:
+
+- the whitelist distance, once the user is SESSION_MOVE_THRESHOLD_KM from where
+  it was computed, could have crossed the safe location radius, or their safe
+  locations were edited
+- the network type, once the IP changes
+- the postcode, once the coordinates leave their reverse-geocode cell, and the
+  threat count once the postcode changes. While the other factors settle the
+  zone, the postcode isn't looked up at all.
+
+Lookups that failed, and inputs older than SESSION_INPUT_MAX_AGE_SECONDS, are
+always redone. The response then only carries the fields that changed since the
+revision the client holds (see RiskSession.delta).
+
+Session ids are issued by the server, in the response to the check that
+started the session, and a session only serves checks from the same owner (the
+userId of checks that carry its userToken, else the client IP). A check with an id the server doesn't know, or
+from another owner, starts a new session. Concurrent checks of one session are
+assessed one at a time.
+
+Sessions live in the memory of the worker process that served them. A check
+that lands on another worker is assessed in full and answered with a full
+response under a new session id, which the client then moves to.
+"""
+import asyncio
+import os
+import secrets
+import threading
+import time
+
+from services.cache import TTLCache
+from services.concurrency import run_stage, run_stage_async
+from services.location_service import (
+    SAFE_LOCATION_RADIUS_KM, calculate_distance, check_location_is_whitelisted, geocode_cell,
+    get_cached_location_context, get_location_context_async, get_safe_location_index, get_safe_location_index_async,
+    load_location_context,
+)
+from services.metrics import get_counter, register_cache
+from services.network_service import (
+    NETWORK_TYPE as NETWORK_TYPE_CODES, get_cached_network_info, get_network_info_async, load_network_info,
+)
+from services.risk_calculator import (
+    GEOCODE_TIMEOUT_SECONDS, NETWORK_TIMEOUT_SECONDS, get_risk_rules, lookup_threat_count, lookup_threat_count_async,
+)
+from services.risk_engine import FactorInputs, LazyInput
+from services.threat_prefetcher import track_active_zipcode
+from services.user_store import normalize_user_id
+
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 10000))
+# Sessions not polled for this long are forgotten
+SESSION_TTL_SECONDS = float(os.getenv('SESSION_TTL_SECONDS', 10 * 60))
+# Remembered inputs are looked up again after this long, even if nothing changed
+SESSION_INPUT_MAX_AGE_SECONDS = float(os.getenv('SESSION_INPUT_MAX_AGE_SECONDS', 5 * 60))
+# Movement after which the whitelist distance is recomputed
+SESSION_MOVE_THRESHOLD_KM = float(os.getenv('SESSION_MOVE_THRESHOLD_KM', 0.05))
+
+SESSION_INPUTS_METRIC = 'session_inputs_total'
+SESSION_INPUTS = ('whitelist', 'network', 'geocode', 'threats')
+
+_input_counts = {name: {"reused": 0, "recomputed": 0} for name in SESSION_INPUTS}
+_input_counts_lock = threading.Lock()
+
+def _count_input(name, outcome):
+    with _input_counts_lock:
+        _input_counts[name][outcome] += 1
+    get_counter(SESSION_INPUTS_METRIC, input=name, outcome=outcome).inc()
+
+class RiskSession:
+    """
+    The inputs and response of a client's last check.
+
+    assess runs one check at a time per session, as does assess_async; a session
+    is only used from one of the two serving modes.
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.revision = None
+        self._response = None
+        # Input name -> (what it was computed from, value, monotonic time computed)
+        self._inputs = {}
+        # Whether the last check needed the threat factor, so its postcode is looked up up front
+        self._postcode_needed = True
+        self._lock = threading.Lock()
+        self._assess_lock = threading.Lock()
+        self._assess_lock_async = asyncio.Lock()
+
+    def _reuse(self, name, key, now):
+        """Return the remembered value of an input computed from key, or None if it has to be looked up."""
+        remembered = self._inputs.get(name)
+        if remembered is None or remembered[0] != key or now - remembered[2] > SESSION_INPUT_MAX_AGE_SECONDS:
+            return None
+        return remembered[1]
+
+    def _remember(self, name, key, value, now):
+        self._inputs[name] = (key, value, now)
+
+    def _reuse_whitelist(self, index, latitude, longitude, now):
+        remembered = self._inputs.get('whitelist')
+        if remembered is None or now - remembered[2] > SESSION_INPUT_MAX_AGE_SECONDS:
+            return None
+        (remembered_index, remembered_latitude, remembered_longitude), whitelist, _ = remembered
+        if remembered_index is not index:
+            return None # Safe locations were edited
+        moved = calculate_distance(latitude, longitude, remembered_latitude, remembered_longitude)
+        _, distance = whitelist
+        # Moving m km changes the distance by at most m km, so is_safe can't have flipped
+        if moved > SESSION_MOVE_THRESHOLD_KM or abs(distance - SAFE_LOCATION_RADIUS_KM) <= moved:
+            return None
+        return whitelist
+
+    def _plan(self, latitude, longitude, ip, index, now):
+        """
+        Args:
+            index (SphereKDTree): The user's index, from get_safe_location_index
+
+        Returns:
+            tuple: (safe location index, geocode cell, and the whitelist, network type
+                   and postcode inputs that can be reused, None where they can't)
+        """
+        cell = geocode_cell(latitude, longitude)
+        return (index, cell, self._reuse_whitelist(index, latitude, longitude, now),
+                self._reuse('network_type', ip, now), self._reuse('postcode', cell, now))
+
+    def assess(self, latitude, longitude, ip, user_id=None):
+        """
+        Run the security assessment, reusing what the last one looked up where its inputs haven't changed.
+
+        Returns:
+            dict: Same as risk_calculator.assess_risk
+        """
+        with self._assess_lock:
+            return self._assess(latitude, longitude, ip, user_id)
+
+    def _assess(self, latitude, longitude, ip, user_id):
+        now = time.monotonic()
+        plan = self._plan(latitude, longitude, ip, get_safe_location_index(user_id), now)
+        _, _, _, network_type, postcode = plan
+
+        # Only the lookups that are needed, concurrently as in assess_risk
+        location_stage = None
+        if postcode is None and self._postcode_needed:
+            location_stage = run_stage("Reverse geocoding", GEOCODE_TIMEOUT_SECONDS, load_location_context,
+                                       latitude, longitude, cached=get_cached_location_context)
+        if network_type is None:
+            network_stage = run_stage("Network lookup", NETWORK_TIMEOUT_SECONDS, load_network_info, ip,
+                                      cached=get_cached_network_info)
+            network_type = LazyInput(network_stage.result, NETWORK_TYPE_CODES["Unknown Network"])
+
+        assessment, inputs, done = self._evaluate(latitude, longitude, ip, plan, network_type, now)
+        if not self._postcode_needed:
+            return assessment
+
+        if postcode is None:
+            if location_stage is None:
+                location_stage = run_stage("Reverse geocoding", GEOCODE_TIMEOUT_SECONDS, load_location_context,
+                                           latitude, longitude, cached=get_cached_location_context)
+            postcode = location_stage.result(default={}).get('postcode')
+        threat_count = self._reuse_threat_count(plan, postcode, now)
+        if threat_count is None:
+            threat_count = self._remember_threat_count(postcode, lookup_threat_count(postcode), now)
+        return self._evaluate_threats(assessment, inputs, done, threat_count)
+
+    async def assess_async(self, latitude, longitude, ip, user_id=None):
+        """Async version of assess, for the ASGI serving mode."""
+        async with self._assess_lock_async:
+            return await self._assess_async(latitude, longitude, ip, user_id)
+
+    async def _assess_async(self, latitude, longitude, ip, user_id):
+        now = time.monotonic()
+        plan = self._plan(latitude, longitude, ip, await get_safe_location_index_async(user_id), now)
+        _, _, _, network_type, postcode = plan
+
+        def location_lookup():
+            return run_stage_async("Reverse geocoding", GEOCODE_TIMEOUT_SECONDS,
+                                   get_location_context_async(latitude, longitude), default={})
+
+        lookups = {}
+        if postcode is None and self._postcode_needed:
+            lookups['location_context'] = location_lookup()
+        if network_type is None:
+            lookups['network_type'] = run_stage_async("Network lookup", NETWORK_TIMEOUT_SECONDS,
+                                                       get_network_info_async(ip),
+                                                       default=NETWORK_TYPE_CODES["Unknown Network"])
+        results = dict(zip(lookups, await asyncio.gather(*lookups.values())))
+
+        assessment, inputs, done = self._evaluate(latitude, longitude, ip, plan,
+                                                  results.get('network_type', network_type), now)
+        if not self._postcode_needed:
+            return assessment
+
+        if postcode is None:
+            location_context = results['location_context'] if 'location_context' in results else await location_lookup()
+            postcode = location_context.get('postcode')
+        threat_count = self._reuse_threat_count(plan, postcode, now)
+        if threat_count is None:
+            threat_count = self._remember_threat_count(postcode, await lookup_threat_count_async(postcode), now)
+        return self._evaluate_threats(assessment, inputs, done, threat_count)
+
+    def _evaluate(self, latitude, longitude, ip, plan, network_type, now):
+        """
+        Score every factor but the threat factor. Sets _postcode_needed to whether
+        the threat factor could still change the zone.
+
+        Returns:
+            tuple: (assessment, inputs, names of factors done)
+        """
+        index, _, whitelist, reused_network_type, _ = plan
+        rules = get_risk_rules()
+        assessment, done = rules.new_assessment(), set()
+        inputs = FactorInputs(
+            whitelist=whitelist if whitelist is not None else LazyInput(
+                check_location_is_whitelisted, latitude, longitude, None, index
+            ),
+            network_type=network_type,
+        )
+        for _ in rules.evaluate(assessment, inputs, done):
+            pass
+        self._postcode_needed = not rules.is_complete(done)
+
+        # Remember what was looked up; inputs of skipped factors were never resolved
+        if whitelist is not None:
+            _count_input('whitelist', "reused")
+        elif not isinstance(dict.get(inputs, 'whitelist'), LazyInput):
+            _count_input('whitelist', "recomputed")
+            self._remember('whitelist', (index, latitude, longitude), inputs['whitelist'], now)
+        if reused_network_type is not None:
+            _count_input('network', "reused")
+        elif not isinstance(dict.get(inputs, 'network_type'), LazyInput):
+            _count_input('network', "recomputed")
+            if inputs['network_type'] != NETWORK_TYPE_CODES["Unknown Network"]:
+                self._remember('network_type', ip, inputs['network_type'], now)
+        return assessment, inputs, done
+
+    def _reuse_threat_count(self, plan, postcode, now):
+        """Remember the postcode, and return the last threat count if it is the same, else None."""
+        _, cell, _, _, reused_postcode = plan
+        _count_input('geocode', "reused" if reused_postcode is not None else "recomputed")
+        if postcode:
+            self._remember('postcode', cell, postcode, now)
+
+        threat_count = self._reuse('threat_count', postcode, now) if postcode else None
+        if threat_count is not None:
+            _count_input('threats', "reused")
+            track_active_zipcode(postcode) # Keep it warm while the session is active
+        return threat_count
+
+    def _remember_threat_count(self, postcode, threat_count, now):
+        """Remember a threat count that was just looked up, and return it."""
+        _count_input('threats', "recomputed")
+        if threat_count is not None:
+            self._remember('threat_count', postcode, threat_count, now)
+        return threat_count
+
+    def _evaluate_threats(self, assessment, inputs, done, threat_count):
+        """Score the threat factor with the threat count, looked up or reused by the caller."""
+        inputs["threat_count"] = threat_count
+        for _ in get_risk_rules().evaluate(assessment, inputs, done):
+            pass
+        return assessment
+
+    def delta(self, response, revision=None):
+        """
+        Record response as the session's latest and return what changed in it.
+
+        Args:
+            response (dict): The full check-security response
+            revision (str): Revision of the last response the client received, if any
+
+        Returns:
+            dict: sessionId, revision and full. If revision is the session's
+                  current one, full is False and only the fields of response
+                  that changed since follow (none if nothing did, in which case
+                  the revision stays the same). Otherwise full is True and all
+                  of response follows.
+        """
+        with self._lock:
+            base = self._response if revision is not None and revision == self.revision else None
+            changed = {name: value for name, value in response.items() if base is None or base.get(name) != value}
+            if base is None or changed:
+                self.revision = secrets.token_hex(8)
+            self._response = response
+            return {"sessionId": self.session_id, "revision": self.revision, "full": base is None, **changed}
+
+_sessions = TTLCache(SESSION_CACHE_SIZE, SESSION_TTL_SECONDS)  # (session id, owner) -> RiskSession
+register_cache('risk_sessions', _sessions.stats)
+
+def get_risk_session(session_id: str, ip: str, user_id: str = None):
+    """
+    Return the session with this id, or start a new one under an id of the
+    server's choosing if it is unknown, expired or belongs to someone else.
+
+    Args:
+        session_id (str): Id the client got in a previous response, if any
+        ip (str): The client's IP, which owns the session if there is no user_id
+        user_id (str): The authenticated user the checks are for, who owns the session
+    """
+    owner = normalize_user_id(user_id) if user_id else ip
+    session = _sessions.get((session_id, owner)) if session_id else None
+    if session is None:
+        session = RiskSession(secrets.token_urlsafe(16))
+    _sessions.set((session.session_id, owner), session) # Every check extends its lifetime
+    return session
+
+def get_risk_session_stats():
+    """
+    Returns:
+        dict: Session cache counters, and how often each input was reused or looked up again
+    """
+    with _input_counts_lock:
+        inputs = {name: dict(counts) for name, counts in _input_counts.items()}
+    return {**_sessions.stats(), "inputs": inputs}
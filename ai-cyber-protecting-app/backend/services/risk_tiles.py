@@ -0,0 +1,130 @@
+"""
+Risk Tiles for AI Cyber Protecting App
+Grids of location risk over web-mercator map tiles, for shading the map.
+
+Each z/x/y tile is sampled at the centres of a RISK_TILE_GRID_SIZE x
+RISK_TILE_GRID_SIZE grid. For every sample the tile holds the distance to the
+closest whitelisted location, computed in one vectorized pass, and the cached
+threat count of its postcode, with all postcodes found in one pass over the
+offline geocoder's KD-tree. Without an offline geocoder the tile says that
+the threat layer is unavailable. Tiles are
+cached until the whitelist changes or RISK_TILE_TTL_SECONDS pass, so threat
+counts refreshed in the meantime show up.
+"""
+import math
+import os
+
+import numpy as np
+
+from services.cache import TTLCache
+from services.location_service import (
+    SAFE_LOCATION_RADIUS_KM, check_locations_are_whitelisted, get_whitelist_generation, resolve_postcodes_offline,
+)
+from services.metrics import register_cache
+from services.threat_service import get_stored_threat_count
+
+RISK_TILE_GRID_SIZE = int(os.getenv('RISK_TILE_GRID_SIZE', 32))
+RISK_TILE_MAX_ZOOM = int(os.getenv('RISK_TILE_MAX_ZOOM', 18))
+RISK_TILE_CACHE_SIZE = int(os.getenv('RISK_TILE_CACHE_SIZE', 4096))
+RISK_TILE_TTL_SECONDS = float(os.getenv('RISK_TILE_TTL_SECONDS', 10 * 60))
+
+_tile_cache = TTLCache(RISK_TILE_CACHE_SIZE, RISK_TILE_TTL_SECONDS)
+register_cache('risk_tile', _tile_cache.stats)
+_tile_cache_generation = None
+
+def _mercator_latitudes(tile_rows):
+    """Convert fractional tile rows (0 at the top of the map, 1 at the bottom) to latitudes."""
+    return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * tile_rows))))
+
+def tile_bounds(z: int, x: int, y: int):
+    """
+    Returns:
+        dict: north, south, west and east edges of the tile in degrees
+    """
+    tiles = 2 ** z
+    north, south = _mercator_latitudes(np.array([y, y + 1]) / tiles)
+    return {
+        "north": float(north),
+        "south": float(south),
+        "west": x / tiles * 360 - 180,
+        "east": (x + 1) / tiles * 360 - 180,
+    }
+
+def tile_sample_points(z: int, x: int, y: int, grid_size: int = RISK_TILE_GRID_SIZE):
+    """
+    Returns:
+        tuple: (latitudes, longitudes) of the grid's cell centres, each of shape
+               (grid_size, grid_size), rows running north to south
+    """
+    tiles = 2 ** z
+    offsets = (np.arange(grid_size) + 0.5) / grid_size
+    latitudes = _mercator_latitudes((y + offsets) / tiles)
+    longitudes = (x + offsets) / tiles * 360 - 180
+    return np.meshgrid(latitudes, longitudes, indexing='ij')
+
+def compute_risk_tile(z: int, x: int, y: int, grid_size: int = RISK_TILE_GRID_SIZE):
+    """
+    Compute the risk grid of one tile.
+
+    Returns:
+        dict: Tile coordinates and bounds, plus distanceKm and threats grids (rows
+              north to south). Distances are None when no safe locations are
+              configured, threat counts when they aren't known. threatsAvailable
+              is False, and threats None, when no offline geocoder is configured.
+    """
+    latitudes, longitudes = tile_sample_points(z, x, y, grid_size)
+    _, distances = check_locations_are_whitelisted(latitudes, longitudes)
+    distances = np.round(distances, 3).reshape(grid_size, grid_size)
+
+    postcodes = resolve_postcodes_offline(latitudes.ravel(), longitudes.ravel())
+    threats = None
+    if postcodes is not None:
+        threat_counts = {postcode: get_stored_threat_count(postcode) for postcode in set(postcodes) if postcode}
+        threats = [
+            [threat_counts.get(postcode) for postcode in postcodes[row * grid_size:(row + 1) * grid_size]]
+            for row in range(grid_size)
+        ]
+
+    return {
+        "z": z,
+        "x": x,
+        "y": y,
+        "gridSize": grid_size,
+        "bounds": tile_bounds(z, x, y),
+        "safeRadiusKm": SAFE_LOCATION_RADIUS_KM,
+        "distanceKm": [[None if math.isinf(value) else value for value in row] for row in distances.tolist()],
+        "threatsAvailable": threats is not None,
+        "threats": threats,
+    }
+
+def get_risk_tile(z: int, x: int, y: int):
+    """
+    Return the risk grid of a tile, from cache when the whitelist hasn't changed since.
+
+    Raises:
+        ValueError: If z/x/y is not a valid tile
+    """
+    global _tile_cache_generation
+
+    if not 0 <= z <= RISK_TILE_MAX_ZOOM:
+        raise ValueError(f"Zoom level must be between 0 and {RISK_TILE_MAX_ZOOM}")
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"Tile {x}/{y} does not exist at zoom level {z}")
+
+    # Read the generation before the index, so a tile computed during a reload is
+    # filed under the old generation and never served afterwards
+    generation = get_whitelist_generation()
+    if generation != _tile_cache_generation:
+        _tile_cache.clear()
+        _tile_cache_generation = generation
+
+    key = (generation, z, x, y)
+    tile = _tile_cache.get(key)
+    if tile is None:
+        tile = compute_risk_tile(z, x, y)
+        _tile_cache.set(key, tile)
+    return tile
+
+def get_risk_tile_cache_stats():
+    """Return hit/miss counters for the risk tile cache."""
+    return _tile_cache.stats()
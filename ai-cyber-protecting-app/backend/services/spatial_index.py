@@ -0,0 +1,200 @@
+"""
+Spatial Index for AI Cyber Protecting App
+Nearest-neighbour lookups over whitelisted locations using a KD-tree on the unit sphere.
+"""
+import math
+
+import numpy as np
+
+# Radius of Earth in kilometers
+EARTH_RADIUS_KM = 6371
+
+# Nodes holding this many points or fewer are scanned in one vectorized pass
+LEAF_SIZE = 64
+
+def to_unit_vectors(latitudes, longitudes):
+    """
+    Convert latitudes/longitudes in degrees to 3D points on the unit sphere.
+
+    Straight-line (chord) distance between two such points grows monotonically
+    with their great-circle distance, so the nearest point by chord is also the
+    nearest point by Haversine distance.
+
+    Returns:
+        np.ndarray: Array of shape (..., 3)
+    """
+    lat_rad = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon_rad = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_lat = np.cos(lat_rad)
+    return np.stack((cos_lat * np.cos(lon_rad), cos_lat * np.sin(lon_rad), np.sin(lat_rad)), axis=-1)
+
+def chord_to_km(chord: float):
+    """Convert a chord length between unit vectors to great-circle distance in kilometers."""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+class SphereKDTree:
+    """
+    Static KD-tree over (latitude, longitude) points.
+
+    The tree is stored implicitly: points are reordered so that the node covering
+    positions [lo, hi) splits on its median at (lo + hi) // 2, on axis depth % 3.
+    No node objects are needed, which keeps the index compact and cheap to build.
+    """
+
+    def __init__(self, coordinates):
+        """
+        Args:
+            coordinates (list): (latitude, longitude) tuples
+        """
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        vectors = to_unit_vectors(coordinates[:, 0], coordinates[:, 1])
+        order = self.tree_order(vectors)
+
+        self._attach(vectors[order])
+        self.latitudes = coordinates[order, 0]
+        self.longitudes = coordinates[order, 1]
+
+    @classmethod
+    def from_ordered_vectors(cls, vectors):
+        """
+        Wrap unit vectors that are already in tree order, e.g. memory-mapped from a
+        file written in tree_order. Only nearest_position is available on such a tree.
+        """
+        tree = cls.__new__(cls)
+        tree._attach(vectors)
+        return tree
+
+    @classmethod
+    def tree_order(cls, vectors):
+        """
+        Returns:
+            np.ndarray: Permutation that arranges vectors in implicit tree order
+        """
+        order = np.arange(len(vectors))
+        cls._build(vectors, order, 0, len(order), 0)
+        return order
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @staticmethod
+    def _build(vectors, order, lo, hi, depth):
+        if hi - lo <= LEAF_SIZE:
+            return
+        axis = depth % 3
+        mid = (lo + hi) // 2
+        segment = order[lo:hi]
+        order[lo:hi] = segment[np.argpartition(vectors[segment, axis], mid - lo)]
+        SphereKDTree._build(vectors, order, lo, mid, depth + 1)
+        SphereKDTree._build(vectors, order, mid + 1, hi, depth + 1)
+
+    def _attach(self, vectors):
+        self.vectors = vectors
+        # Plain floats for the splitting points, whose per-node comparisons are too
+        # small to benefit from NumPy. Leaves are left in the (possibly mapped) array.
+        self._split_vectors = {}
+        pending = [(0, len(vectors))]
+        while pending:
+            lo, hi = pending.pop()
+            if hi - lo <= LEAF_SIZE:
+                continue
+            mid = (lo + hi) // 2
+            self._split_vectors[mid] = tuple(float(value) for value in vectors[mid])
+            pending.append((lo, mid))
+            pending.append((mid + 1, hi))
+
+    def nearest(self, latitude: float, longitude: float):
+        """
+        Find the indexed point closest to the given coordinates.
+
+        Returns:
+            tuple: ((latitude, longitude), chord_distance) of the nearest point,
+                   or (None, math.inf) if the tree is empty
+        """
+        position, chord = self.nearest_position(latitude, longitude)
+        if position is None:
+            return None, math.inf
+        return (float(self.latitudes[position]), float(self.longitudes[position])), chord
+
+    def nearest_position(self, latitude: float, longitude: float):
+        """
+        Returns:
+            tuple: (position in tree order, chord_distance) of the nearest point,
+                   or (None, math.inf) if the tree is empty
+        """
+        if not len(self):
+            return None, math.inf
+
+        position, squared = self._nearest_position(to_unit_vectors(latitude, longitude).tolist())
+        return position, math.sqrt(squared)
+
+    def nearest_many(self, latitudes, longitudes):
+        """
+        Find the nearest indexed point for each of many coordinates.
+
+        Returns:
+            tuple: (nearest latitudes, nearest longitudes) as arrays matching the input
+                   length, or None if the tree is empty
+        """
+        nearest = self.nearest_positions(latitudes, longitudes)
+        if nearest is None:
+            return None
+        positions, _ = nearest
+        return self.latitudes[positions], self.longitudes[positions]
+
+    def nearest_positions(self, latitudes, longitudes):
+        """
+        Batch version of nearest_position, also available on trees from from_ordered_vectors.
+
+        Returns:
+            tuple: (positions in tree order, chord distances) as arrays matching the
+                   input length, or None if the tree is empty
+        """
+        if not len(self):
+            return None
+
+        queries = to_unit_vectors(latitudes, longitudes).reshape(-1, 3)
+        if len(self) <= LEAF_SIZE:
+            # The whole tree is one leaf: for unit vectors the largest dot product
+            # is the smallest chord, so all queries resolve in one matrix product
+            dots = queries @ np.asarray(self.vectors, dtype=np.float64).T
+            positions = np.argmax(dots, axis=1)
+            closest = dots[np.arange(len(queries)), positions]
+            return positions, np.sqrt(np.maximum(2 - 2 * closest, 0))
+
+        nearest = [self._nearest_position(query) for query in queries.tolist()]
+        positions = np.fromiter((position for position, _ in nearest), dtype=np.intp, count=len(nearest))
+        squared = np.fromiter((squared for _, squared in nearest), dtype=np.float64, count=len(nearest))
+        return positions, np.sqrt(squared)
+
+    def _nearest_position(self, query):
+        best = [math.inf, -1]  # squared chord distance, position
+        self._search(query, 0, len(self), 0, best)
+        return best[1], best[0]
+
+    def _search(self, query, lo, hi, depth, best):
+        if hi - lo <= LEAF_SIZE:
+            squared = np.sum((self.vectors[lo:hi] - query) ** 2, axis=1)
+            closest = int(np.argmin(squared))
+            if squared[closest] < best[0]:
+                best[0], best[1] = float(squared[closest]), lo + closest
+            return
+
+        mid = (lo + hi) // 2
+        axis = depth % 3
+        split = self._split_vectors[mid]
+        qx, qy, qz = query
+        squared = (split[0] - qx) ** 2 + (split[1] - qy) ** 2 + (split[2] - qz) ** 2
+        if squared < best[0]:
+            best[0], best[1] = squared, mid
+
+        diff = query[axis] - split[axis]
+        if diff < 0:
+            near, far = (lo, mid), (mid + 1, hi)
+        else:
+            near, far = (mid + 1, hi), (lo, mid)
+
+        self._search(query, near[0], near[1], depth + 1, best)
+        # Only cross the splitting plane if it is closer than the best match so far
+        if diff * diff < best[0]:
+            self._search(query, far[0], far[1], depth + 1, best)
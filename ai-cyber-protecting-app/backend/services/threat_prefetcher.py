@@ -0,0 +1,240 @@
+"""
+Threat Prefetcher for AI Cyber Protecting App
+Refreshes the threat counts of recently active zipcodes before they expire, so
+user requests almost never find a cold or stale threat cache entry.
+"""
+import fcntl
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from services.config import gemini_enabled
+from services.threat_service import THREAT_CACHE_FRESH_SECONDS, get_threat_cache
+
+# Zipcodes seen within this window are kept warm
+PREFETCH_ACTIVE_SECONDS = float(os.getenv('PREFETCH_ACTIVE_SECONDS', 24 * 60 * 60))
+PREFETCH_MAX_ACTIVE_ZIPCODES = int(os.getenv('PREFETCH_MAX_ACTIVE_ZIPCODES', 5000))
+# Refresh this long before an entry stops being fresh
+PREFETCH_LEAD_SECONDS = float(os.getenv('PREFETCH_LEAD_SECONDS', 30 * 60))
+PREFETCH_INTERVAL_SECONDS = float(os.getenv('PREFETCH_INTERVAL_SECONDS', 30))
+PREFETCH_BATCH_SIZE = int(os.getenv('PREFETCH_BATCH_SIZE', 20))
+# Gemini quota guards: sustained refresh rate and refreshes in flight at once
+PREFETCH_RATE_PER_MINUTE = float(os.getenv('PREFETCH_RATE_PER_MINUTE', 30))
+PREFETCH_MAX_CONCURRENCY = int(os.getenv('PREFETCH_MAX_CONCURRENCY', 2))
+# Directory whose lock files cap refreshes in flight across every process using
+# it. server.py sets it, since each of its workers runs a prefetcher; when unset,
+# the cap is per process.
+PREFETCH_SLOTS_DIR = os.getenv('PREFETCH_SLOTS_DIR')
+
+class TokenBucket:
+    """Allows rate_per_second operations on average, in bursts of up to capacity."""
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+class ProcessSlots:
+    """
+    Up to count slots shared by all processes using the same directory.
+
+    A slot is an exclusive flock on one of count lock files. The kernel drops it
+    when its process exits, so a worker that crashes mid-refresh never keeps one.
+    """
+
+    def __init__(self, directory: str, count: int):
+        self.directory = directory
+        self.count = count
+        self._files = None
+        self._pid = None
+        self._held = set()
+
+    def _open(self):
+        # Locks on files opened before a fork would be shared with the parent
+        if self._pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self._files = [open(os.path.join(self.directory, f'slot-{slot}.lock'), 'a')
+                           for slot in range(self.count)]
+            self._pid = os.getpid()
+            self._held = set()
+        return self._files
+
+    def try_acquire(self):
+        """
+        Returns:
+            int: The slot taken, or None if every slot is in use
+        """
+        for slot, file in enumerate(self._open()):
+            if slot in self._held:
+                continue # flock would grant it again to this process
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            self._held.add(slot)
+            return slot
+        return None
+
+    def release(self, slot: int):
+        self._held.discard(slot)
+        fcntl.flock(self._files[slot], fcntl.LOCK_UN)
+
+class ThreatPrefetcher:
+    """
+    Keeps threat counts warm for active zipcodes.
+
+    Each tick, zipcodes that are missing from the threat cache or due to expire
+    within PREFETCH_LEAD_SECONDS join a queue, oldest due first. Up to
+    PREFETCH_BATCH_SIZE of them are then dispatched to the cache's background
+    loader, subject to the rate limit and the concurrency cap (per process, and
+    across processes if slots are given). Whatever isn't
+    dispatched waits for the next tick. A refresh that fails is queued again
+    with the time it first became due, so it keeps its place and its lag.
+    """
+
+    def __init__(self, cache, interval=PREFETCH_INTERVAL_SECONDS, slots=None):
+        """
+        Args:
+            slots (ProcessSlots): Refresh slots shared with other processes, if any
+        """
+        self.cache = cache
+        self.interval = interval
+        self.slots = slots
+        self._active = OrderedDict()  # zipcode -> last seen, least recently seen first
+        self._queue = OrderedDict()  # zipcode -> time its refresh became due
+        self._in_flight = 0
+        self._refreshed = 0
+        self._failed = 0
+        self._bucket = TokenBucket(PREFETCH_RATE_PER_MINUTE / 60, max(1, PREFETCH_BATCH_SIZE))
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def track(self, zip_code):
+        """Record that a request was just made from zip_code."""
+        with self._lock:
+            self._active[zip_code] = time.time()
+            self._active.move_to_end(zip_code)
+            while len(self._active) > PREFETCH_MAX_ACTIVE_ZIPCODES:
+                self._active.popitem(last=False)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="threat-prefetcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Threat prefetch failed: {e}")
+
+    def tick(self):
+        """Queue zipcodes that are due for a refresh and dispatch a batch of them."""
+        now = time.time()
+        with self._lock:
+            while self._active and next(iter(self._active.values())) < now - PREFETCH_ACTIVE_SECONDS:
+                self._active.popitem(last=False)
+            active = list(self._active.items())
+
+        for zip_code, last_seen in active:
+            age = self.cache.age(zip_code)
+            if age is None:
+                due_at = last_seen
+            else:
+                due_at = now - age + THREAT_CACHE_FRESH_SECONDS - PREFETCH_LEAD_SECONDS
+            if due_at <= now:
+                with self._lock:
+                    self._queue.setdefault(zip_code, due_at)
+
+        with self._lock:
+            queued = sorted(self._queue.items(), key=lambda item: item[1])
+
+        for zip_code, due_at in queued[:PREFETCH_BATCH_SIZE]:
+            with self._lock:
+                if self._in_flight >= PREFETCH_MAX_CONCURRENCY:
+                    break
+                slot = self.slots.try_acquire() if self.slots is not None else None
+                if self.slots is not None and slot is None:
+                    break # Other workers' refreshes use up the cap
+                if not self._bucket.try_acquire():
+                    if slot is not None:
+                        self.slots.release(slot)
+                    break
+                del self._queue[zip_code]
+                self._in_flight += 1
+            future = self.cache.refresh(zip_code)
+            if future is None:
+                # A request already triggered this refresh
+                with self._lock:
+                    self._release(slot)
+                continue
+            future.add_done_callback(partial(self._refresh_done, zip_code, due_at, slot))
+
+    def _release(self, slot):
+        self._in_flight -= 1
+        if slot is not None:
+            self.slots.release(slot)
+
+    def _refresh_done(self, zip_code, due_at, slot, future):
+        with self._lock:
+            self._release(slot)
+            if future.exception() is None:
+                self._refreshed += 1
+            else:
+                self._failed += 1
+                self._queue.setdefault(zip_code, due_at)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Active zipcodes, queue depth, refreshes in flight, done and failed, and lag,
+                  i.e. how many seconds the most overdue queued refresh has waited
+        """
+        now = time.time()
+        with self._lock:
+            oldest_due = min(self._queue.values(), default=None)
+            return {
+                "activeZipcodes": len(self._active),
+                "queueDepth": len(self._queue),
+                "inFlight": self._in_flight,
+                "refreshed": self._refreshed,
+                "failed": self._failed,
+                "lagSeconds": max(0.0, now - oldest_due) if oldest_due is not None else 0.0,
+            }
+
+_prefetcher = None
+
+def get_threat_prefetcher():
+    global _prefetcher
+    if _prefetcher is None:
+        slots = ProcessSlots(PREFETCH_SLOTS_DIR, PREFETCH_MAX_CONCURRENCY) if PREFETCH_SLOTS_DIR else None
+        _prefetcher = ThreatPrefetcher(get_threat_cache(), slots=slots)
+    return _prefetcher
+
+def track_active_zipcode(zip_code):
+    """Record that a security check was made from zip_code."""
+    get_threat_prefetcher().track(str(zip_code))
+
+def start_threat_prefetcher():
+    """Start refreshing active zipcodes' threat counts in the background, if Gemini is configured."""
+    if not gemini_enabled():
+        print("GEMINI_API_KEY is not set, threat intel prefetching is off.")
+        return
+    get_threat_prefetcher().start()
+
+def get_threat_prefetch_stats():
+    return get_threat_prefetcher().stats()
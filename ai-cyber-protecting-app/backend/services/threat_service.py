@@ -3,36 +3,45 @@ Threat Intelligence Service for AI Cyber Protecting App
 Provides criminal threat information based on geographic location.
 """
 import os
-from dotenv import load_dotenv
 
 import json
 from datetime import datetime
-import google.generativeai as genai
+
+from services.cache import SQLiteCacheStore, StaleWhileRevalidateCache
+from services.concurrency import get_background_executor
+from services.config import gemini_enabled
+from services.gemini_client import get_gemini_model
+from services.metrics import register_cache
+from services.tracing import traced
 
 # CityProtect uses this specific date format in their API requests
 DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 
-def get_cyber_threats_by_zip(zip_code: str) -> int:
-    """
-    Uses the Gemini API to generate a mock list of realistic cyber threats for a given zip code.
-    
-    Args:
-        zip_code (str): The user's zip code.
+# Threat counts are served from cache for THREAT_CACHE_FRESH_SECONDS, then served
+# stale for up to THREAT_CACHE_STALE_SECONDS more while a refresh runs. Entries are
+# also kept on disk so a restart doesn't send every zipcode back to Gemini.
+THREAT_CACHE_FRESH_SECONDS = float(os.getenv('THREAT_CACHE_FRESH_SECONDS', 6 * 60 * 60))
+THREAT_CACHE_STALE_SECONDS = float(os.getenv('THREAT_CACHE_STALE_SECONDS', 24 * 60 * 60))
+THREAT_CACHE_SIZE = int(os.getenv('THREAT_CACHE_SIZE', 10000))
+THREAT_CACHE_PATH = os.getenv('THREAT_CACHE_PATH', '../database/threat_cache.sqlite3')
 
-    Returns:
-        dict: A dictionary containing cyber threat data or an error message.
+# Shared Gemini model, configured on first use
+_threat_model = None
+_threat_cache = None
+
+def _get_threat_model():
     """
+    Raises:
+        RuntimeError: If Gemini is not configured
+    """
+    global _threat_model
+    if _threat_model is None:
+        _threat_model = get_gemini_model()
+    if _threat_model is None:
+        raise RuntimeError("Gemini is not configured, set GEMINI_API_KEY in your .env file")
+    return _threat_model
 
-    # --- Environment Variable Setup ---
-    # Make sure to add your GEMINI_API_KEY to your .env file
-    try:
-        load_dotenv()
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    except Exception as e:
-        print(f"Error configuring Gemini API: {e}. Please check your GEMINI_API_KEY.")
-        
-    model = genai.GenerativeModel('gemini-2.5-flash')
-    
+def _build_threat_prompt(zip_code: str) -> str:
     # Current date for context
     current_date = datetime.now()
 
@@ -65,13 +74,89 @@ def get_cyber_threats_by_zip(zip_code: str) -> int:
     Generate the JSON object for Zipcode {zip_code} now.
     """
 
+    return prompt
+
+def _parse_threat_response(response) -> int:
+    # Clean up the response to extract only the JSON part
+    json_text = response.text.strip().replace("```json", "").replace("```", "").strip()
+    threat_data = json.loads(json_text)
+    return len(threat_data.get("threats", []))
+
+def get_cyber_threats_by_zip(zip_code: str) -> int:
+    """
+    Uses the Gemini API to generate a mock list of realistic cyber threats for a given zip code.
+    
+    Args:
+        zip_code (str): The user's zip code.
+
+    Returns:
+        int: The number of recent threats, or 0 if Gemini failed or isn't configured.
+    """
     try:
-        response = model.generate_content(prompt)
-        # Clean up the response to extract only the JSON part
-        json_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        threat_data = json.loads(json_text)
-        return len(threat_data)
+        return fetch_threat_count(zip_code)
     except Exception as e:
         print(f"Error calling Gemini API or parsing its response: {e}")
         # {"error": "Failed to generate cyber threat data."}
-        return 0
\ No newline at end of file
+        return 0
+
+@traced('fetch_threat_count')
+def fetch_threat_count(zip_code: str) -> int:
+    """
+    Ask Gemini for the number of recent cyber threats in a zip code.
+
+    Raises:
+        Exception: If the call fails or the response can't be parsed
+    """
+    model = _get_threat_model()
+    prompt = _build_threat_prompt(zip_code)
+    response = model.generate_content(prompt)
+    return _parse_threat_response(response)
+
+def get_threat_cache():
+    """Return the zipcode threat cache, opening its on-disk layer on first use."""
+    global _threat_cache
+    if _threat_cache is None:
+        try:
+            store = SQLiteCacheStore(THREAT_CACHE_PATH, 'threat_counts')
+        except Exception as e:
+            print(f"Could not open threat cache database, caching in memory only: {e}")
+            store = None
+        _threat_cache = StaleWhileRevalidateCache(
+            fetch_threat_count, get_background_executor(),
+            THREAT_CACHE_FRESH_SECONDS, THREAT_CACHE_STALE_SECONDS, THREAT_CACHE_SIZE, store
+        )
+    return _threat_cache
+
+@traced('get_cached_threat_count')
+def get_cached_threat_count(zip_code: str):
+    """
+    Get the number of cyber threats for a zip code without waiting on Gemini.
+
+    Fresh and stale cached counts are returned at once; stale ones and misses
+    trigger a background refresh, unless Gemini isn't configured to do it.
+
+    Returns:
+        int: The threat count, or None if it isn't known yet
+    """
+    return get_threat_cache().get(str(zip_code), refresh=gemini_enabled())
+
+@traced('get_cached_threat_count')
+async def get_cached_threat_count_async(zip_code: str):
+    """Async version of get_cached_threat_count, which keeps the on-disk cache read off the event loop."""
+    return await get_threat_cache().get_async(str(zip_code), refresh=gemini_enabled())
+
+def get_stored_threat_count(zip_code: str):
+    """
+    Get the last known number of cyber threats for a zip code, however old,
+    without ever triggering a Gemini call. Meant for offline scoring.
+
+    Returns:
+        int: The threat count, or None if it was never fetched
+    """
+    return get_threat_cache().peek(str(zip_code))
+
+def get_threat_cache_stats():
+    """Return hit/miss counters for the zipcode threat cache."""
+    return get_threat_cache().stats()
+
+register_cache('threat', get_threat_cache_stats)
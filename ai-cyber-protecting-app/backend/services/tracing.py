@@ -0,0 +1,101 @@
+"""
+Tracing for AI Cyber Protecting App
+Per-request traces and per-stage latency histograms.
+
+Servers start a trace per request, and each stage the request goes through
+(request parsing, geocoding, whitelist check, network lookup, threat and LLM
+calls) runs inside a span, usually applied with the @traced decorator. Every span is observed in the
+stage_duration_seconds histogram and recorded on the current request's trace, and
+requests slower than TRACE_SLOW_REQUEST_SECONDS are logged with their stage
+breakdown. The current trace follows work handed to the shared pool (see
+services.concurrency) and to asyncio tasks, since both carry over contextvars.
+"""
+import contextvars
+import functools
+import inspect
+import os
+import time
+from contextlib import contextmanager
+
+from services.metrics import get_counter, get_histogram
+
+TRACE_SLOW_REQUEST_SECONDS = float(os.getenv('TRACE_SLOW_REQUEST_SECONDS', 1))
+
+REQUEST_LATENCY_METRIC = 'request_duration_seconds'
+REQUESTS_METRIC = 'requests_total'
+STAGE_LATENCY_METRIC = 'stage_duration_seconds'
+STAGE_FAILURES_METRIC = 'stage_failures_total'
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+class Trace:
+    """Timings of the stages one request went through."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.spans = []  # (stage, offset from request start, duration), in completion order
+
+    def add_span(self, stage: str, started: float, duration: float):
+        self.spans.append((stage, started - self.started, duration))
+
+    def describe(self):
+        return ', '.join(f"{stage} at +{offset * 1000:.1f}ms took {duration * 1000:.1f}ms"
+                         for stage, offset, duration in self.spans)
+
+def start_trace(endpoint: str):
+    """
+    Start tracing a request in the current context.
+
+    Returns:
+        tuple: (trace, token) to pass to finish_trace
+    """
+    trace = Trace(endpoint)
+    return trace, _current_trace.set(trace)
+
+def finish_trace(trace, token, status):
+    """
+    Record a request started with start_trace, and stop tracing it.
+
+    Args:
+        status: HTTP status code of the response
+    """
+    _current_trace.reset(token)
+    duration = time.perf_counter() - trace.started
+    get_histogram(REQUEST_LATENCY_METRIC, endpoint=trace.endpoint).observe(duration)
+    get_counter(REQUESTS_METRIC, endpoint=trace.endpoint, status=str(status)).inc()
+    if duration > TRACE_SLOW_REQUEST_SECONDS:
+        print(f"Slow request {trace.endpoint} took {duration * 1000:.1f}ms: {trace.describe()}")
+
+@contextmanager
+def span(stage: str):
+    """Time a stage of the current request, or of background work if there is none."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        get_counter(STAGE_FAILURES_METRIC, stage=stage).inc()
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        get_histogram(STAGE_LATENCY_METRIC, stage=stage).observe(duration)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(stage, started, duration)
+
+def traced(stage: str):
+    """Decorator running every call of a function, sync or async, in a span."""
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def traced_async(*args, **kwargs):
+                with span(stage):
+                    return await function(*args, **kwargs)
+            return traced_async
+
+        @functools.wraps(function)
+        def traced_sync(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return traced_sync
+    return decorate
@@ -0,0 +1,361 @@
+"""
+User Store for AI Cyber Protecting App
+Per-user configuration (alert email and safe locations) in an embedded SQLite
+database, and an LRU cache of per-user whitelist indexes built from it.
+
+The database runs in WAL mode and every thread gets its own connection, so
+checks keep reading while a configuration is being saved, in this process or
+in another worker. Each save bumps the user's version; a cached index built
+from an older version is rebuilt on next use.
+
+There are no accounts, so a configuration that would replace one with an alert
+email is only held until its owner confirms it with a code sent to that email.
+Every save issues the user a new token. Checks only use a user's safe locations
+and alert email when they present it, so a user id alone reveals nothing.
+"""
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from services.cache import SingleFlight, TTLCache
+from services.metrics import register_cache
+from services.spatial_index import SphereKDTree
+
+USER_STORE_PATH = os.getenv('USER_STORE_PATH', '../database/users.sqlite3')
+USER_MAX_SAFE_LOCATIONS = int(os.getenv('USER_MAX_SAFE_LOCATIONS', 50))
+
+# Per-user whitelist indexes kept in memory, least recently used evicted first
+USER_INDEX_CACHE_SIZE = int(os.getenv('USER_INDEX_CACHE_SIZE', 1000))
+USER_INDEX_CACHE_TTL_SECONDS = float(os.getenv('USER_INDEX_CACHE_TTL_SECONDS', 60 * 60))
+
+# How long a held configuration change waits for its confirmation code, and how
+# many wrong codes it takes before it can only expire
+USER_CONFIRMATION_TTL_SECONDS = float(os.getenv('USER_CONFIRMATION_TTL_SECONDS', 15 * 60))
+USER_CONFIRMATION_MAX_ATTEMPTS = int(os.getenv('USER_CONFIRMATION_MAX_ATTEMPTS', 5))
+
+class UserStore:
+    """SQLite store of each user's alert email and safe locations."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connect()
+        # WAL mode is a property of the database file, so setting it once covers every connection
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, alert_email TEXT, "
+                "version INTEGER NOT NULL, updated_at REAL NOT NULL, token_hash TEXT)"
+            )
+            # Databases created before tokens were issued
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(users)")]
+            if 'token_hash' not in columns:
+                connection.execute("ALTER TABLE users ADD COLUMN token_hash TEXT")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS safe_locations (user_id TEXT NOT NULL, position INTEGER NOT NULL, "
+                "label TEXT, latitude REAL NOT NULL, longitude REAL NOT NULL, PRIMARY KEY (user_id, position))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS pending_changes (user_id TEXT PRIMARY KEY, alert_email TEXT, "
+                "safe_locations TEXT NOT NULL, code_hash TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "attempts INTEGER NOT NULL)"
+            )
+
+    def _connect(self):
+        """
+        Return this thread's connection, opening it on first use. Connections are
+        never shared between threads, nor across a fork.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def save_user(self, user_id: str, alert_email: str, safe_locations, token_hash: str = None):
+        """
+        Replace a user's configuration.
+
+        Args:
+            safe_locations (list): (label, latitude, longitude) tuples
+            token_hash (str): Hash of the user's new token; None keeps the current one
+
+        Returns:
+            int: The user's new version
+        """
+        connection = self._connect()
+        with connection:
+            # Take the write lock up front so the version bump can't race another save
+            connection.execute("BEGIN IMMEDIATE")
+            return self._write_user(connection, user_id, alert_email, safe_locations, token_hash)
+
+    def _write_user(self, connection, user_id, alert_email, safe_locations, token_hash):
+        row = connection.execute("SELECT version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        version = row[0] + 1 if row else 1
+        connection.execute(
+            "INSERT INTO users (user_id, alert_email, version, updated_at, token_hash) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET alert_email = excluded.alert_email, version = excluded.version, "
+            "updated_at = excluded.updated_at, token_hash = COALESCE(excluded.token_hash, users.token_hash)",
+            (user_id, alert_email, version, time.time(), token_hash)
+        )
+        connection.execute("DELETE FROM safe_locations WHERE user_id = ?", (user_id,))
+        connection.executemany(
+            "INSERT INTO safe_locations (user_id, position, label, latitude, longitude) VALUES (?, ?, ?, ?, ?)",
+            [(user_id, position, *location) for position, location in enumerate(safe_locations)]
+        )
+        return version
+
+    def save_or_hold_user(self, user_id: str, alert_email: str, safe_locations, code_hash: str, expires_at: float,
+                          token_hash: str):
+        """
+        Save a user's configuration along with token_hash, unless it would replace
+        one with an alert email: then hold it until confirm_user is called with code_hash.
+
+        Returns:
+            str: The alert email the change has to be confirmed from, or None if it was saved
+        """
+        connection = self._connect()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT alert_email FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None or row[0] is None:
+                self._write_user(connection, user_id, alert_email, safe_locations, token_hash)
+                return None
+            # A new code replaces the last one, but not its wrong attempts, so
+            # asking for codes over and over gives no extra guesses
+            connection.execute(
+                "INSERT INTO pending_changes (user_id, alert_email, safe_locations, code_hash, expires_at, attempts) "
+                "VALUES (?, ?, ?, ?, ?, 0) ON CONFLICT (user_id) DO UPDATE SET alert_email = excluded.alert_email, "
+                "safe_locations = excluded.safe_locations, code_hash = excluded.code_hash, "
+                "expires_at = excluded.expires_at, "
+                "attempts = CASE WHEN pending_changes.expires_at > ? THEN pending_changes.attempts ELSE 0 END",
+                (user_id, alert_email, json.dumps(safe_locations), code_hash, expires_at, time.time())
+            )
+            return row[0]
+
+    def confirm_user(self, user_id: str, code_hash: str, token_hash: str):
+        """
+        Apply the change held for a user, along with token_hash, if code_hash is
+        the one it was held with.
+
+        Returns:
+            int: The user's new version, or None if the code is wrong, the change
+                 expired or too many wrong codes were tried
+        """
+        connection = self._connect()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT alert_email, safe_locations, code_hash, expires_at, attempts FROM pending_changes "
+                "WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            alert_email, safe_locations, expected_hash, expires_at, attempts = row
+            if expires_at <= time.time() or attempts >= USER_CONFIRMATION_MAX_ATTEMPTS:
+                return None
+            if not secrets.compare_digest(code_hash, expected_hash):
+                connection.execute("UPDATE pending_changes SET attempts = attempts + 1 WHERE user_id = ?", (user_id,))
+                return None
+            connection.execute("DELETE FROM pending_changes WHERE user_id = ?", (user_id,))
+            safe_locations = [tuple(location) for location in json.loads(safe_locations)]
+            return self._write_user(connection, user_id, alert_email, safe_locations, token_hash)
+
+    def get_token_hash(self, user_id: str):
+        """
+        Returns:
+            str: Hash of the token last issued to the user, or None if they were never issued one
+        """
+        row = self._connect().execute("SELECT token_hash FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_version(self, user_id: str):
+        """
+        Returns:
+            int: The user's version, or None if they never saved a configuration
+        """
+        row = self._connect().execute("SELECT version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_safe_locations(self, user_id: str):
+        """
+        Returns:
+            tuple: (version, list of (latitude, longitude)), or (None, []) for an unknown user
+        """
+        # One statement, so the version and the locations come from the same snapshot
+        rows = self._connect().execute(
+            "SELECT users.version, safe_locations.latitude, safe_locations.longitude FROM users "
+            "LEFT JOIN safe_locations ON safe_locations.user_id = users.user_id "
+            "WHERE users.user_id = ? ORDER BY safe_locations.position", (user_id,)
+        ).fetchall()
+        if not rows:
+            return None, []
+        return rows[0][0], [(latitude, longitude) for _, latitude, longitude in rows if latitude is not None]
+
+    def get_user(self, user_id: str):
+        """
+        Returns:
+            dict: userId, alertEmail and safeLocations, or None for an unknown user
+        """
+        connection = self._connect()
+        user = connection.execute("SELECT alert_email FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if user is None:
+            return None
+        locations = connection.execute(
+            "SELECT label, latitude, longitude FROM safe_locations WHERE user_id = ? ORDER BY position", (user_id,)
+        ).fetchall()
+        return {
+            "userId": user_id,
+            "alertEmail": user[0],
+            "safeLocations": [
+                {"label": label, "latitude": latitude, "longitude": longitude} for label, latitude, longitude in locations
+            ],
+        }
+
+# Opened on first use
+_user_store = None
+_user_store_lock = threading.Lock()
+
+_user_indexes = TTLCache(USER_INDEX_CACHE_SIZE, USER_INDEX_CACHE_TTL_SECONDS)  # user id -> (version, SphereKDTree)
+register_cache('user_whitelist_index', _user_indexes.stats)
+# Concurrent checks for a user whose index isn't loaded build it once
+_index_loads = SingleFlight()
+
+def get_user_store():
+    """
+    Return the user store, opening the database on first use.
+
+    Raises:
+        sqlite3.Error: If the database can't be opened
+    """
+    global _user_store
+    with _user_store_lock:
+        if _user_store is None:
+            _user_store = UserStore(USER_STORE_PATH)
+    return _user_store
+
+def normalize_user_id(user_id):
+    """User ids are emails or opaque strings; compare them case-insensitively."""
+    return user_id.strip().lower()
+
+def save_user_configuration(user_id: str, alert_email: str, safe_locations):
+    """
+    Save a user's configuration; their whitelist index is rebuilt on next use.
+    Replaces whatever the user saved before, so requests from clients should go
+    through request_user_configuration instead.
+
+    Args:
+        safe_locations (list): (label, latitude, longitude) tuples
+
+    Returns:
+        int: The user's new version
+    """
+    return get_user_store().save_user(normalize_user_id(user_id), alert_email, safe_locations)
+
+def _hash_confirmation_code(user_id, code):
+    return hashlib.sha256(f"{user_id}:{code}".encode()).hexdigest()
+
+def _hash_user_token(token):
+    # Tokens are random, so they need no salt
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def request_user_configuration(user_id: str, alert_email: str, safe_locations):
+    """
+    Save a user's configuration if they have none with an alert email yet.
+    Otherwise hold it for USER_CONFIRMATION_TTL_SECONDS, until
+    confirm_user_configuration is called with the code returned here, which
+    the caller must send to the user's current alert email only.
+
+    Args:
+        safe_locations (list): (label, latitude, longitude) tuples
+
+    Returns:
+        tuple: (confirmation code, alert email to send it to, None) if the change
+               is held, or (None, None, the user's new token) if it was saved
+    """
+    user_id = normalize_user_id(user_id)
+    code = f"{secrets.randbelow(10 ** 6):06d}"
+    token = secrets.token_urlsafe(32)
+    owner_email = get_user_store().save_or_hold_user(
+        user_id, alert_email, safe_locations, _hash_confirmation_code(user_id, code),
+        time.time() + USER_CONFIRMATION_TTL_SECONDS, _hash_user_token(token)
+    )
+    return (code, owner_email, None) if owner_email is not None else (None, None, token)
+
+def confirm_user_configuration(user_id: str, code: str):
+    """
+    Apply the configuration change held for a user by request_user_configuration.
+
+    Returns:
+        str: The user's new token, or None if the code is wrong or expired
+    """
+    user_id = normalize_user_id(user_id)
+    token = secrets.token_urlsafe(32)
+    version = get_user_store().confirm_user(user_id, _hash_confirmation_code(user_id, code), _hash_user_token(token))
+    return token if version is not None else None
+
+def authenticate_user(user_id: str, token: str):
+    """
+    Check that token is the one last issued to user_id, by request_user_configuration
+    or confirm_user_configuration. Earlier tokens of the user no longer pass.
+
+    Returns:
+        str: The normalized user id, or None if the token doesn't match (or the
+             store can't be read), in which case the caller must not use the
+             user's safe locations or alert email
+    """
+    user_id = normalize_user_id(user_id)
+    try:
+        token_hash = get_user_store().get_token_hash(user_id)
+    except sqlite3.Error as e:
+        print(f"Could not read token of user {user_id}: {e}")
+        return None
+    if token_hash is None or not secrets.compare_digest(token_hash, _hash_user_token(token)):
+        return None
+    return user_id
+
+def get_user_configuration(user_id: str):
+    """
+    Returns:
+        dict: userId, alertEmail and safeLocations, or None for an unknown user
+    """
+    return get_user_store().get_user(normalize_user_id(user_id))
+
+def _load_user_whitelist_index(user_id):
+    version, locations = get_user_store().get_safe_locations(user_id)
+    index = SphereKDTree(locations)
+    _user_indexes.set(user_id, (version, index))
+    return version, index
+
+def get_user_whitelist_index(user_id: str):
+    """
+    Return the spatial index over a user's safe locations, building it on first use
+    and again whenever they save a new configuration.
+
+    Returns:
+        SphereKDTree: The index, or None if the user has no saved safe locations
+                      (or the store can't be read), in which case callers fall back
+                      to the shared whitelist
+    """
+    user_id = normalize_user_id(user_id)
+    try:
+        version = get_user_store().get_version(user_id)
+        if version is None:
+            return None
+        cached = _user_indexes.get(user_id)
+        if cached is None or cached[0] != version:
+            cached = _index_loads.do(user_id, _load_user_whitelist_index, user_id)
+    except sqlite3.Error as e:
+        print(f"Could not read safe locations of user {user_id}: {e}")
+        return None
+    index = cached[1]
+    return index if len(index) else None
+
+def get_user_index_cache_stats():
+    """Return hit/miss counters for the per-user whitelist index cache."""
+    return _user_indexes.stats()
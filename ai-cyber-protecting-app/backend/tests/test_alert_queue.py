@@ -0,0 +1,159 @@
+"""
+Alert Queue Tests for AI Cyber Protecting App
+Batching, deduplication and retries of queued alert emails, driven by process().
+"""
+import pytest
+
+import services.alert_queue as alert_queue
+from services.alert_queue import ALERT_MAX_ATTEMPTS, AlertQueue, PreparedEmail
+from services.email_service import CONFIRMATION_SUBJECT, SUBJECT
+
+RISK_FACTORS = ("Location: 12.0km from the closest safe location",)
+
+class FakeClock:
+    """Stands in for the time module in services.alert_queue."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class FakeSender:
+    """Collects messages instead of sending them, failing the first `failures` sends."""
+
+    sender = "alerts@example.com"
+    sessions_opened = 0
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.sent = []
+
+    def send(self, message):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("SMTP server went away")
+        self.sent.append(message)
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(alert_queue, 'time', clock)
+    return clock
+
+def new_queue(sender, max_size=100):
+    recipients = {"ana": "ana@example.com", "bob": "bob@example.com"}
+    return AlertQueue(sender, resolve_recipient=recipients.get, window_seconds=10, dedupe_seconds=60,
+                      max_size=max_size)
+
+def test_alerts_within_the_window_go_out_as_one_email(clock):
+    sender = FakeSender()
+    alerts = new_queue(sender)
+    alerts.enqueue("ana", 37.2296, -80.4139, RISK_FACTORS)
+    alerts.process()
+    clock.advance(5)
+    alerts.enqueue("ana", 38.8951, -77.0364, RISK_FACTORS)
+    alerts.process()
+    assert sender.sent == []
+
+    clock.advance(5)
+    alerts.process()
+
+    assert len(sender.sent) == 1
+    assert sender.sent[0]['To'] == "ana@example.com"
+    assert sender.sent[0]['Subject'] == SUBJECT
+    assert alerts.stats()["emailsSent"] == 1
+    assert alerts.stats()["pendingBatches"] == 0
+
+def test_users_get_separate_emails_and_unknown_users_none(clock):
+    sender = FakeSender()
+    alerts = new_queue(sender)
+    for user_id in ("ana", "bob", "carol"):
+        alerts.enqueue(user_id, 37.2296, -80.4139, RISK_FACTORS)
+
+    alerts.process()
+    clock.advance(10)
+    alerts.process()
+
+    assert sorted(message['To'] for message in sender.sent) == ["ana@example.com", "bob@example.com"]
+
+def test_repeated_alerts_are_merged_and_not_resent(clock):
+    sender = FakeSender()
+    alerts = new_queue(sender)
+    alerts.enqueue("ana", 37.2296, -80.4139, RISK_FACTORS)
+    alerts.enqueue("ana", 37.22961, -80.41391, RISK_FACTORS)  # Same place, to ALERT_LOCATION_PRECISION
+    alerts.process()
+    clock.advance(10)
+    alerts.process()
+    assert alerts.stats()["deduplicated"] == 1
+
+    clock.advance(30)
+    alerts.enqueue("ana", 37.2296, -80.4139, RISK_FACTORS)
+    alerts.process()
+    clock.advance(10)
+    alerts.process()
+    assert len(sender.sent) == 1
+    assert alerts.stats()["deduplicated"] == 2
+
+    clock.advance(60)  # Past dedupe_seconds
+    alerts.enqueue("ana", 37.2296, -80.4139, RISK_FACTORS)
+    alerts.process()
+    clock.advance(10)
+    alerts.process()
+    assert len(sender.sent) == 2
+
+def test_failed_sends_are_retried_with_backoff(clock):
+    sender = FakeSender(failures=2)
+    alerts = new_queue(sender)
+    alerts.enqueue("ana", 37.2296, -80.4139, RISK_FACTORS)
+    alerts.process()
+
+    clock.advance(10)
+    alerts.process()
+    assert alerts.stats()["retries"] == 1
+    clock.advance(alert_queue.ALERT_RETRY_BASE_SECONDS)
+    alerts.process()
+    assert alerts.stats()["retries"] == 2
+    clock.advance(alert_queue.ALERT_RETRY_BASE_SECONDS * 2)
+    alerts.process()
+
+    assert len(sender.sent) == 1
+    assert alerts.stats()["failed"] == 0
+
+def test_sends_are_given_up_after_max_attempts(clock):
+    sender = FakeSender(failures=ALERT_MAX_ATTEMPTS)
+    alerts = new_queue(sender)
+    alerts.enqueue("ana", 37.2296, -80.4139, RISK_FACTORS)
+    alerts.process()
+
+    for _ in range(ALERT_MAX_ATTEMPTS):
+        clock.advance(alert_queue.ALERT_RETRY_MAX_SECONDS)
+        alerts.process()
+
+    assert sender.sent == []
+    assert alerts.stats()["failed"] == 1
+    assert alerts.stats()["pendingBatches"] == 0
+
+def test_prepared_emails_go_out_without_waiting_for_a_batch(clock):
+    sender = FakeSender()
+    alerts = new_queue(sender)
+
+    alerts.enqueue_email(PreparedEmail("ana@example.com", CONFIRMATION_SUBJECT, "Your code is 123456",
+                                       "<p>Your code is 123456</p>", "confirmation code for user ana"))
+    alerts.process()
+
+    assert len(sender.sent) == 1
+    assert sender.sent[0]['Subject'] == CONFIRMATION_SUBJECT
+
+def test_full_queue_drops_alerts(clock):
+    alerts = new_queue(FakeSender(), max_size=1)
+
+    assert alerts.enqueue("ana", 37.2296, -80.4139, RISK_FACTORS)
+    assert not alerts.enqueue("bob", 37.2296, -80.4139, RISK_FACTORS)
+    assert alerts.stats()["dropped"] == 1
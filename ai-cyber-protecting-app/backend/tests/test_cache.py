@@ -0,0 +1,236 @@
+"""
+Cache Tests for AI Cyber Protecting App
+TTL/LRU expiry and eviction, the shared SQLite second level stale-while-revalidate refreshes and single-flight loads.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+import services.cache as cache
+from services.cache import SQLiteCacheStore, SingleFlight, StaleWhileRevalidateCache, TTLCache
+
+class FakeClock:
+    """Stands in for the time module in services.cache, moved forward by hand."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache, 'time', clock)
+    return clock
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteCacheStore(str(tmp_path / 'cache.sqlite3'), 'entries')
+
+def test_ttl_cache_expires_entries(clock):
+    ttl_cache = TTLCache(10, ttl_seconds=60)
+    ttl_cache.set('a', 1)
+
+    clock.advance(59)
+    assert ttl_cache.get('a') == 1
+    clock.advance(2)
+    assert ttl_cache.get('a') is None
+    assert ttl_cache.get('a', 'default') == 'default'
+
+def test_ttl_cache_evicts_least_recently_used(clock):
+    ttl_cache = TTLCache(2, ttl_seconds=60)
+    ttl_cache.set('a', 1)
+    ttl_cache.set('b', 2)
+    ttl_cache.get('a')  # b is now the least recently used
+    ttl_cache.set('c', 3)
+
+    assert ttl_cache.get('a') == 1
+    assert ttl_cache.get('b') is None
+    assert ttl_cache.get('c') == 3
+    assert len(ttl_cache) == 2
+
+def test_ttl_cache_counts_hits_and_misses(clock):
+    ttl_cache = TTLCache(10, ttl_seconds=60)
+    ttl_cache.set('a', 1)
+    ttl_cache.get('a')
+    ttl_cache.get('b')
+
+    stats = ttl_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hitRate"]) == (1, 1, 0.5)
+
+def test_ttl_cache_shares_entries_through_store(clock, store):
+    writer = TTLCache(10, ttl_seconds=60, store=store)
+    reader = TTLCache(10, ttl_seconds=60, store=store)
+    writer.set('a', {"postcode": "24502"})
+
+    assert reader.get('a') == {"postcode": "24502"}
+    assert reader.stats()["sharedHits"] == 1
+
+def test_ttl_cache_ignores_expired_store_entries(clock, store):
+    TTLCache(10, ttl_seconds=60, store=store).set('a', 1)
+    clock.advance(61)
+
+    assert TTLCache(10, ttl_seconds=60, store=store).get('a') is None
+
+def test_ttl_cache_async_reads_and_writes_store(clock, store):
+    writer = TTLCache(10, ttl_seconds=60, store=store)
+    reader = TTLCache(10, ttl_seconds=60, store=store)
+
+    async def roundtrip():
+        await writer.set_async('a', [1, 2])
+        return await reader.get_async('a'), await reader.get_async('b', 'default')
+
+    assert asyncio.run(roundtrip()) == ([1, 2], 'default')
+
+class InlineExecutor:
+    """Runs submitted loads right away, or holds them until run_pending if paused."""
+
+    def __init__(self, paused=False):
+        self.paused = paused
+        self.pending = []
+
+    def submit(self, function, *args):
+        future = Future()
+        self.pending.append((future, function, args))
+        if not self.paused:
+            self.run_pending()
+        return future
+
+    def run_pending(self):
+        pending, self.pending = self.pending, []
+        for future, function, args in pending:
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+class CountingLoader:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, key):
+        self.calls.append(key)
+        return f"{key}-{len(self.calls)}"
+
+def swr_cache(loader, executor, store=None):
+    return StaleWhileRevalidateCache(loader, executor, fresh_seconds=60, stale_seconds=300, max_size=10, store=store)
+
+def test_swr_miss_loads_in_background_and_returns_none(clock):
+    loader = CountingLoader()
+    executor = InlineExecutor(paused=True)
+    swr = swr_cache(loader, executor)
+
+    assert swr.get('24502') is None
+    assert loader.calls == []  # The caller didn't wait on the loader
+    executor.run_pending()
+    assert swr.get('24502') == '24502-1'
+
+def test_swr_serves_stale_value_while_refreshing(clock):
+    loader = CountingLoader()
+    swr = swr_cache(loader, InlineExecutor())
+    swr.get('a')
+
+    clock.advance(61)
+    assert swr.get('a') == 'a-1'  # Stale, served as is; the refresh lands for the next call
+    assert swr.get('a') == 'a-2'
+    assert swr.stats()["staleHits"] == 1
+
+def test_swr_drops_values_past_the_stale_window(clock):
+    loader = CountingLoader()
+    swr = swr_cache(loader, InlineExecutor(paused=True))
+    swr.refresh('a')
+    swr.executor.run_pending()
+
+    clock.advance(361)
+    assert swr.get('a') is None
+
+def test_swr_runs_one_load_per_key_at_a_time(clock):
+    loader = CountingLoader()
+    executor = InlineExecutor(paused=True)
+    swr = swr_cache(loader, executor)
+
+    assert swr.refresh('a') is not None
+    assert swr.refresh('a') is None
+    swr.get('a')
+    executor.run_pending()
+    assert loader.calls == ['a']
+
+def test_swr_get_without_refresh_never_loads(clock):
+    loader = CountingLoader()
+    swr = swr_cache(loader, InlineExecutor())
+
+    assert swr.get('a', refresh=False) is None
+    assert loader.calls == []
+
+def test_swr_refresh_future_raises_loader_error(clock):
+    def failing_loader(key):
+        raise RuntimeError("Gemini is down")
+
+    swr = swr_cache(failing_loader, InlineExecutor())
+
+    with pytest.raises(RuntimeError):
+        swr.refresh('a').result()
+    assert swr.peek('a') is None
+    assert swr.refresh('a') is not None  # A failed load doesn't block the next one
+
+def test_swr_picks_up_entries_another_process_stored(clock, store):
+    loader = CountingLoader()
+    first = swr_cache(loader, InlineExecutor(), store)
+    second = swr_cache(loader, InlineExecutor(), store)
+    first.refresh('a')
+
+    assert second.get('a') == 'a-1'
+    assert second.age('a') == 0
+    assert loader.calls == ['a']
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'index'
+
+    with ThreadPoolExecutor(4) as pool:
+        leader = pool.submit(single_flight.do, 'whitelist', load)
+        started.wait(5)
+        followers = [pool.submit(single_flight.do, 'whitelist', load) for _ in range(3)]
+        time.sleep(0.05)  # Let the followers reach the call in flight
+        release.set()
+        results = [leader.result(5)] + [future.result(5) for future in followers]
+
+    assert results == ['index'] * 4
+    assert calls == [1]
+    assert single_flight.do('whitelist', lambda: 'next') == 'next'  # Finished calls aren't cached
+
+def test_single_flight_shares_the_leaders_exception():
+    single_flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def load():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("database is locked")
+
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(single_flight.do, 'whitelist', load)
+        started.wait(5)
+        follower = pool.submit(single_flight.do, 'whitelist', load)
+        time.sleep(0.05)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(RuntimeError):
+                future.result(5)
@@ -0,0 +1,140 @@
+"""
+Circuit Breaker Tests for AI Cyber Protecting App
+Opening on a failure rate, half-open trials and background health probes.
+"""
+import threading
+import time
+
+import pytest
+
+import services.circuit_breaker as circuit_breaker
+from services.circuit_breaker import CircuitBreaker
+
+class FakeClock:
+    """Stands in for the time module in services.circuit_breaker."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit_breaker, 'time', clock)
+    return clock
+
+def new_breaker(probe=None):
+    return CircuitBreaker('gemini', probe=probe, failure_rate_threshold=0.5,
+                          minimum_calls=4, window_seconds=30, open_seconds=15)
+
+def open_breaker(breaker):
+    for _ in range(4):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+def wait_for_probe(breaker):
+    """The probe thread sets the state just after the probe returns."""
+    deadline = time.time() + 5
+    while breaker.state == CircuitBreaker.HALF_OPEN and time.time() < deadline:
+        time.sleep(0.01)
+
+def test_breaker_waits_for_minimum_calls_before_opening(clock):
+    breaker = new_breaker()
+    for _ in range(3):
+        breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+def test_breaker_opens_at_failure_rate_and_rejects_calls(clock):
+    breaker = new_breaker()
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()  # 2 of 4 failed
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.stats()["failureRate"] == 0.5
+
+def test_breaker_forgets_calls_outside_the_window(clock):
+    breaker = new_breaker()
+    for _ in range(3):
+        breaker.record_failure()
+    clock.advance(31)
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["recentCalls"] == 1
+
+def test_half_open_trial_call_closes_on_success(clock):
+    breaker = new_breaker()
+    open_breaker(breaker)
+    clock.advance(15)
+
+    assert breaker.allow_request()  # The trial call
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()  # Only one at a time
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["recentCalls"] == 1
+
+def test_half_open_trial_call_reopens_on_failure(clock):
+    breaker = new_breaker()
+    open_breaker(breaker)
+    clock.advance(15)
+    breaker.allow_request()
+
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    clock.advance(15)
+    assert breaker.allow_request()
+
+@pytest.mark.parametrize("healthy, state", [(True, CircuitBreaker.CLOSED), (False, CircuitBreaker.OPEN)])
+def test_probe_runs_in_background_and_decides_state(clock, healthy, state):
+    probed = threading.Event()
+
+    def probe():
+        probed.set()
+        return healthy
+
+    breaker = new_breaker(probe)
+    open_breaker(breaker)
+    clock.advance(15)
+
+    assert not breaker.allow_request()  # Callers keep failing fast while the probe runs
+    assert probed.wait(5)
+    wait_for_probe(breaker)
+    assert breaker.state == state
+
+def test_probe_errors_count_as_unhealthy(clock):
+    done = threading.Event()
+
+    def probe():
+        done.set()
+        raise ConnectionError("refused")
+
+    breaker = new_breaker(probe)
+    open_breaker(breaker)
+    clock.advance(15)
+    breaker.allow_request()
+    assert done.wait(5)
+    wait_for_probe(breaker)
+
+    assert breaker.state == CircuitBreaker.OPEN
+
+def test_breakers_are_shared_per_upstream():
+    first = circuit_breaker.get_circuit_breaker('test-upstream')
+
+    assert circuit_breaker.get_circuit_breaker('test-upstream') is first
+    assert circuit_breaker.get_circuit_breaker_stats()['test-upstream']["state"] == CircuitBreaker.CLOSED
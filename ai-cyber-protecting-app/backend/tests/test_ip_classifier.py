@@ -0,0 +1,102 @@
+"""
+IP Classifier Tests for AI Cyber Protecting App
+Longest-prefix matching, the shipped network ranges table and the ASN prefix updater.
+"""
+import ipaddress
+import os
+
+import pytest
+
+import services.network_ranges_updater as updater
+from services.ip_classifier import IPClassifier, PrefixTrie
+from services.network_service import NETWORK_TYPE
+
+NETWORK_RANGES = os.path.join(os.path.dirname(__file__), '..', '..', 'database', 'network_ranges')
+
+def address(ip_address):
+    return int(ipaddress.ip_address(ip_address))
+
+def test_prefix_trie_returns_longest_matching_prefix():
+    trie = PrefixTrie(32)
+    trie.insert(ipaddress.ip_network('10.0.0.0/8'), 'wide')
+    trie.insert(ipaddress.ip_network('10.1.0.0/16'), 'narrow')
+    trie.insert(ipaddress.ip_network('10.1.2.3/32'), 'host')
+
+    assert trie.lookup(address('10.9.9.9')) == 'wide'
+    assert trie.lookup(address('10.1.9.9')) == 'narrow'
+    assert trie.lookup(address('10.1.2.3')) == 'host'
+    assert trie.lookup(address('11.0.0.0')) is None
+
+def test_prefix_trie_default_route_matches_everything():
+    trie = PrefixTrie(32)
+    trie.insert(ipaddress.ip_network('0.0.0.0/0'), 'default')
+
+    assert trie.lookup(address('203.0.113.7')) == 'default'
+
+def test_classifier_keeps_ipv4_and_ipv6_rules_apart():
+    classifier = IPClassifier([('10.0.0.0/8', 'v4'), ('fc00::/7', 'v6'), ('AS15169', 'google')])
+
+    assert classifier.classify_ip('10.2.3.4') == 'v4'
+    assert classifier.classify_ip('fd12::1') == 'v6'
+    assert classifier.classify_ip('::a00:1') is None  # 10.0.0.1's bits, but IPv6
+    assert classifier.classify_ip('not an address') is None
+    assert classifier.classify_asn(15169) == 'google'
+    assert classifier.classify_asn(1) is None
+
+def test_from_file_maps_values_and_skips_comments(tmp_path):
+    table = tmp_path / 'ranges'
+    table.write_text("# Private\n\n192.168.0.0/16 | Residential/Private Network\nAS13335|VPN/Proxy Network\n")
+
+    classifier = IPClassifier.from_file(str(table), NETWORK_TYPE)
+
+    assert classifier.classify_ip('192.168.1.20') == NETWORK_TYPE["Residential/Private Network"]
+    assert classifier.classify_asn(13335) == NETWORK_TYPE["VPN/Proxy Network"]
+
+def test_from_file_rejects_unknown_network_types(tmp_path):
+    table = tmp_path / 'ranges'
+    table.write_text("192.168.0.0/16|Home\n")
+
+    with pytest.raises(ValueError, match="Home"):
+        IPClassifier.from_file(str(table), NETWORK_TYPE)
+
+@pytest.mark.parametrize("ip_address, network_type", [
+    ('192.168.0.10', "Residential/Private Network"),
+    ('73.45.12.9', "Residential/Private Network"),       # Comcast
+    ('8.8.8.8', "VPN/Proxy Network"),                     # Google
+    ('1.1.1.1', "VPN/Proxy Network"),                     # Cloudflare
+    ('3.14.15.92', "VPN/Proxy Network"),                  # AWS
+    ('2600:1f00::1', "VPN/Proxy Network"),                # AWS over IPv6
+    ('2607:fb90::1', "Untrusted/Unknown Public Network"), # T-Mobile
+])
+def test_shipped_table_classifies_public_and_private_addresses(ip_address, network_type):
+    classifier = IPClassifier.from_file(NETWORK_RANGES, NETWORK_TYPE)
+
+    assert classifier.classify_ip(ip_address) == NETWORK_TYPE[network_type]
+
+def test_updater_merges_announced_prefixes_and_skips_listed_ones(tmp_path, monkeypatch):
+    table = tmp_path / 'ranges'
+    table.write_text("# Hand-written\n203.0.113.0/25|VPN/Proxy Network\nAS64500|VPN/Proxy Network\nAS64501|Residential/Private Network\n")
+    announced = {
+        64500: ['198.51.100.0/25', '198.51.100.128/25', '203.0.113.0/25'],
+        64501: ['198.51.100.0/25', '192.0.2.0/24'],  # The first prefix is AS64500's already
+    }
+    monkeypatch.setattr(updater, 'fetch_announced_prefixes',
+                        lambda asn: [ipaddress.ip_network(prefix) for prefix in announced[asn]])
+
+    lines, asns, cidrs = updater.read_rules(str(table))
+    rules = updater.generate_rules(asns, cidrs)
+
+    assert asns == {64500: "VPN/Proxy Network", 64501: "Residential/Private Network"}
+    assert sorted(rules) == ["192.0.2.0/24|Residential/Private Network", "198.51.100.0/24|VPN/Proxy Network"]
+
+    # Running it twice replaces the generated section instead of appending another
+    updater.write_rules(str(table), lines, rules)
+    lines, _, _ = updater.read_rules(str(table))
+    updater.write_rules(str(table), lines, rules)
+    text = table.read_text()
+    assert text.count(updater.GENERATED_BEGIN) == 1
+    assert text.startswith("# Hand-written\n203.0.113.0/25|VPN/Proxy Network\n")
+
+    classifier = IPClassifier.from_file(str(table), NETWORK_TYPE)
+    assert classifier.classify_ip('198.51.100.200') == NETWORK_TYPE["VPN/Proxy Network"]
+    assert classifier.classify_ip('192.0.2.1') == NETWORK_TYPE["Residential/Private Network"]
@@ -0,0 +1,118 @@
+"""
+Location Service Tests for AI Cyber Protecting App
+Checks the vectorized Haversine engine and the KD-tree index against scalar and brute-force results.
+"""
+import math
+
+import numpy as np
+import pytest
+
+from services.location_service import (
+    SAFE_LOCATION_RADIUS_KM, calculate_distance, calculate_distance_matrix, calculate_distances,
+    check_location_is_whitelisted,
+)
+from services.spatial_index import LEAF_SIZE, SphereKDTree, chord_to_km, to_unit_vectors
+
+TOLERANCE_KM = 1e-6
+
+def random_coordinates(rng, count):
+    return rng.uniform(-90, 90, count), rng.uniform(-180, 180, count)
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(7)
+
+def test_calculate_distances_matches_scalar(rng):
+    latitudes, longitudes = random_coordinates(rng, 2000)
+    # Identical, near-identical and antipodal pairs, where rounding matters most
+    latitudes = np.concatenate((latitudes, [37.3521, 37.3521 + 1e-7, -37.3521]))
+    longitudes = np.concatenate((longitudes, [-79.1754, -79.1754, 100.8246]))
+
+    expected = [calculate_distance(37.3521, -79.1754, latitude, longitude)
+                for latitude, longitude in zip(latitudes, longitudes)]
+    distances = calculate_distances(37.3521, -79.1754, latitudes, longitudes)
+
+    assert distances.shape == latitudes.shape
+    np.testing.assert_allclose(distances, expected, rtol=0, atol=TOLERANCE_KM)
+
+def test_calculate_distances_pairs_broadcast(rng):
+    latitudes1, longitudes1 = random_coordinates(rng, 100)
+    latitudes2, longitudes2 = random_coordinates(rng, 100)
+
+    expected = [calculate_distance(*pair) for pair in zip(latitudes1, longitudes1, latitudes2, longitudes2)]
+
+    np.testing.assert_allclose(calculate_distances(latitudes1, longitudes1, latitudes2, longitudes2),
+                               expected, rtol=0, atol=TOLERANCE_KM)
+
+def test_calculate_distance_matrix_matches_scalar(rng):
+    latitudes1, longitudes1 = random_coordinates(rng, 7)
+    latitudes2, longitudes2 = random_coordinates(rng, 11)
+
+    matrix = calculate_distance_matrix(latitudes1, longitudes1, latitudes2, longitudes2)
+
+    assert matrix.shape == (7, 11)
+    for row, (latitude1, longitude1) in enumerate(zip(latitudes1, longitudes1)):
+        for column, (latitude2, longitude2) in enumerate(zip(latitudes2, longitudes2)):
+            assert matrix[row, column] == pytest.approx(
+                calculate_distance(latitude1, longitude1, latitude2, longitude2), abs=TOLERANCE_KM
+            )
+
+def brute_force_nearest(sites, latitude, longitude):
+    distances = [calculate_distance(latitude, longitude, *site) for site in sites]
+    closest = int(np.argmin(distances))
+    return sites[closest], distances[closest]
+
+# One leaf, and a tree deep enough to prune branches
+@pytest.mark.parametrize("size", [LEAF_SIZE // 2, 5000])
+def test_nearest_matches_brute_force(rng, size):
+    sites = list(zip(*random_coordinates(rng, size)))
+    tree = SphereKDTree(sites)
+
+    for latitude, longitude in zip(*random_coordinates(rng, 200)):
+        expected_site, expected_km = brute_force_nearest(sites, latitude, longitude)
+        site, chord = tree.nearest(latitude, longitude)
+
+        assert chord_to_km(chord) == pytest.approx(expected_km, abs=1e-6)
+        # Ties aside, it is the same site
+        assert calculate_distance(latitude, longitude, *site) == pytest.approx(expected_km, abs=1e-6)
+
+@pytest.mark.parametrize("size", [LEAF_SIZE // 2, 5000])
+def test_nearest_many_matches_nearest(rng, size):
+    tree = SphereKDTree(list(zip(*random_coordinates(rng, size))))
+    latitudes, longitudes = random_coordinates(rng, 300)
+
+    nearest_latitudes, nearest_longitudes = tree.nearest_many(latitudes, longitudes)
+    positions, chords = tree.nearest_positions(latitudes, longitudes)
+
+    for index, (latitude, longitude) in enumerate(zip(latitudes, longitudes)):
+        site, chord = tree.nearest(latitude, longitude)
+        assert (nearest_latitudes[index], nearest_longitudes[index]) == site
+        assert chords[index] == pytest.approx(chord, abs=1e-9)
+        assert (tree.latitudes[positions[index]], tree.longitudes[positions[index]]) == site
+
+def test_nearest_on_ordered_vectors_matches_tree(rng):
+    sites = list(zip(*random_coordinates(rng, 1000)))
+    vectors = to_unit_vectors(*zip(*sites))
+    ordered = SphereKDTree.from_ordered_vectors(vectors[SphereKDTree.tree_order(vectors)])
+    tree = SphereKDTree(sites)
+
+    for latitude, longitude in zip(*random_coordinates(rng, 50)):
+        _, chord = tree.nearest(latitude, longitude)
+        assert ordered.nearest_position(latitude, longitude)[1] == pytest.approx(chord, abs=1e-12)
+
+def test_empty_tree():
+    tree = SphereKDTree([])
+
+    assert tree.nearest(10, 20) == (None, math.inf)
+    assert tree.nearest_many([10], [20]) is None
+    assert tree.nearest_positions([10], [20]) is None
+
+def test_check_location_is_whitelisted_with_index():
+    index = SphereKDTree([(37.3521, -79.1754), (40.7128, -74.0060)])
+
+    is_safe, distance = check_location_is_whitelisted(37.3521, -79.1754, index=index)
+    assert is_safe and distance == pytest.approx(0, abs=1e-6)
+
+    # About 1km north of the first site
+    is_safe, distance = check_location_is_whitelisted(37.3611, -79.1754, index=index)
+    assert not is_safe and distance > SAFE_LOCATION_RADIUS_KM
@@ -0,0 +1,57 @@
+"""
+Offline Geocoder Tests for AI Cyber Protecting App
+Compiling a postcode centroid table and looking points up in it.
+"""
+import pytest
+
+from services.offline_geocoder import OfflineGeocoder, compile_postcode_table
+
+# GeoNames postal code dump columns: country, postcode, place, state, ..., latitude, longitude
+CENTROIDS = [
+    ("US", "24060", "Blacksburg", "Virginia", 37.2296, -80.4139),
+    ("US", "24502", "Lynchburg", "Virginia", 37.3521, -79.1754),
+    ("US", "20001", "Washington", "District of Columbia", 38.9101, -77.0147),
+    ("DE", "10115", "Berlin", "Berlin", 52.5323, 13.3846),
+]
+
+@pytest.fixture
+def geocoder(tmp_path):
+    csv_path = tmp_path / 'postcodes.txt'
+    csv_path.write_text("".join(
+        f"{country}\t{postcode}\t{place}\t{state}\t\t\t\t\t\t{latitude}\t{longitude}\t4\n"
+        for country, postcode, place, state, latitude, longitude in CENTROIDS
+    ))
+    table_path = tmp_path / 'postcode_centroids.bin'
+    assert compile_postcode_table(str(csv_path), str(table_path)) == len(CENTROIDS)
+    return OfflineGeocoder(str(table_path))
+
+def test_lookup_returns_the_closest_centroids_address(geocoder):
+    address = geocoder.lookup(37.24, -80.40, max_distance_km=25)
+
+    assert address == {
+        'housenumber': None, 'street': None, 'state': "Virginia", 'country': None,
+        'country_code': "US", 'postcode': "24060",
+    }
+    assert geocoder.lookup(52.52, 13.40, max_distance_km=25)['postcode'] == "10115"
+
+def test_lookup_gives_up_past_max_distance(geocoder):
+    assert geocoder.lookup(0.0, 0.0, max_distance_km=25) is None
+
+def test_lookup_postcodes_matches_lookup_point_by_point(geocoder):
+    # The first two points are closest to Blacksburg, but only the first is within range
+    latitudes = [37.24, 37.23, 38.90, 36.0]
+    longitudes = [-80.40, -81.00, -77.02, -80.41]
+
+    postcodes = geocoder.lookup_postcodes(latitudes, longitudes, max_distance_km=25)
+
+    assert postcodes == ["24060", None, "20001", None]
+    for latitude, longitude, postcode in zip(latitudes, longitudes, postcodes):
+        address = geocoder.lookup(latitude, longitude, max_distance_km=25)
+        assert (address['postcode'] if address else None) == postcode
+
+def test_rejects_files_that_are_not_compiled_tables(tmp_path):
+    path = tmp_path / 'not_a_table.bin'
+    path.write_bytes(b'\0' * 64)
+
+    with pytest.raises(ValueError):
+        OfflineGeocoder(str(path))
@@ -0,0 +1,105 @@
+"""
+Request Validation Tests for AI Cyber Protecting App
+Payload parsing shared by the Flask and ASGI backends.
+"""
+import pytest
+
+from services.request_validation import (
+    BATCH_MAX_RECORDS, USER_ID_MAX_LENGTH, parse_batch_records, parse_confirmation, parse_coordinates, parse_session,
+    parse_user_config, parse_user_credentials, parse_user_id,
+)
+from services.user_store import USER_MAX_SAFE_LOCATIONS
+
+def test_parse_coordinates_accepts_numbers_and_numeric_strings():
+    assert parse_coordinates({"latitude": 37.2, "longitude": "-80.4"}) == ((37.2, -80.4), None)
+    assert parse_coordinates({"latitude": -90, "longitude": 180}) == ((-90.0, 180.0), None)
+
+@pytest.mark.parametrize("data, error", [
+    (None, "No JSON data provided"),
+    ({}, "No JSON data provided"),
+    ([37.2, -80.4], "JSON body must be an object"),
+    ("37.2,-80.4", "JSON body must be an object"),
+    ({"latitude": 37.2}, "Missing required fields: latitude and longitude"),
+    ({"latitude": "north", "longitude": 1}, "Invalid latitude or longitude format"),
+    ({"latitude": [1], "longitude": 1}, "Invalid latitude or longitude format"),
+    ({"latitude": "nan", "longitude": 1}, "Invalid latitude or longitude format"),
+    ({"latitude": 1, "longitude": "inf"}, "Invalid latitude or longitude format"),
+    ({"latitude": 90.5, "longitude": 0}, "Latitude must be within [-90, 90] and longitude within [-180, 180]"),
+    ({"latitude": 0, "longitude": -181}, "Latitude must be within [-90, 90] and longitude within [-180, 180]"),
+])
+def test_parse_coordinates_rejects_invalid_payloads(data, error):
+    assert parse_coordinates(data) == (None, error)
+
+def test_parse_batch_records_flags_bad_records_without_failing_the_batch():
+    records, error = parse_batch_records({"records": [
+        {"latitude": 1, "longitude": 2, "ip": "8.8.8.8"},
+        {"latitude": 1, "longitude": 2},
+        {"latitude": 1, "longitude": 2, "ip": "8.8.8"},
+        {"latitude": 100, "longitude": 2},
+        "1,2",
+    ]})
+
+    assert error is None
+    assert records == [
+        ((1.0, 2.0), "8.8.8.8", None),
+        ((1.0, 2.0), None, None),
+        (None, "8.8.8", "Invalid ip format"),
+        (None, None, "Latitude must be within [-90, 90] and longitude within [-180, 180]"),
+        (None, None, "Invalid record format"),
+    ]
+
+@pytest.mark.parametrize("data, error", [
+    ({"records": "all"}, "Missing required field: records"),
+    ({"records": [{}] * (BATCH_MAX_RECORDS + 1)}, f"Too many records: at most {BATCH_MAX_RECORDS} per batch"),
+    ([{"latitude": 1, "longitude": 2}], "JSON body must be an object"),
+])
+def test_parse_batch_records_rejects_invalid_batches(data, error):
+    assert parse_batch_records(data) == (None, error)
+
+@pytest.mark.parametrize("data, user_id", [
+    ({"userId": "ana@example.com"}, "ana@example.com"),
+    ({"userId": "   "}, None),
+    ({"userId": 42}, None),
+    ({"userId": "a" * (USER_ID_MAX_LENGTH + 1)}, None),
+    (["ana@example.com"], None),
+])
+def test_parse_user_id(data, user_id):
+    assert parse_user_id(data) == user_id
+
+@pytest.mark.parametrize("data, credentials", [
+    ({"userId": "ana@example.com", "userToken": "t0k3n"}, ("ana@example.com", "t0k3n")),
+    ({"userId": "ana@example.com"}, (None, None)),
+    ({"userToken": "t0k3n"}, (None, None)),
+    ({"userId": "ana@example.com", "userToken": ""}, (None, None)),
+    ({"userId": "ana@example.com", "userToken": 12345}, (None, None)),
+    ({"userId": "ana@example.com", "userToken": "t" * 129}, (None, None)),
+])
+def test_parse_user_credentials_needs_both_id_and_token(data, credentials):
+    assert parse_user_credentials(data) == credentials
+
+def test_parse_session_keeps_only_string_revisions():
+    assert parse_session({"sessionId": "s1", "revision": "r3"}) == ("s1", "r3")
+    assert parse_session({"sessionId": "s1", "revision": 3}) == ("s1", None)
+    assert parse_session({"revision": "r3"}) == (None, None)
+
+def test_parse_user_config_defaults_user_id_to_the_2fa_email():
+    data = {"2faEmail": "ana@example.com", "homeAddresses": ["1|Main St|Blacksburg|VA|24060"]}
+
+    assert parse_user_config(data) == (("ana@example.com", "ana@example.com", ["1|Main St|Blacksburg|VA|24060"]), None)
+    assert parse_user_config(dict(data, userId="ana"))[0][0] == "ana"
+
+@pytest.mark.parametrize("data, error", [
+    ({"homeAddresses": []}, "Missing required field: 2faEmail"),
+    ({"2faEmail": "ana"}, "Invalid 2faEmail format"),
+    ({"2faEmail": "ana@example.com", "homeAddresses": "1|Main St"}, "Invalid homeAddresses format"),
+    ({"2faEmail": "ana@example.com", "homeAddresses": ["  "]}, "Invalid homeAddresses format"),
+    ({"2faEmail": "ana@example.com", "homeAddresses": ["x"] * (USER_MAX_SAFE_LOCATIONS + 1)},
+     f"Too many homeAddresses: at most {USER_MAX_SAFE_LOCATIONS}"),
+])
+def test_parse_user_config_rejects_invalid_payloads(data, error):
+    assert parse_user_config(data) == (None, error)
+
+def test_parse_confirmation():
+    assert parse_confirmation({"userId": "ana", "confirmationCode": " 123456 "}) == (("ana", "123456"), None)
+    assert parse_confirmation({"confirmationCode": "123456"}) == (None, "Missing required field: userId")
+    assert parse_confirmation({"userId": "ana"}) == (None, "Missing required field: confirmationCode")
@@ -0,0 +1,133 @@
+"""
+Risk Engine Tests for AI Cyber Protecting App
+Zones, scoring, skipping settled factors, lazy inputs and rules validation.
+"""
+import os
+
+import pytest
+
+import services.risk_factors  # Registers the built-in risk factors
+from services.network_service import NETWORK_TYPE
+from services.risk_engine import FactorInputs, LazyInput, RiskRules
+
+RISK_RULES = os.path.join(os.path.dirname(__file__), '..', '..', 'database', 'risk_rules.json')
+
+ZONES = [{"name": "Green", "maxScore": 0}, {"name": "Yellow", "maxScore": 5}, {"name": "Red"}]
+
+def rules(*factors, zones=ZONES):
+    return RiskRules({"zones": zones, "factors": list(factors)})
+
+def location(points=2, actions=("Turn on the VPN",)):
+    return {"factor": "location", "points": points, "actions": list(actions)}
+
+def network(points=4, actions=("Find a new work location",)):
+    return {"factor": "network", "points": points, "actions": list(actions),
+            "goodNetworkTypes": ["Untrusted/Unknown Public Network"]}
+
+def threat(points=5, actions=("Find a new work location",)):
+    return {"factor": "threat", "points": points, "actions": list(actions)}
+
+class Counted:
+    """Input function that counts how often it was computed."""
+
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+def test_zones_follow_max_scores():
+    risk_rules = rules()
+
+    assert [risk_rules.zone(score) for score in (0, 1, 5, 6, 100)] == ["Green", "Yellow", "Yellow", "Red", "Red"]
+
+def test_score_adds_points_and_actions_of_bad_factors():
+    # A wide Yellow zone, so the threat factor could still reach Red and runs too
+    zones = [{"name": "Green", "maxScore": 0}, {"name": "Yellow", "maxScore": 10}, {"name": "Red"}]
+    risk_rules = rules(location(), network(actions=("Turn on the VPN", "Find a new work location")), threat(),
+                       zones=zones)
+    inputs = FactorInputs(whitelist=(False, 12.3), network_type=NETWORK_TYPE["VPN/Proxy Network"], threat_count=0)
+
+    assessment = risk_rules.score(inputs)
+
+    assert assessment["score"] == 6
+    assert assessment["zone"] == "Yellow"
+    assert [status for status, _ in assessment["reasons"]] == ["Bad", "Bad", "Good"]
+    assert assessment["actions"] == ["Turn on the VPN", "Find a new work location"]  # Not repeated
+
+def test_unknown_factors_add_no_points():
+    risk_rules = rules(network(), threat())
+    inputs = FactorInputs(network_type=NETWORK_TYPE["Unknown Network"], threat_count=None)
+
+    assessment = risk_rules.score(inputs)
+
+    assert assessment["score"] == 0
+    assert [status for status, _ in assessment["reasons"]] == ["Unknown", "Unknown"]
+
+def test_factors_run_cheapest_first():
+    risk_rules = rules(threat(), network(), location())
+
+    assert [factor.name for factor, _ in risk_rules.factors] == ["location", "network", "threat"]
+
+def test_settled_factors_are_skipped_without_reading_their_inputs():
+    # Location and network already reach Red, which the threat factor can't change
+    risk_rules = rules(location(points=2), network(points=4), threat())
+    threat_count = Counted(3)
+    inputs = FactorInputs(whitelist=(False, 40.0), network_type=NETWORK_TYPE["VPN/Proxy Network"],
+                          threat_count=LazyInput(threat_count))
+
+    assessment = risk_rules.score(inputs)
+
+    assert assessment["zone"] == "Red"
+    assert len(assessment["reasons"]) == 2
+    assert threat_count.calls == 0
+
+def test_lazy_inputs_are_computed_once():
+    inputs = FactorInputs(threat_count=LazyInput(Counted(2)))
+    counted = dict.__getitem__(inputs, "threat_count").function
+
+    assert inputs["threat_count"] == 2
+    assert inputs["threat_count"] == 2
+    assert counted.calls == 1
+
+def test_evaluate_waits_for_missing_inputs_then_resumes():
+    risk_rules = rules(location(), threat())
+    assessment, done = risk_rules.new_assessment(), set()
+
+    first = list(risk_rules.evaluate(assessment, FactorInputs(whitelist=(True, 0.2)), done))
+    assert len(first) == 1
+    assert not risk_rules.is_complete(done)
+
+    second = list(risk_rules.evaluate(assessment, FactorInputs(threat_count=4), done))
+    assert second == [(["Bad", "Threats: 'There are 4 active cyber threats in your area."], ["Find a new work location"])]
+    assert risk_rules.is_complete(done)
+    assert assessment["zone"] == "Yellow"
+
+def test_evaluate_completes_once_missing_inputs_cannot_matter():
+    risk_rules = rules(location(points=6), threat())
+    assessment, done = risk_rules.new_assessment(), set()
+
+    list(risk_rules.evaluate(assessment, FactorInputs(whitelist=(False, 9.0)), done))
+
+    assert assessment["zone"] == "Red"
+    assert risk_rules.is_complete(done)
+
+@pytest.mark.parametrize("config, message", [
+    ({"zones": [{"name": "Green", "maxScore": 0}], "factors": []}, "no maxScore"),
+    ({"zones": [{"name": "Green", "maxScore": 5}, {"name": "Yellow", "maxScore": 5}, {"name": "Red"}],
+      "factors": []}, "higher maxScore"),
+    ({"zones": ZONES, "factors": [{"factor": "weather"}]}, "Unknown risk factor"),
+    ({"zones": ZONES, "factors": [location(points=-1)]}, "negative points"),
+    ({"zones": ZONES, "factors": [dict(network(), goodNetworkTypes=["Home"])]}, "Unknown network type"),
+])
+def test_invalid_rules_are_rejected(config, message):
+    with pytest.raises(ValueError, match=message):
+        RiskRules(config)
+
+def test_shipped_rules_compile():
+    risk_rules = RiskRules.from_file(RISK_RULES)
+
+    assert {factor.name for factor, _ in risk_rules.factors} == {"location", "network", "threat"}
+    assert risk_rules.zone(0) == "Green"
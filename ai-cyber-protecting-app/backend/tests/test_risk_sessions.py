@@ -0,0 +1,108 @@
+"""
+Risk Session Tests for AI Cyber Protecting App
+Session ownership, reuse of unchanged lookups between polls and delta responses.
+"""
+import pytest
+
+import services.risk_sessions as risk_sessions
+from services.network_service import NETWORK_TYPE
+from services.risk_sessions import get_risk_session
+
+# The first entry of database/whitelisted_locations
+SAFE_LATITUDE, SAFE_LONGITUDE = 37.3521, -79.1754
+
+class Lookups:
+    """Answers the session's upstream lookups from fixed values, counting each one."""
+
+    def __init__(self):
+        self.network_types = {}
+        self.postcode = '24502'
+        self.threat_count = 0
+        self.calls = {"network": 0, "geocode": 0, "threats": 0}
+
+    def network_type(self, ip):
+        self.calls["network"] += 1
+        return self.network_types.get(ip, NETWORK_TYPE["Untrusted/Unknown Public Network"])
+
+    def location_context(self, latitude, longitude):
+        self.calls["geocode"] += 1
+        return {'postcode': self.postcode}
+
+    def threats(self, postcode):
+        self.calls["threats"] += 1
+        return self.threat_count
+
+@pytest.fixture
+def lookups(monkeypatch):
+    lookups = Lookups()
+    # Served as cache hits, so no stage waits on the shared pool
+    monkeypatch.setattr(risk_sessions, 'get_cached_network_info', lookups.network_type)
+    monkeypatch.setattr(risk_sessions, 'get_cached_location_context', lookups.location_context)
+    monkeypatch.setattr(risk_sessions, 'lookup_threat_count', lookups.threats)
+    monkeypatch.setattr(risk_sessions, 'track_active_zipcode', lambda zipcode: None)
+    return lookups
+
+def test_unknown_session_ids_start_a_new_session():
+    session = get_risk_session(None, '203.0.113.7')
+
+    assert get_risk_session(session.session_id, '203.0.113.7') is session
+    assert get_risk_session('made-up', '203.0.113.7').session_id != 'made-up'
+
+def test_sessions_only_serve_their_owner():
+    session = get_risk_session(None, '203.0.113.7')
+    user_session = get_risk_session(None, '203.0.113.7', 'Ana@Example.com')
+
+    assert get_risk_session(session.session_id, '198.51.100.1') is not session
+    assert get_risk_session(user_session.session_id, '198.51.100.1', 'ana@example.com') is user_session
+    assert get_risk_session(user_session.session_id, '203.0.113.7') is not user_session
+
+def test_delta_returns_only_changed_fields_for_the_current_revision():
+    session = get_risk_session(None, '203.0.113.7')
+
+    first = session.delta({"zone": "Green", "score": 0})
+    assert first["full"] and first["zone"] == "Green"
+
+    unchanged = session.delta({"zone": "Green", "score": 0}, first["revision"])
+    assert unchanged == {"sessionId": session.session_id, "revision": first["revision"], "full": False}
+
+    changed = session.delta({"zone": "Yellow", "score": 2}, unchanged["revision"])
+    assert changed["revision"] != first["revision"]
+    assert {name: changed[name] for name in ("full", "zone", "score")} == {"full": False, "zone": "Yellow", "score": 2}
+
+    stale = session.delta({"zone": "Yellow", "score": 2}, first["revision"])
+    assert stale["full"] and stale["zone"] == "Yellow"
+
+def test_polls_reuse_lookups_whose_inputs_did_not_change(lookups):
+    session = get_risk_session(None, '203.0.113.7')
+
+    assessment = session.assess(SAFE_LATITUDE, SAFE_LONGITUDE, '203.0.113.7')
+    assert assessment["zone"] == "Green"
+    assert lookups.calls == {"network": 1, "geocode": 1, "threats": 1}
+
+    assert session.assess(SAFE_LATITUDE, SAFE_LONGITUDE, '203.0.113.7') == assessment
+    assert lookups.calls == {"network": 1, "geocode": 1, "threats": 1}
+
+    session.assess(SAFE_LATITUDE, SAFE_LONGITUDE, '198.51.100.1')  # New network only
+    assert lookups.calls == {"network": 2, "geocode": 1, "threats": 1}
+
+def test_threats_are_not_looked_up_once_the_zone_is_settled(lookups):
+    lookups.network_types['203.0.113.7'] = NETWORK_TYPE["VPN/Proxy Network"]
+    session = get_risk_session(None, '203.0.113.7')
+
+    assert session.assess(SAFE_LATITUDE + 1, SAFE_LONGITUDE, '203.0.113.7')["zone"] == "Red"
+    assert lookups.calls["threats"] == 0
+
+    # The first check geocoded up front; once in another cell, the next one doesn't
+    assert session.assess(SAFE_LATITUDE + 2, SAFE_LONGITUDE, '203.0.113.7')["zone"] == "Red"
+    assert lookups.calls == {"network": 1, "geocode": 1, "threats": 0}
+
+def test_new_threat_counts_change_the_zone_on_the_next_poll(lookups, monkeypatch):
+    session = get_risk_session(None, '203.0.113.7')
+    session.assess(SAFE_LATITUDE, SAFE_LONGITUDE, '203.0.113.7')
+
+    # Remembered inputs are looked up again once they are too old
+    monkeypatch.setattr(risk_sessions, 'SESSION_INPUT_MAX_AGE_SECONDS', -1)
+    lookups.threat_count = 3
+
+    assert session.assess(SAFE_LATITUDE, SAFE_LONGITUDE, '203.0.113.7')["zone"] == "Yellow"
+    assert lookups.calls["threats"] == 2
@@ -0,0 +1,138 @@
+"""
+User Store Tests for AI Cyber Protecting App
+Tokens, confirmed replacements, schema migration and per-user whitelist indexes.
+"""
+import sqlite3
+
+import pytest
+
+import services.user_store as user_store
+from services.cache import TTLCache
+from services.user_store import (
+    USER_CONFIRMATION_MAX_ATTEMPTS, USER_CONFIRMATION_TTL_SECONDS, UserStore, authenticate_user,
+    confirm_user_configuration, get_user_configuration, get_user_whitelist_index, request_user_configuration,
+    save_user_configuration,
+)
+
+HOME = [("Home", 37.2296, -80.4139)]
+OFFICE = [("Office", 38.8951, -77.0364)]
+
+class FakeClock:
+    """Stands in for the time module in services.user_store."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = UserStore(str(tmp_path / 'users.sqlite3'))
+    monkeypatch.setattr(user_store, '_user_store', store)
+    monkeypatch.setattr(user_store, '_user_indexes', TTLCache(10, 60))
+    return store
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(user_store, 'time', clock)
+    return clock
+
+def configure(user_id, alert_email, safe_locations):
+    """Save a first configuration and return its token."""
+    code, owner_email, token = request_user_configuration(user_id, alert_email, safe_locations)
+    assert code is None and owner_email is None
+    return token
+
+def test_first_configuration_is_saved_with_a_token(store):
+    token = configure("Ana@Example.com ", "ana@example.com", HOME)
+
+    assert authenticate_user("ana@example.com", token) == "ana@example.com"
+    assert authenticate_user("ana@example.com", token + "x") is None
+    assert authenticate_user("bob@example.com", token) is None
+    assert get_user_configuration("ana@example.com")["safeLocations"] == [
+        {"label": "Home", "latitude": 37.2296, "longitude": -80.4139}
+    ]
+
+def test_replacement_is_held_until_confirmed_from_the_current_email(store):
+    first_token = configure("ana", "ana@example.com", HOME)
+
+    code, owner_email, token = request_user_configuration("ana", "mallory@example.com", OFFICE)
+
+    assert owner_email == "ana@example.com"
+    assert token is None
+    assert get_user_configuration("ana")["alertEmail"] == "ana@example.com"
+
+    new_token = confirm_user_configuration("ana", code)
+
+    assert new_token is not None
+    assert get_user_configuration("ana")["alertEmail"] == "mallory@example.com"
+    assert authenticate_user("ana", new_token) == "ana"
+    assert authenticate_user("ana", first_token) is None  # Rotated
+    assert confirm_user_configuration("ana", code) is None  # Used up
+
+def test_confirmation_stops_after_too_many_wrong_codes(store):
+    configure("ana", "ana@example.com", HOME)
+    code, _, _ = request_user_configuration("ana", "ana@example.com", OFFICE)
+    wrong = f"{(int(code) + 1) % 10 ** 6:06d}"
+
+    for _ in range(USER_CONFIRMATION_MAX_ATTEMPTS):
+        assert confirm_user_configuration("ana", wrong) is None
+    assert confirm_user_configuration("ana", code) is None
+
+    # A new code doesn't reset the attempts while the change is still held
+    code, _, _ = request_user_configuration("ana", "ana@example.com", OFFICE)
+    assert confirm_user_configuration("ana", code) is None
+
+def test_held_change_expires(store, clock):
+    configure("ana", "ana@example.com", HOME)
+    code, _, _ = request_user_configuration("ana", "ana@example.com", OFFICE)
+
+    clock.advance(USER_CONFIRMATION_TTL_SECONDS)
+
+    assert confirm_user_configuration("ana", code) is None
+    assert get_user_configuration("ana")["safeLocations"][0]["label"] == "Home"
+
+def test_server_side_save_keeps_the_token(store):
+    token = configure("ana", "ana@example.com", HOME)
+
+    save_user_configuration("ana", "ana@example.com", OFFICE)
+
+    assert authenticate_user("ana", token) == "ana"
+    assert store.get_version("ana") == 2
+
+def test_old_databases_gain_the_token_column(tmp_path):
+    path = str(tmp_path / 'users.sqlite3')
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute("CREATE TABLE users (user_id TEXT PRIMARY KEY, alert_email TEXT, "
+                           "version INTEGER NOT NULL, updated_at REAL NOT NULL)")
+        connection.execute("INSERT INTO users VALUES ('ana', 'ana@example.com', 3, 0)")
+    connection.close()
+
+    store = UserStore(path)
+
+    assert store.get_token_hash('ana') is None
+    assert store.get_version('ana') == 3
+    assert store.save_user('ana', 'ana@example.com', HOME, token_hash='abc') == 4
+    assert store.get_token_hash('ana') == 'abc'
+
+def test_whitelist_index_is_rebuilt_after_a_new_save(store):
+    assert get_user_whitelist_index("ana") is None
+
+    save_user_configuration("ana", None, HOME)
+    index = get_user_whitelist_index("ana")
+    assert len(index) == 1
+    assert get_user_whitelist_index("ANA") is index  # Cached
+
+    save_user_configuration("ana", None, HOME + OFFICE)
+    assert len(get_user_whitelist_index("ana")) == 2
+
+def test_whitelist_index_is_none_without_safe_locations(store):
+    save_user_configuration("ana", None, [])
+
+    assert get_user_whitelist_index("ana") is None
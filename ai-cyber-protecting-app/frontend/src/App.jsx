@@ -47,7 +47,8 @@ function App() {
     setSecurityStatus(null);
 
     try {
-      const response = await fetch(`${API_BASE_URL}/api/check-security`, {
+      // Stream the assessment so each risk factor renders as soon as it is scored
+      const response = await fetch(`${API_BASE_URL}/api/check-security/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -55,7 +56,10 @@ function App() {
         body: JSON.stringify({
           latitude,
           longitude,
-          homeAddresses
+          homeAddresses,
+          // Checks against the safe locations saved with /api/configure-user
+          userId: localStorage.getItem('userId') || undefined,
+          userToken: localStorage.getItem('userToken') || undefined
         }),
       });
 
@@ -64,8 +68,44 @@ function App() {
         throw new Error(errorData.error || `HTTP ${response.status}: ${response.statusText}`);
       }
 
-      const data = await response.json();
-      setSecurityStatus(data);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let status = { score: 0, zone: 'Green', reasons: [], actions: [], suggestedLocations: [] };
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const event = JSON.parse(line);
+
+          if (event.type === 'error') {
+            throw new Error(event.error);
+          } else if (event.type === 'factor') {
+            status = {
+              ...status,
+              score: event.score,
+              zone: event.zone,
+              reasons: [...status.reasons, event.reason],
+              actions: [...status.actions, ...event.actions]
+            };
+          } else if (event.type === 'suggestedLocations') {
+            status = { ...status, suggestedLocations: event.suggestedLocations };
+          } else if (event.type === 'summary') {
+            const { type, ...summary } = event;
+            status = summary;
+          }
+
+          setSecurityStatus(status);
+          setIsLoading(false);
+        }
+      }
 
     } catch (err) {
       console.error('Security check failed:', err);
@@ -4,7 +4,7 @@ import React from 'react';
  * LocationAnalysis - Component to display location analysis results
  * Displays reasons, actions, and suggested locations based on security assessment
  * Reasons structure: [["Status", "Description"], ...]
- * Status can be "Good" or "Bad"
+ * Status can be "Good", "Bad" or "Unknown" (the factor could not be checked)
  */
 const LocationAnalysis = ({ analysisData }) => {
   if (!analysisData) return null;
@@ -14,6 +14,7 @@ const LocationAnalysis = ({ analysisData }) => {
   // Filter and separate good and bad reasons
   const badReasons = reasons.filter(reason => Array.isArray(reason) && reason[0] === "Bad").map(reason => reason[1]);
   const goodReasons = reasons.filter(reason => Array.isArray(reason) && reason[0] === "Good").map(reason => reason[1]);
+  const unknownReasons = reasons.filter(reason => Array.isArray(reason) && reason[0] === "Unknown").map(reason => reason[1]);
   
   // Filter out empty actions
   const validActions = actions.filter(action => action && action.trim() !== "");
@@ -21,7 +22,7 @@ const LocationAnalysis = ({ analysisData }) => {
   return (
     <div className="space-y-6">
       {/* Security Assessment Section */}
-      {(badReasons.length > 0 || goodReasons.length > 0) && (
+      {(badReasons.length > 0 || goodReasons.length > 0 || unknownReasons.length > 0) && (
         <div className="bg-gradient-to-br from-commuter-card/90 to-commuter-surface/50 border border-commuter-surface/30 rounded-2xl p-6 backdrop-blur-xl shadow-2xl">
           <div className="flex items-center mb-4">
             <div className={`w-10 h-10 rounded-lg flex items-center justify-center mr-3 ${
@@ -62,6 +63,20 @@ const LocationAnalysis = ({ analysisData }) => {
                 </div>
               </div>
             ))}
+
+            {/* Unknown Reasons */}
+            {unknownReasons.map((reason, index) => (
+              <div key={`unknown-${index}`} className="bg-gradient-to-r from-commuter-surface/30 to-commuter-surface/10 border border-commuter-surface/20 rounded-xl p-4">
+                <div className="flex items-start">
+                  <div className="flex-shrink-0 mr-3 mt-1">
+                    <div className="w-6 h-6 bg-commuter-surface/40 rounded-full flex items-center justify-center">
+                      <span className="text-xs text-commuter-muted">?</span>
+                    </div>
+                  </div>
+                  <p className="text-commuter-muted text-sm leading-relaxed">{reason}</p>
+                </div>
+              </div>
+            ))}
           </div>
         </div>
       )}
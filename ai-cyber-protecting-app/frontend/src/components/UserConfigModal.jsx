@@ -47,7 +47,7 @@ const UserConfigModal = ({ isOpen, onClose, onSave }) => {
       };
 
       // Call the backend API
-      const response = await fetch('http://localhost:5000/api/configure-user', {
+      let response = await fetch('http://localhost:5000/api/configure-user', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -55,12 +55,28 @@ const UserConfigModal = ({ isOpen, onClose, onSave }) => {
         body: JSON.stringify(configData),
       });
 
+      // Changing a saved configuration takes the code sent to its current 2FA email
+      if (response.status === 202) {
+        const { userId } = await response.json();
+        const confirmationCode = window.prompt('Enter the confirmation code sent to your current 2FA email');
+        response = await fetch('http://localhost:5000/api/configure-user/confirm', {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({ userId, confirmationCode: confirmationCode || '' }),
+        });
+      }
+
       if (response.ok) {
         const result = await response.json();
         
         // Save to localStorage only if backend succeeds
         localStorage.setItem('userHomeAddresses', JSON.stringify(homeAddresses));
         localStorage.setItem('user2FAEmail', twoFAEmail);
+        // Security checks send these to prove they are for this user
+        localStorage.setItem('userId', result.userId);
+        localStorage.setItem('userToken', result.userToken);
         
         // Dispatch custom event to notify other components
         window.dispatchEvent(new CustomEvent('configurationUpdated'));